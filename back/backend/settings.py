@@ -15,12 +15,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'partners',
 ]
 
 MIDDLEWARE = [
+    'partners.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -29,6 +31,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'partners.replicas.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -51,16 +54,43 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'game_partners_platform',
-        'USER': 'postgres',
-        'PASSWORD': '12345',
-        'HOST': 'localhost',
-        'PORT': '5432',
-    }
+# Соединения с Postgres. DB_POOL=1 включает пул psycopg 3: соединения живут
+# в пуле процесса и выдаются запросам без TCP-рукопожатия и аутентификации.
+# Без пула DB_CONN_MAX_AGE - сколько секунд держать соединение между запросами
+# (0 - новое на каждый запрос). DB_HEALTH_CHECKS проверяет соединение перед
+# повторным использованием (и в пуле, и у постоянных соединений)
+DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+DB_CONNECTION = {
+    'ENGINE': 'django.db.backends.postgresql',
+    'NAME': os.environ.get('DB_NAME', 'game_partners_platform'),
+    'USER': os.environ.get('DB_USER', 'postgres'),
+    'PASSWORD': os.environ.get('DB_PASSWORD', '12345'),
+    'HOST': os.environ.get('DB_HOST', 'localhost'),
+    'PORT': os.environ.get('DB_PORT', '5432'),
+    'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+    'CONN_HEALTH_CHECKS': os.environ.get('DB_HEALTH_CHECKS', '1') == '1',
+    'OPTIONS': {},
 }
+if DB_POOL:
+    DB_CONNECTION['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    }
+
+DATABASES = {'default': DB_CONNECTION}
+
+# Реплики для чтения: DB_REPLICA_HOSTS=host1,host2:5433. Безопасные запросы
+# к viewset'ам читают с реплик (partners.replicas), остальное - с основной базы
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DB_CONNECTION, 'HOST': host, 'PORT': port or DB_CONNECTION['PORT'], 'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['partners.replicas.ReplicaRouter']
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -101,5 +131,48 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
-}
\ No newline at end of file
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'partners.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Брокер событий WebSocket (partners.realtime); в памяти процесса по умолчанию
+REALTIME_BROKER = os.environ.get('REALTIME_BROKER', 'partners.realtime.InMemoryBroker')
+
+# Фоновые задачи (partners.tasks): потоки процесса по умолчанию,
+# partners.tasks.ImmediateBackend выполняет задачи синхронно
+TASK_BACKEND = os.environ.get('TASK_BACKEND', 'partners.tasks.ThreadQueueBackend')
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 2))
+# manage.py test выполняет задачи синхронно (partners.testing.TestRunner)
+TEST_RUNNER = 'partners.testing.TestRunner'
+
+# Авторы с таким числом подписчиков не раскладываются по лентам при публикации,
+# их посты подмешиваются в ленту при чтении (partners.feed)
+FEED_FANOUT_LIMIT = int(os.environ.get('FEED_FANOUT_LIMIT', 10000))
+
+
+# Кеш (права доступа, индексы подбора, ответы каталога). По умолчанию в памяти
+# процесса; для общего кеша нескольких процессов, например,
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache и
+# CACHE_LOCATION=redis://127.0.0.1:6379 (нужен пакет redis)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Кешированные ответы списков и карточек (partners.caching)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Метрики запросов (partners.instrumentation, /api/metrics/): запрос медленный
+# дольше SLOW_REQUEST_MS, N+1 - если один SQL повторился DUPLICATE_QUERY_THRESHOLD раз.
+# PROFILE_SAMPLE_RATE - доля запросов под cProfile (0 - выключено); профили
+# медленных из них сохраняются в PROFILE_DIR
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+DUPLICATE_QUERY_THRESHOLD = int(os.environ.get('DUPLICATE_QUERY_THRESHOLD', 5))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
@@ -0,0 +1,81 @@
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import ContentPost, Purchase, UserGallery, UserSubscription
+
+ENTITLEMENTS_TIMEOUT = 300
+
+# Значения Purchase.content_type для платного контента
+PURCHASE_CONTENT_TYPES = {
+    ContentPost: 'post',
+    UserGallery: 'gallery_image',
+}
+
+
+def entitlements_cache_key(user_id):
+    return f'entitlements:{user_id}'
+
+
+def invalidate_entitlements(*user_ids):
+    cache.delete_many([entitlements_cache_key(user_id) for user_id in user_ids])
+
+
+class Entitlements:
+    """
+    Набор прав зрителя на платный контент: авторы, на которых у него есть
+    активная подписка, и купленные посты/изображения. Загружается двумя
+    запросами и кешируется, поэтому проверка ленты любой длины не требует
+    запросов на каждый элемент.
+    """
+
+    def __init__(self, user_id=None, authors=(), purchases=()):
+        self.user_id = user_id
+        self.authors = set(authors)
+        self.purchases = set(purchases)
+
+    @classmethod
+    def for_user(cls, user):
+        if user is None or not user.is_authenticated:
+            return cls()
+
+        key = entitlements_cache_key(user.pk)
+        cached = cache.get(key)
+        if cached is not None:
+            authors, purchases = cached
+            return cls(user.pk, authors, purchases)
+
+        now = timezone.now()
+        subscriptions = list(
+            UserSubscription.objects.filter(subscriber=user, status='active', ends_at__gt=now)
+            .values_list('plan__author_id', 'ends_at')
+        )
+        purchases = list(
+            Purchase.objects.filter(user=user).values_list('content_type', 'content_id')
+        )
+        authors = {author_id for author_id, ends_at in subscriptions}
+
+        # Кеш не должен пережить окончание ближайшей подписки
+        timeout = ENTITLEMENTS_TIMEOUT
+        if subscriptions:
+            expires_in = (min(ends_at for _, ends_at in subscriptions) - now).total_seconds()
+            timeout = max(1, min(timeout, int(expires_in)))
+        cache.set(key, (authors, purchases), timeout)
+        return cls(user.pk, authors, purchases)
+
+    def can_view(self, obj):
+        author_id = obj.author_id if isinstance(obj, ContentPost) else obj.user_id
+        if obj.access_type == 'free' or author_id == self.user_id:
+            return True
+        if obj.access_type == 'subscription':
+            return author_id in self.authors
+        if obj.access_type == 'pay_per_view':
+            return (PURCHASE_CONTENT_TYPES[type(obj)], obj.pk) in self.purchases
+        return False
+
+
+def get_entitlements(context):
+    """Права зрителя из запроса, один раз на весь сериализуемый список."""
+    if 'entitlements' not in context:
+        request = context.get('request')
+        context['entitlements'] = Entitlements.for_user(getattr(request, 'user', None))
+    return context['entitlements']
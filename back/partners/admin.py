@@ -16,19 +16,29 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'country', 'city']
     search_fields = ['user__username', 'country', 'city']
 
+@admin.register(ProfileStats)
+class ProfileStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'followers_count', 'reviews_count', 'rating_avg', 'posts_count']
+    search_fields = ['user__username']
+
 @admin.register(UserSocialAuth)
 class UserSocialAuthAdmin(admin.ModelAdmin):
     list_display = ['user', 'provider', 'provider_user_id']
     list_filter = ['provider']
 
+class GameRankInline(admin.TabularInline):
+    model = GameRank
+    extra = 1
+
 @admin.register(Game)
 class GameAdmin(admin.ModelAdmin):
     list_display = ['name']
     search_fields = ['name']
+    inlines = [GameRankInline]
 
 @admin.register(UserGame)
 class UserGameAdmin(admin.ModelAdmin):
-    list_display = ['user', 'game', 'playtime_hours', 'current_rank', 'is_primary']
+    list_display = ['user', 'game', 'playtime_hours', 'current_rank', 'rank_ordinal', 'is_primary']
     list_filter = ['game', 'is_primary']
 
 @admin.register(Achievement)
@@ -42,6 +52,11 @@ class ContentPostAdmin(admin.ModelAdmin):
     list_filter = ['access_type', 'is_published', 'created_at']
     search_fields = ['title', 'content']
 
+@admin.register(FeedEntry)
+class FeedEntryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'post', 'author', 'published_at']
+    raw_id_fields = ['user', 'post', 'author']
+
 @admin.register(UserGallery)
 class UserGalleryAdmin(admin.ModelAdmin):
     list_display = ['user', 'caption', 'access_type', 'price', 'uploaded_at']
@@ -102,5 +117,10 @@ class PostCommentAdmin(admin.ModelAdmin):
 
 @admin.register(PaymentTransaction)
 class PaymentTransactionAdmin(admin.ModelAdmin):
-    list_display = ['user', 'type', 'amount', 'status', 'created_at']
-    list_filter = ['type', 'status', 'currency']
\ No newline at end of file
+    list_display = ['user', 'author', 'type', 'amount', 'status', 'created_at']
+    list_filter = ['type', 'status', 'currency']
+
+@admin.register(EarningsDaily)
+class EarningsDailyAdmin(admin.ModelAdmin):
+    list_display = ['author', 'day', 'subscriptions_amount', 'purchases_amount', 'transactions_count']
+    search_fields = ['author__username']
@@ -0,0 +1,152 @@
+"""
+Асинхронные версии горячих эндпоинтов чтения для ASGI (backend/asgi.py):
+пока запрос ждет базу, воркер обслуживает другие. Ответы совпадают
+с синхронными viewset'ами (кроме карточки профиля, которая собирает
+страницу профиля целиком), но без кеша ответов и браузерного API.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+
+from .access import Entitlements
+from .fieldsets import build_row, plan_columns, values_plan
+from .models import ContentPost, Game, PostLike, ProfileStats, SubscriptionPlan, UserGame, UserProfile
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import (
+    ContentPostSerializer, GameSerializer, ProfileWithGamesSerializer, SubscriptionPlanSerializer,
+)
+from .views import UserProfileViewSet
+
+PROFILE_POSTS = 10
+
+
+def json_response(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def error_response(exc):
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(detail, exc.status_code)
+
+
+def async_endpoint(view):
+    """
+    GET/HEAD-представление: получает DRF Request с пользователем сессии
+    (для query_params и контекста сериализаторов), возвращает данные,
+    ошибки DRF превращаются в ответы как в APIView.
+    """
+    @require_safe
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        drf_request = Request(request)
+        drf_request.user = await request.auser()
+        try:
+            data = await view(drf_request, *args, **kwargs)
+        except (ObjectDoesNotExist, Http404):
+            return error_response(NotFound())
+        except APIException as exc:
+            return error_response(exc)
+        return json_response(data)
+    wrapper.read_replica = True
+    return wrapper
+
+
+def _own_connection(func):
+    def run():
+        try:
+            return func()
+        finally:
+            # Поток пула не обрабатывает request_finished: соединение
+            # закрывается (или возвращается в пул) здесь
+            close_old_connections()
+    return run
+
+
+async def gather_queries(*funcs):
+    """
+    Выполняет независимые синхронные запросы одновременно. Async ORM Django
+    выполняет все запросы одного запроса по очереди в одном потоке, поэтому
+    каждая функция идет в свой поток со своим соединением. Выигрыш есть
+    при пуле или постоянных соединениях (DB_POOL, DB_CONN_MAX_AGE).
+    """
+    return await asyncio.gather(*(
+        sync_to_async(_own_connection(func), thread_sensitive=False)() for func in funcs
+    ))
+
+
+@async_endpoint
+async def profile_list(request):
+    view = UserProfileViewSet(request=request, action='list', kwargs={}, format_kwarg=None)
+    # Фильтры могут обращаться к базе (ладдер рангов) - строим queryset в потоке
+    queryset = await sync_to_async(view.get_queryset)()
+    paginator = KeysetPagination()
+    rows = paginator.cut_page([row async for row in paginator.page_queryset(queryset, request)])
+    data = ProfileWithGamesSerializer(rows, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+@async_endpoint
+async def profile_detail(request, pk):
+    """
+    Страница профиля: профиль, игры, счетчики, последние посты и планы
+    подписки. Все, кроме профиля, загружается одновременно.
+    """
+    profile = await UserProfile.objects.select_related('user').defer('search_vector').aget(pk=pk)
+    user = request.user
+    games, stats, posts, plans, entitlements, liked = await gather_queries(
+        lambda: list(UserGame.objects.filter(user_id=pk).select_related('user', 'game')),
+        lambda: ProfileStats.objects.filter(user_id=pk).first(),
+        lambda: list(
+            ContentPost.objects.filter(author_id=pk, is_published=True)
+            .select_related('author').order_by('-published_at', '-post_id')[:PROFILE_POSTS]
+        ),
+        lambda: list(SubscriptionPlan.objects.filter(author_id=pk, is_active=True).select_related('author')),
+        lambda: Entitlements.for_user(user),
+        lambda: _liked_post_ids(user, author_id=pk),
+    )
+    profile.user.prefetched_games = games
+    profile.user.stats = stats
+    context = {'request': request, 'entitlements': entitlements, 'liked_post_ids': liked}
+    data = ProfileWithGamesSerializer(profile, context=context).data
+    data['posts'] = ContentPostSerializer(posts, many=True, context=context).data
+    data['subscription_plans'] = SubscriptionPlanSerializer(plans, many=True, context=context).data
+    return data
+
+
+@async_endpoint
+async def post_list(request):
+    author_id = request.query_params.get('author') or None
+    queryset = ContentPost.objects.select_related('author')
+    if author_id:
+        queryset = queryset.filter(author_id=author_id)
+    user = request.user
+    posts, entitlements, liked = await gather_queries(
+        lambda: list(queryset),
+        lambda: Entitlements.for_user(user),
+        lambda: _liked_post_ids(user, author_id=author_id),
+    )
+    context = {'request': request, 'entitlements': entitlements, 'liked_post_ids': liked}
+    return ContentPostSerializer(posts, many=True, context=context).data
+
+
+@async_endpoint
+async def game_list(request):
+    plan = values_plan(GameSerializer(context={'request': request}))
+    return [build_row(plan, row) async for row in Game.objects.values(*plan_columns(plan))]
+
+
+def _liked_post_ids(user, author_id=None):
+    if not user.is_authenticated:
+        return set()
+    likes = PostLike.objects.filter(user=user)
+    if author_id:
+        likes = likes.filter(post__author_id=author_id)
+    return set(likes.values_list('post_id', flat=True))
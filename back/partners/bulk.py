@@ -0,0 +1,254 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F
+from rest_framework.exceptions import ValidationError
+
+from . import feed, matchmaking
+from .caching import invalidate_responses
+from .models import Achievement, ContentPost, Follow, Game, PostLike, ProfileStats, User, UserGame
+from .ranks import rank_tables
+from .search import refresh_search_vectors
+from .serializers import (
+    FollowItemSerializer, PostLikeItemSerializer, UserGameItemSerializer, UserGameKeySerializer,
+)
+from .signals import rebuild_profile_stats
+from .tasks import enqueue
+
+# Ограничение держит число параметров DELETE ... IN и длину транзакции в разумных пределах
+MAX_ITEMS = 500
+
+
+def _insert_returning(objs, column):
+    """
+    INSERT ... ON CONFLICT DO NOTHING RETURNING column: значения только
+    вставленных строк. Строки, которые уже есть или которые одновременно
+    вставил такой же запрос, не возвращаются, поэтому счетчики и статусы не
+    учитываются дважды.
+    """
+    model = type(objs[0])
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    rows = [[field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields] for obj in objs]
+    placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} ({", ".join(field.column for field in fields)}) '
+            f'VALUES {", ".join([placeholder] * len(rows))} ON CONFLICT DO NOTHING RETURNING {column}',
+            [value for row in rows for value in row],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _delete_returning(model, owner_column, owner_id, key_column, keys):
+    """DELETE ... RETURNING key_column: ключи удаленных строк владельца."""
+    # QuerySet.delete() при подключенных сигналах загружает объекты и шлет
+    # post_delete по одному, поэтому удаляем одним DELETE, а сигналы
+    # заменяем пакетными обновлениями
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {model._meta.db_table} WHERE {owner_column} = %s '
+            f'AND {key_column} IN ({", ".join(["%s"] * len(keys))}) RETURNING {key_column}',
+            [owner_id, *keys],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+class BulkWriter:
+    """
+    Пакетная запись связей пользователя: owner_field - сам пользователь,
+    key_field - второй столбец unique_together. Список проверяется за один
+    проход, запись идет одним INSERT ... ON CONFLICT DO NOTHING (как
+    bulk_create(ignore_conflicts=True), но с RETURNING) или одним DELETE в
+    одной транзакции. Сигналы при этом не шлются, поэтому счетчики, ленты и
+    кеши обновляются пакетно в created()/deleted() - только для строк,
+    которые запрос действительно изменил.
+    """
+    model = None
+    owner_field = None
+    key_field = None
+    target_model = None
+    item_serializer = None
+    key_serializer = None
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def check(self, key):
+        """Сообщение об ошибке для цели, которую нельзя связать с владельцем."""
+        return None
+
+    def build(self, valid):
+        return [self.model(**{self.owner_field: self.owner, f'{self.key_field}_id': key}) for key in valid]
+
+    def created(self, keys):
+        pass
+
+    def deleted(self, keys):
+        pass
+
+    def validate(self, items, serializer_class, check_targets):
+        """
+        (results, valid): итог по каждому элементу в порядке запроса и
+        {ключ: данные} прошедших проверку. Существование целей проверяется
+        одним запросом на весь список.
+        """
+        if not isinstance(items, list):
+            raise ValidationError({'items': 'Ожидается список'})
+        if not items:
+            raise ValidationError({'items': 'Список пуст'})
+        if len(items) > MAX_ITEMS:
+            raise ValidationError({'items': f'Не больше {MAX_ITEMS} элементов за запрос'})
+
+        # Один экземпляр сериализатора на весь список: поля копируются один раз
+        serializer = serializer_class()
+        results, parsed = [], {}
+        for index, item in enumerate(items):
+            result = {'index': index}
+            results.append(result)
+            try:
+                data = serializer.run_validation(item)
+            except ValidationError as exc:
+                result.update(status='invalid', errors=exc.detail)
+                continue
+            key = data[self.key_field]
+            result[self.key_field] = key
+            if key in parsed:
+                result['status'] = 'duplicate'
+                continue
+            parsed[key] = data
+
+        found = parsed
+        if check_targets and parsed:
+            found = set(self.target_model.objects.filter(pk__in=parsed).values_list('pk', flat=True))
+        valid = {}
+        for result in results:
+            if 'status' in result:
+                continue
+            key = result[self.key_field]
+            if key not in found:
+                error = 'Объект не найден'
+            else:
+                error = self.check(key) if check_targets else None
+            if error:
+                result.update(status='invalid', errors={self.key_field: [error]})
+            else:
+                valid[key] = parsed[key]
+        return results, valid
+
+    def column(self, field):
+        return self.model._meta.get_field(field).column
+
+    def create(self, items):
+        with transaction.atomic():
+            results, valid = self.validate(items, self.item_serializer, check_targets=True)
+            created = _insert_returning(self.build(valid), self.column(self.key_field)) if valid else set()
+            if created:
+                self.created(sorted(created))
+        return self.report(results, lambda key: 'created' if key in created else 'exists')
+
+    def delete(self, items):
+        with transaction.atomic():
+            results, valid = self.validate(items, self.key_serializer or self.item_serializer, check_targets=False)
+            deleted = self.delete_keys(list(valid)) if valid else set()
+            if deleted:
+                self.deleted(sorted(deleted))
+        return self.report(results, lambda key: 'deleted' if key in deleted else 'not_found')
+
+    def delete_keys(self, keys):
+        return _delete_returning(self.model, self.column(self.owner_field), self.owner.pk,
+                                 self.column(self.key_field), keys)
+
+    def report(self, results, status):
+        for result in results:
+            if 'status' not in result:
+                result['status'] = status(result[self.key_field])
+        return {'summary': dict(Counter(result['status'] for result in results)), 'results': results}
+
+
+def _add_followers(user_ids, delta):
+    updated = ProfileStats.objects.filter(user_id__in=user_ids).update(
+        followers_count=F('followers_count') + delta)
+    if updated < len(user_ids):
+        # Как и update_profile_stats: строки без статистики собираются целиком
+        present = set(ProfileStats.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        rebuild_profile_stats([user_id for user_id in user_ids if user_id not in present])
+
+
+class FollowBulkWriter(BulkWriter):
+    model = Follow
+    owner_field = 'follower'
+    key_field = 'following'
+    target_model = User
+    item_serializer = FollowItemSerializer
+
+    def check(self, key):
+        if key == self.owner.pk:
+            return 'Нельзя подписаться на себя'
+
+    def created(self, keys):
+        _add_followers(keys, 1)
+        for key in keys:
+            enqueue(feed.backfill_follower, self.owner.pk, key)
+        invalidate_responses('profiles', *(f'user:{key}' for key in keys))
+
+    def deleted(self, keys):
+        _add_followers(keys, -1)
+        for key in keys:
+            enqueue(feed.remove_author, self.owner.pk, key)
+        invalidate_responses('profiles', *(f'user:{key}' for key in keys))
+
+
+class PostLikeBulkWriter(BulkWriter):
+    model = PostLike
+    owner_field = 'user'
+    key_field = 'post'
+    target_model = ContentPost
+    item_serializer = PostLikeItemSerializer
+
+    # Лайк пользователя у поста один, поэтому приращение у всех изменившихся постов одинаковое
+    def created(self, keys):
+        ContentPost.objects.filter(pk__in=keys).update(likes_count=F('likes_count') + 1)
+
+    def deleted(self, keys):
+        ContentPost.objects.filter(pk__in=keys).update(likes_count=F('likes_count') - 1)
+
+
+class UserGameBulkWriter(BulkWriter):
+    model = UserGame
+    owner_field = 'user'
+    key_field = 'game'
+    target_model = Game
+    item_serializer = UserGameItemSerializer
+    key_serializer = UserGameKeySerializer
+
+    def build(self, valid):
+        # Порядковые номера рангов, которые при обычном сохранении ставит pre_save
+        tables = rank_tables(list(valid))
+        games = []
+        for game_id, data in valid.items():
+            ranks = tables.get(game_id, {})
+            current_rank, max_rank = data.get('current_rank') or None, data.get('max_rank') or None
+            games.append(UserGame(
+                user=self.owner, game_id=game_id, playtime_hours=data['playtime_hours'],
+                current_rank=current_rank, max_rank=max_rank, is_primary=data['is_primary'],
+                rank_ordinal=ranks.get(current_rank.lower()) if current_rank else None,
+                max_rank_ordinal=ranks.get(max_rank.lower()) if max_rank else None,
+            ))
+        return games
+
+    def created(self, keys):
+        self.games_changed(keys)
+
+    def deleted(self, keys):
+        self.games_changed(keys)
+
+    def delete_keys(self, keys):
+        # Каскад, который выполнил бы Collector
+        Achievement.objects.filter(user_game__user=self.owner, user_game__game_id__in=keys).delete()
+        return super().delete_keys(keys)
+
+    def games_changed(self, game_ids):
+        refresh_search_vectors([self.owner.pk])
+        for game_id in game_ids:
+            matchmaking.invalidate_index(matchmaking.game_index_name(game_id))
+        invalidate_responses('profiles', f'user:{self.owner.pk}')
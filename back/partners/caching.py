@@ -0,0 +1,108 @@
+import hashlib
+import json
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .replicas import primary_reads
+
+
+def response_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _generation_key(namespace):
+    return f'responses:gen:{namespace}'
+
+
+def generations(namespaces):
+    """
+    Текущие поколения пространств имен (одним обращением к кешу). Ключ ответа
+    включает поколения всех его зависимостей, поэтому инвалидация - это смена
+    поколения, а старые ответы просто истекают по таймауту.
+    """
+    cache = response_cache()
+    keys = [_generation_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, uuid4().hex, None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def invalidate_responses(*namespaces):
+    """
+    Меняет поколения после фиксации текущей транзакции, как tasks.enqueue:
+    иначе чтение до фиксации (параллельное или в той же транзакции)
+    закешировало бы старые данные уже под новым поколением. Вне транзакции
+    поколения меняются сразу.
+    """
+    keys = [_generation_key(namespace) for namespace in namespaces]
+    transaction.on_commit(lambda: response_cache().set_many({key: uuid4().hex for key in keys}, None))
+
+
+def compute_etag(data):
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True, separators=(',', ':'))
+    return '"%s"' % hashlib.md5(body.encode()).hexdigest()
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+class CachedResponseMixin:
+    """
+    Кеширует сериализованные ответы list/retrieve по URL запроса и отвечает
+    304 на If-None-Match. Зависимости ответа задает cache_dependencies,
+    инвалидация - сигналами моделей через invalidate_responses.
+    """
+
+    def cache_dependencies(self):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+    def cached_response(self, request, build):
+        cache = response_cache()
+        tokens = generations(self.cache_dependencies())
+        # Порядок параметров запроса на ключ не влияет; хост входит в ключ,
+        # т.к. ссылки пагинации в ответе абсолютные
+        params = sorted((name, values) for name, values in request.query_params.lists())
+        key = 'responses:' + hashlib.md5(
+            repr((request.get_host(), request.path, params, tokens)).encode()
+        ).hexdigest()
+
+        cached = cache.get(key)
+        if cached is None:
+            # Ответ ляжет в кеш под текущими поколениями: отстающая реплика
+            # сразу после записи закешировала бы старые данные на весь таймаут
+            with primary_reads():
+                response = build()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cached = (compute_etag(response.data), response.data)
+            cache.set(key, cached, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+
+        etag, data = cached
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
@@ -0,0 +1,124 @@
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .models import PostComment
+from .pagination import encode_cursor, page_size_from
+
+# Превью ветки по умолчанию: первые REPLIES ответов каждого комментария
+# на глубину до DEPTH уровней под комментарием верхнего уровня
+PREVIEW_DEPTH = 3
+PREVIEW_REPLIES = 3
+MAX_PREVIEW_DEPTH = 10
+MAX_PREVIEW_REPLIES = 20
+
+BATCH_SIZE = 2000
+
+
+def place_comment(comment):
+    """
+    Заполняет положение нового комментария в ветке. Номер ответа - следующий
+    после наибольшего у родителя, поэтому номера растут с comment_id; после
+    удаления ответов в номерах остаются пропуски.
+    """
+    if comment.parent_comment_id is None:
+        comment.root_id, comment.depth, comment.ordinal = None, 0, 0
+        return
+    parent = PostComment.objects.only('post_id', 'root_id', 'depth').get(pk=comment.parent_comment_id)
+    last = PostComment.objects.filter(parent_comment_id=parent.pk).aggregate(last=Max('ordinal'))['last']
+    comment.post_id = parent.post_id
+    comment.root_id = parent.root_id or parent.pk
+    comment.depth = parent.depth + 1
+    comment.ordinal = (last or 0) + 1
+
+
+def update_replies_count(parent_id, delta):
+    PostComment.objects.filter(pk=parent_id).update(replies_count=F('replies_count') + delta)
+
+
+def rebuild_comment_tree(post_ids=None):
+    """Пересчитывает положение в ветках и replies_count комментариев постов."""
+    comments = PostComment.objects.order_by('post_id', 'comment_id')
+    if post_ids is not None:
+        comments = comments.filter(post_id__in=post_ids)
+    rows = comments.values_list('comment_id', 'post_id', 'parent_comment_id')
+
+    total = 0
+    batch = []
+    # Ветки поста: ответ меняет replies_count родителя, поэтому комментарии
+    # поста сохраняются, когда прочитаны все они
+    thread, current_post = {}, None
+    for pk, post_id, parent_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if post_id != current_post:
+            batch.extend(thread.values())
+            thread, current_post = {}, post_id
+            if len(batch) >= BATCH_SIZE:
+                total += _save_positions(batch)
+        parent = thread.get(parent_id)
+        comment = thread[pk] = PostComment(comment_id=pk)
+        if parent is not None:
+            parent.replies_count += 1
+            comment.root_id = parent.root_id or parent.pk
+            comment.depth = parent.depth + 1
+            comment.ordinal = parent.replies_count
+    batch.extend(thread.values())
+    return total + _save_positions(batch)
+
+
+def _save_positions(batch):
+    PostComment.objects.bulk_update(
+        batch, ['root_id', 'depth', 'ordinal', 'replies_count'], batch_size=BATCH_SIZE)
+    saved = len(batch)
+    batch.clear()
+    return saved
+
+
+def preview_size(request):
+    """Глубина и ширина превью веток из параметров depth и replies."""
+    depth = page_size_from(request, PREVIEW_DEPTH, MAX_PREVIEW_DEPTH, 'depth')
+    replies = page_size_from(request, PREVIEW_REPLIES, MAX_PREVIEW_REPLIES, 'replies')
+    if request.query_params.get('depth') == '0':
+        depth = 0
+    return depth, replies
+
+
+def attach_replies(comments, request, depth=0, replies=0):
+    """
+    Собирает ветки: comments - страница комментариев одного уровня; при
+    depth > 0 это комментарии верхнего уровня, и превью их веток (первые
+    replies ответов каждого комментария до глубины depth) загружается одним
+    запросом по индексу (root, depth): первые ответы родителя выбирает
+    ROW_NUMBER() по родителю, а не номер ответа - в номерах после удаления
+    пропуски. Каждому комментарию проставляются replies и more_replies -
+    ссылка на следующие ответы.
+    """
+    nodes = {comment.pk: comment for comment in comments}
+    for comment in comments:
+        comment.replies = []
+    if depth and comments:
+        thread = (
+            PostComment.objects.filter(root_id__in=list(nodes), depth__lte=depth)
+            .annotate(position=Window(RowNumber(), partition_by=F('parent_comment_id'), order_by='comment_id'))
+            .filter(position__lte=replies)
+            .select_related('author').order_by('depth', 'comment_id')
+        )
+        # Родитель всегда выше по глубине, поэтому уже в nodes; ответ родителя,
+        # который сам не попал в превью, пропускаем - как и строку, чей родитель
+        # не попал в ветку (дерево изменено в обход сигналов)
+        for reply in thread:
+            parent = nodes.get(reply.parent_comment_id)
+            if parent is None:
+                continue
+            reply.replies = []
+            nodes[reply.pk] = reply
+            parent.replies.append(reply)
+
+    url = remove_query_param(request.build_absolute_uri(), 'cursor')
+    for node in nodes.values():
+        node.more_replies = None
+        if node.replies_count > len(node.replies):
+            link = replace_query_param(url, 'parent', node.pk)
+            if node.replies:
+                link = replace_query_param(link, 'cursor', encode_cursor([node.replies[-1].pk]))
+            node.more_replies = link
+    return comments
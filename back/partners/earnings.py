@@ -0,0 +1,275 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DateTimeField, ExpressionWrapper, F, Max, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.utils import timezone
+
+from .access import PURCHASE_CONTENT_TYPES
+from .models import ContentPost, EarningsDaily, PaymentTransaction, Purchase, UserGallery, UserSubscription
+
+# Тип платежа -> колонка дохода в EarningsDaily
+REVENUE_COLUMNS = {
+    'subscription': 'subscriptions_amount',
+    'one_time_purchase': 'purchases_amount',
+}
+
+# Модель платного контента -> поле ее автора
+CONTENT_AUTHOR_FIELDS = {
+    ContentPost: 'author_id',
+    UserGallery: 'user_id',
+}
+
+UPSERT_BATCH_SIZE = 500
+REBUILD_AUTHORS_CHUNK_SIZE = 500
+LINK_CHUNK_SIZE = 50000
+# Старый платеж без ссылки сопоставляется с покупкой или подпиской, созданной не дальше этого
+LINK_WINDOW = timedelta(minutes=10)
+
+
+def purchase_author():
+    """Автор купленного поста или изображения - выражение над строкой Purchase."""
+    return Case(*(
+        When(content_type=content_type, then=Subquery(
+            model.objects.filter(pk=OuterRef('content_id')).values(CONTENT_AUTHOR_FIELDS[model])[:1]
+        ))
+        for model, content_type in PURCHASE_CONTENT_TYPES.items()
+    ))
+
+
+def source_author():
+    """Автор дохода по подписке или покупке платежа - выражение над строкой PaymentTransaction."""
+    return Coalesce(
+        Subquery(UserSubscription.objects.filter(pk=OuterRef('subscription_id')).values('plan__author_id')[:1]),
+        Subquery(Purchase.objects.filter(pk=OuterRef('purchase_id')).annotate(author=purchase_author())
+                 .values('author')[:1]),
+    )
+
+
+def payment_author_id(payment):
+    """
+    Автор, которому идет доход платежа: автор плана подписки или купленного
+    контента. Выплаты дохода не дают; у платежа без ссылки автор остается
+    тем, что указал серверный код (в API поле только для чтения).
+    """
+    if payment.type == 'payout':
+        return None
+    if payment.subscription_id:
+        return (UserSubscription.objects.filter(pk=payment.subscription_id)
+                .values_list('plan__author_id', flat=True).first())
+    if payment.purchase_id:
+        return (Purchase.objects.filter(pk=payment.purchase_id).annotate(author=purchase_author())
+                .values_list('author', flat=True).first())
+    return payment.author_id
+
+
+def _near(field):
+    return [
+        ExpressionWrapper(OuterRef(field) - LINK_WINDOW, output_field=DateTimeField()),
+        ExpressionWrapper(OuterRef(field) + LINK_WINDOW, output_field=DateTimeField()),
+    ]
+
+
+def _purchase_match():
+    # Покупка, уже связанная с другим платежом, второй раз не подбирается
+    return Subquery(
+        Purchase.objects.filter(user=OuterRef('user'), purchase_price=OuterRef('amount'),
+                                purchased_at__range=_near('created_at'), payments__isnull=True)
+        .order_by('purchased_at').values('pk')[:1]
+    )
+
+
+def _subscription_match():
+    return Subquery(
+        UserSubscription.objects.filter(subscriber=OuterRef('user'), plan__price_per_month=OuterRef('amount'),
+                                        starts_at__range=_near('created_at'))
+        .order_by('starts_at').values('pk')[:1]
+    )
+
+
+def _link(payments, field, match, unique=False):
+    """
+    Ссылки field для платежей, которым нашелся объект подзапросом match.
+    С unique объект достается одному платежу - раньше созданному (покупка
+    оплачивается один раз, подписка - каждым продлением).
+    """
+    taken, linked = set(), []
+    candidates = payments.annotate(match=match).filter(match__isnull=False).order_by('pk')
+    for pk, target in candidates.values_list('pk', 'match'):
+        if unique and target in taken:
+            continue
+        taken.add(target)
+        linked.append(PaymentTransaction(pk=pk, **{f'{field}_id': target}))
+    PaymentTransaction.objects.bulk_update(linked, [field], batch_size=UPSERT_BATCH_SIZE)
+    return len(linked)
+
+
+def link_payments(chunk_size=None, dry_run=False, log=None):
+    """
+    Связывает старые платежи без ссылки с покупкой или подпиской того же
+    пользователя на ту же сумму, созданной не дальше LINK_WINDOW по времени,
+    и проставляет автора связанным платежам без автора (заданный автор не
+    перезаписывается, такие платежи не связываются). Сопоставление - догадка, поэтому выполняется только
+    явно (команда link_payments); с dry_run изменения откатываются.
+    Возвращает (число по видам изменений, авторы, которым добавился доход).
+    """
+    chunk_size = chunk_size or LINK_CHUNK_SIZE
+    counts = dict.fromkeys(('purchase', 'subscription', 'author'), 0)
+    authors = set()
+    last_id = PaymentTransaction.objects.aggregate(last=Max('transaction_id'))['last'] or 0
+    for start in range(0, last_id, chunk_size):
+        with transaction.atomic():
+            payments = PaymentTransaction.objects.filter(
+                transaction_id__gt=start, transaction_id__lte=start + chunk_size)
+            # Платеж с автором не связывается: ссылка могла бы указать на другого
+            unlinked = payments.filter(subscription__isnull=True, purchase__isnull=True, author__isnull=True)
+            counts['purchase'] += _link(unlinked.filter(type='one_time_purchase'), 'purchase',
+                                        _purchase_match(), unique=True)
+            counts['subscription'] += _link(unlinked.filter(type='subscription'), 'subscription',
+                                            _subscription_match())
+            orphans = (payments.filter(author__isnull=True).exclude(type='payout')
+                       .exclude(subscription__isnull=True, purchase__isnull=True))
+            authors |= set(orphans.annotate(earner=source_author()).filter(earner__isnull=False)
+                           .values_list('earner', flat=True).distinct())
+            counts['author'] += PaymentTransaction.objects.filter(
+                pk__in=orphans.annotate(earner=source_author()).filter(earner__isnull=False).values('pk'),
+            ).update(author=source_author())
+            if dry_run:
+                transaction.set_rollback(True)
+        if log:
+            log(f'Платежи до #{min(start + chunk_size, last_id)}: {counts}')
+    return counts, authors
+
+
+class EarningsDelta:
+    """Приращения дневных корзин дохода: (автор, день) -> суммы по колонкам и число платежей."""
+
+    def __init__(self):
+        self.buckets = defaultdict(lambda: dict.fromkeys((*REVENUE_COLUMNS.values(), 'transactions_count'), 0))
+
+    def add(self, author_id, day, kind, amount, count=1):
+        bucket = self.buckets[(author_id, day)]
+        bucket[REVENUE_COLUMNS[kind]] += amount
+        bucket['transactions_count'] += count
+
+    def add_transaction(self, payment, sign=1):
+        """Учитывает платеж, если он приносит доход автору (завершен и с автором)."""
+        if payment.status != 'completed' or payment.author_id is None or payment.type not in REVENUE_COLUMNS:
+            return
+        self.add(payment.author_id, timezone.localdate(payment.created_at), payment.type,
+                 sign * Decimal(payment.amount), sign)
+
+    def __bool__(self):
+        return any(any(bucket.values()) for bucket in self.buckets.values())
+
+    def apply(self):
+        """
+        Прибавляет приращения к корзинам одним INSERT ... ON CONFLICT DO UPDATE
+        на порцию: одновременные платежи одного автора не теряют друг друга,
+        и корзина создается при первом платеже дня.
+        """
+        table = EarningsDaily._meta.db_table
+        columns = [*REVENUE_COLUMNS.values(), 'transactions_count']
+        rows = [
+            [author_id, connection.ops.adapt_datefield_value(day), *(bucket[column] for column in columns)]
+            for (author_id, day), bucket in self.buckets.items() if any(bucket.values())
+        ]
+        updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in columns)
+        placeholder = '(' + ', '.join(['%s'] * (len(columns) + 2)) + ')'
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                batch = rows[start:start + UPSERT_BATCH_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {table} (author_id, day, {", ".join(columns)}) '
+                    f'VALUES {", ".join([placeholder] * len(batch))} '
+                    f'ON CONFLICT (author_id, day) DO UPDATE SET {updates}',
+                    [value for row in batch for value in row],
+                )
+        self.buckets.clear()
+
+
+def rebuild_earnings(author_ids=None, chunk_size=None, log=None):
+    """
+    Пересобирает EarningsDaily из истории PaymentTransaction порциями
+    авторов, ничего не меняя в самих платежах: доход идет автору платежа,
+    а платежу со ссылкой, но без автора - автору подписки или покупки.
+    Платежи без того и другого не учитываются (их связывает link_payments).
+    Удаление корзин порции и их сборка (GROUP BY автор, день, тип) идут в
+    одной транзакции, поэтому дашборды не видят нулей, а платеж, чей сигнал
+    пришел во время пересборки, не теряется - его прибавка ждет блокировки
+    корзины и ложится поверх собранной.
+    """
+    chunk_size = chunk_size or REBUILD_AUTHORS_CHUNK_SIZE
+    completed = PaymentTransaction.objects.filter(status='completed', type__in=list(REVENUE_COLUMNS))
+    sources = [
+        completed.filter(author__isnull=False).annotate(earner=F('author_id')),
+        completed.filter(author__isnull=True).exclude(subscription__isnull=True, purchase__isnull=True)
+        .annotate(earner=source_author()),
+    ]
+    if author_ids is None:
+        author_ids = set(EarningsDaily.objects.order_by().values_list('author_id', flat=True).distinct())
+        for payments in sources:
+            author_ids |= set(payments.filter(earner__isnull=False).order_by()
+                              .values_list('earner', flat=True).distinct())
+    author_ids = sorted(author_ids)
+
+    total = 0
+    for start in range(0, len(author_ids), chunk_size):
+        authors = author_ids[start:start + chunk_size]
+        with transaction.atomic():
+            EarningsDaily.objects.filter(author_id__in=authors).delete()
+            delta = EarningsDelta()
+            for payments in sources:
+                chunk = (
+                    payments.filter(earner__in=authors)
+                    .annotate(day=TruncDate('created_at')).order_by()
+                    .values_list('earner', 'day', 'type').annotate(amount=Sum('amount'), count=Count('*'))
+                )
+                for author_id, day, kind, amount, count in chunk:
+                    delta.add(author_id, day, kind, amount, count)
+                    total += count
+            delta.apply()
+        if log:
+            log(f'Авторов: {start + len(authors)} из {len(author_ids)}, учтено платежей {total}')
+    return total
+
+
+def _money(value):
+    return str((value or Decimal(0)).quantize(Decimal('0.01')))
+
+
+def earnings_report(author_id, date_from, date_to, period='day'):
+    """
+    Ряд дохода автора по дням или месяцам и итоги за [date_from, date_to]
+    из корзин EarningsDaily - два запроса по индексу (author, day). Дни
+    без дохода в ряд не попадают.
+    """
+    buckets = EarningsDaily.objects.filter(author_id=author_id, day__range=(date_from, date_to))
+    sums = {
+        'subscriptions_amount': Sum('subscriptions_amount'),
+        'purchases_amount': Sum('purchases_amount'),
+        'transactions_count': Sum('transactions_count'),
+    }
+    key = TruncMonth('day') if period == 'month' else F('day')
+    series = buckets.annotate(period=key).order_by('period').values('period').annotate(**sums)
+    totals = buckets.aggregate(**sums)
+
+    def point(values):
+        subscriptions, purchases = values['subscriptions_amount'], values['purchases_amount']
+        return {
+            'subscriptions_amount': _money(subscriptions),
+            'purchases_amount': _money(purchases),
+            'total_amount': _money((subscriptions or 0) + (purchases or 0)),
+            'transactions_count': values['transactions_count'] or 0,
+        }
+
+    return {
+        'author': author_id,
+        'period': period,
+        'from': date_from,
+        'to': date_to,
+        'totals': point(totals),
+        'series': [{'period': row['period'], **point(row)} for row in series],
+    }
@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ContentPost, FeedEntry, Follow, ProfileStats, UserSubscription
+from .pagination import keyset_filter
+
+FEED_CHUNK_SIZE = 1000
+# Посты последних публикаций автора, добавляемые в ленту при подписке
+FEED_BACKFILL_SIZE = 20
+FEED_ORDERING = ('-published_at', '-post_id')
+
+
+def fanout_limit():
+    """
+    Авторы с большим числом подписчиков не раскладываются по лентам
+    (fan-out-on-write), их посты подмешиваются при чтении.
+    """
+    return getattr(settings, 'FEED_FANOUT_LIMIT', 10000)
+
+
+def is_large_author(author_id):
+    return ProfileStats.objects.filter(
+        user_id=author_id, followers_count__gte=fanout_limit()).exists()
+
+
+def _chunks(queryset, field, chunk_size):
+    queryset = queryset.order_by(field).values_list(field, flat=True).distinct()
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(**{f'{field}__gt': last_id})[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def audience_chunks(author_id, chunk_size=None):
+    """Подписчики автора и читатели с активной подпиской на его планы."""
+    chunk_size = chunk_size or FEED_CHUNK_SIZE
+    yield from _chunks(Follow.objects.filter(following_id=author_id), 'follower_id', chunk_size)
+    yield from _chunks(
+        UserSubscription.objects.filter(
+            plan__author_id=author_id, status='active', ends_at__gt=timezone.now()),
+        'subscriber_id', chunk_size,
+    )
+
+
+def fanout_post(post_id, chunk_size=None):
+    post = ContentPost.objects.filter(pk=post_id, is_published=True).first()
+    if post is None or is_large_author(post.author_id):
+        return 0
+    published_at = post.published_at or post.created_at
+    total = 0
+    for user_ids in audience_chunks(post.author_id, chunk_size):
+        FeedEntry.objects.bulk_create([
+            FeedEntry(user_id=user_id, post_id=post.pk, author_id=post.author_id, published_at=published_at)
+            for user_id in user_ids
+        ], ignore_conflicts=True)
+        total += len(user_ids)
+    return total
+
+
+def backfill_follower(user_id, author_id):
+    """Последние посты автора в ленту нового подписчика."""
+    if is_large_author(author_id):
+        return
+    posts = ContentPost.objects.filter(
+        author_id=author_id, is_published=True
+    ).order_by('-published_at')[:FEED_BACKFILL_SIZE]
+    FeedEntry.objects.bulk_create([
+        FeedEntry(user_id=user_id, post_id=post.pk, author_id=author_id,
+                  published_at=post.published_at or post.created_at)
+        for post in posts
+    ], ignore_conflicts=True)
+
+
+def remove_author(user_id, author_id):
+    """Убирает посты автора из ленты, если читатель больше не связан с ним."""
+    remove_authors([(user_id, author_id)])
+
+
+def remove_authors(pairs, chunk_size=500):
+    """
+    remove_author для многих пар (читатель, автор), например после
+    пакетного завершения подписок: связи проверяются двумя запросами на
+    все пары, записи удаляются порциями.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return
+    readers, authors = {user_id for user_id, _ in pairs}, {author_id for _, author_id in pairs}
+    linked = set(UserSubscription.objects.filter(
+        subscriber_id__in=readers, plan__author_id__in=authors, status='active', ends_at__gt=timezone.now(),
+    ).values_list('subscriber_id', 'plan__author_id'))
+    linked |= set(Follow.objects.filter(
+        follower_id__in=readers, following_id__in=authors).values_list('follower_id', 'following_id'))
+    stale = sorted(pairs - linked)
+    for start in range(0, len(stale), chunk_size):
+        condition = Q()
+        for user_id, author_id in stale[start:start + chunk_size]:
+            condition |= Q(user_id=user_id, author_id=author_id)
+        FeedEntry.objects.filter(condition).delete()
+
+
+def large_authors(user):
+    """Крупные авторы, на которых читатель подписан или у которых есть его активная подписка - один запрос."""
+    limit = fanout_limit()
+    followed = Follow.objects.filter(
+        follower=user, following__stats__followers_count__gte=limit,
+    ).values_list('following_id', flat=True)
+    subscribed = UserSubscription.objects.filter(
+        subscriber=user, status='active', ends_at__gt=timezone.now(),
+        plan__author__stats__followers_count__gte=limit,
+    ).values_list('plan__author_id', flat=True)
+    return list(followed.union(subscribed))
+
+
+def feed_page(user, limit, position=None):
+    """
+    Страница ленты: один индексный запрос по FeedEntry, запрос крупных
+    авторов читателя (подписки и платные подписки) и, если они есть, один
+    запрос по их постам. Возвращает посты
+    и признак наличия следующей страницы.
+    """
+    entries = FeedEntry.objects.filter(user=user).select_related('post__author')
+    if position is not None:
+        entries = entries.filter(keyset_filter(FEED_ORDERING, position))
+    posts = [entry.post for entry in entries.order_by(*FEED_ORDERING)[:limit + 1]]
+
+    pulled_authors = large_authors(user)
+    if pulled_authors:
+        pulled = ContentPost.objects.filter(
+            author_id__in=pulled_authors, is_published=True, published_at__isnull=False,
+        ).select_related('author')
+        if position is not None:
+            pulled = pulled.filter(keyset_filter(FEED_ORDERING, position))
+        seen = {post.pk for post in posts}
+        posts += [post for post in pulled.order_by(*FEED_ORDERING)[:limit + 1] if post.pk not in seen]
+        posts.sort(key=lambda post: (post.published_at or post.created_at, post.pk), reverse=True)
+
+    return posts[:limit], len(posts) > limit
+
+
+def feed_position(post):
+    return [post.published_at or post.created_at, post.pk]
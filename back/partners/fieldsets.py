@@ -0,0 +1,179 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .instrumentation import SerializationTimingMixin, phase
+
+
+def _param_set(request, name):
+    if request is None:
+        return None
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа параметрами запроса: ?fields=a,b оставляет только
+    перечисленные поля, ?expand=user,game - вложенные объекты, которые нужно
+    развернуть. Если задан любой из параметров, неразвернутые вложенные
+    объекты отдаются первичными ключами. Без параметров ответ не меняется.
+    Применяется только к корневому сериализатору ответа и только к чтению:
+    при записи урезанный набор полей молча отбросил бы присланные данные.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS or not self._is_response_root():
+            return fields
+        only = _param_set(request, 'fields')
+        expand = _param_set(request, 'expand')
+        if only is None and expand is None:
+            return fields
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only}
+        for name, field in list(fields.items()):
+            if isinstance(field, serializers.BaseSerializer) and name not in (expand or ()):
+                fields[name] = self._collapsed(field)
+        return fields
+
+    def _is_response_root(self):
+        parent = getattr(self, 'parent', None)
+        if parent is None:
+            return True
+        return isinstance(parent, serializers.ListSerializer) and parent.parent is None
+
+    @staticmethod
+    def _collapsed(field):
+        many = isinstance(field, serializers.ListSerializer)
+        kwargs = {'read_only': True, 'many': many}
+        if field.source and field.source != field.field_name:
+            kwargs['source'] = field.source
+        return serializers.PrimaryKeyRelatedField(**kwargs)
+
+
+# Поля, значение которых из .values() уже совпадает с представлением DRF
+PLAIN_FIELDS = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+    serializers.FloatField, serializers.PrimaryKeyRelatedField,
+)
+
+
+def _is_plain_serializer(serializer):
+    return (
+        isinstance(serializer, serializers.ModelSerializer)
+        and type(serializer).to_representation in (
+            serializers.ModelSerializer.to_representation, SerializationTimingMixin.to_representation,
+        )
+    )
+
+
+def _datetime_converter(field):
+    """
+    DateTimeField.to_representation с часовым поясом, определенным один раз
+    на весь ответ: на каждой строке DRF заново ищет текущий пояс.
+    """
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601:
+        return field.to_representation
+    tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if tz is None:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def values_plan(serializer, model=None, prefix=''):
+    """
+    План построения ответа из строк .values(): [(ключ, колонка, преобразование)]
+    или [(ключ, (колонка pk, вложенный план))] для развернутых объектов.
+    None, если сериализатор нельзя собрать без экземпляров моделей
+    (методы, свойства, переопределенный to_representation, файлы, many=True).
+    """
+    if not _is_plain_serializer(serializer):
+        return None
+    model = model or serializer.Meta.model
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        source = field.source
+        if '.' in source or source == '*':
+            return None
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        column = prefix + source
+        if isinstance(field, serializers.BaseSerializer):
+            if isinstance(field, serializers.ListSerializer) or not model_field.is_relation:
+                return None
+            nested = values_plan(field, model_field.related_model, column + '__')
+            if nested is None:
+                return None
+            plan.append((name, (column, nested)))
+        elif isinstance(field, serializers.FileField):
+            return None
+        elif isinstance(field, PLAIN_FIELDS):
+            plan.append((name, column, None))
+        elif isinstance(field, serializers.DateTimeField):
+            plan.append((name, column, _datetime_converter(field)))
+        else:
+            plan.append((name, column, field.to_representation))
+    return plan
+
+
+def plan_columns(plan):
+    columns = []
+    for entry in plan:
+        if len(entry) == 2:
+            column, nested = entry[1]
+            columns.append(column)
+            columns += plan_columns(nested)
+        else:
+            columns.append(entry[1])
+    return columns
+
+
+def build_row(plan, row):
+    data = {}
+    for entry in plan:
+        if len(entry) == 2:
+            name, (column, nested) = entry
+            data[name] = None if row[column] is None else build_row(nested, row)
+            continue
+        name, column, convert = entry
+        value = row[column]
+        data[name] = value if convert is None or value is None else convert(value)
+    return data
+
+
+def values_rows(queryset, plan):
+    return [build_row(plan, row) for row in queryset.values(*plan_columns(plan))]
+
+
+class ValuesListMixin:
+    """
+    Быстрый путь list только для чтения: ответ собирается из строк .values()
+    без создания экземпляров моделей и полного прохода сериализатора.
+    Для сериализаторов с вычисляемыми полями и при пагинации используется
+    обычный list.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is None:
+            plan = values_plan(self.get_serializer())
+            if plan is not None:
+                queryset = self.filter_queryset(self.get_queryset())
+                with phase('serialize'):
+                    return Response(values_rows(queryset, plan))
+        return super().list(request, *args, **kwargs)
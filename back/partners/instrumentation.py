@@ -0,0 +1,317 @@
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (как le в Prometheus)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'partners_http_request_duration_seconds': ('Время обработки запроса', SECONDS_BUCKETS),
+    'partners_http_request_queries': ('SQL-запросов на запрос', QUERY_BUCKETS),
+    'partners_http_request_sql_seconds': ('Суммарное время SQL', SECONDS_BUCKETS),
+    'partners_http_request_serialize_seconds': ('Время сериализаторов без SQL', SECONDS_BUCKETS),
+    'partners_http_request_render_seconds': ('Время рендеринга ответа', SECONDS_BUCKETS),
+    'partners_http_response_bytes': ('Размер ответа', BYTES_BUCKETS),
+}
+COUNTERS = {
+    'partners_http_requests_total': 'Запросов по коду ответа',
+    'partners_http_duplicate_queries_total': 'Повторов уже выполненного в запросе SQL',
+    'partners_http_n_plus_one_total': 'Запросов, где один SQL повторился не меньше DUPLICATE_QUERY_THRESHOLD раз',
+    'partners_http_slow_requests_total': 'Запросов дольше SLOW_REQUEST_MS',
+}
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Стоимость одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.phases = defaultdict(float)
+        self.active = set()
+        # Запросы асинхронного представления могут идти из нескольких потоков
+        self._lock = threading.Lock()
+
+    def record(self, sql, elapsed):
+        with self._lock:
+            self.sql_time += elapsed
+            self.queries += 1
+            # Параметры передаются отдельно, поэтому одинаковый текст - один и тот же запрос
+            self.statements[sql] += 1
+
+    def __call__(self, execute, sql, params, many, context):
+        """Как execute_wrapper: учитывает запросы одного соединения."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - started)
+
+    def add_phase(self, phase, started, sql_time):
+        """Время фазы с момента started за вычетом SQL, выполненного внутри нее."""
+        self.phases[phase] += time.perf_counter() - started - (self.sql_time - sql_time)
+
+    @property
+    def duplicates(self):
+        return self.queries - len(self.statements)
+
+    def most_repeated(self):
+        return self.statements.most_common(1)[0] if self.statements else (None, 0)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Постоянная обертка соединений: учитывает запрос в метриках текущего
+    запроса. Контекст переходит и в потоки sync_to_async, поэтому учитываются
+    и запросы асинхронных представлений.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Соединения потоков создаются лениво; новые получают обертку сразу
+connection_created.connect(install_query_recorder)
+
+
+@contextmanager
+def phase(name):
+    """
+    Учитывает время блока (без SQL внутри него) как фазу текущего запроса.
+    Вложенные блоки той же фазы (сериализатор внутри SerializerMethodField)
+    уже учтены внешним.
+    """
+    metrics = _current.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    started, sql_time = time.perf_counter(), metrics.sql_time
+    metrics.active.add(name)
+    try:
+        yield
+    finally:
+        metrics.active.discard(name)
+        metrics.add_phase(name, started, sql_time)
+
+
+class SerializationTimingMixin:
+    """Время корневого сериализатора ответа идет в фазу serialize запроса."""
+
+    def to_representation(self, instance):
+        parent = getattr(self, 'parent', None)
+        is_root = parent is None or isinstance(parent, serializers.ListSerializer) and parent.parent is None
+        metrics = _current.get()
+        if not is_root or metrics is None or 'serialize' in metrics.active:
+            return super().to_representation(instance)
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в памяти. Гистограммы и счетчики накопительные, как
+    принято в Prometheus: скользящие окна считаются на его стороне через rate().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = Counter()
+
+    def observe(self, view, method, status, metrics, duration, size):
+        labels = (('view', _escape(view)), ('method', method))
+        values = {
+            'partners_http_request_duration_seconds': duration,
+            'partners_http_request_queries': metrics.queries,
+            'partners_http_request_sql_seconds': metrics.sql_time,
+            'partners_http_request_serialize_seconds': metrics.phases['serialize'],
+            'partners_http_request_render_seconds': metrics.phases['render'],
+        }
+        if size is not None:
+            values['partners_http_response_bytes'] = size
+        _, repeated = metrics.most_repeated()
+        with self._lock:
+            for name, value in values.items():
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+            self.counters[('partners_http_requests_total', labels + (('status', str(status)),))] += 1
+            self.counters[('partners_http_duplicate_queries_total', labels)] += metrics.duplicates
+            self.counters[('partners_http_n_plus_one_total', labels)] += repeated >= duplicate_threshold()
+            self.counters[('partners_http_slow_requests_total', labels)] += duration >= slow_request_seconds()
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, labels), histogram in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+                lines.append(f'{name}_sum{{{_labels(labels)}}} {histogram.sum!r}')
+                lines.append(f'{name}_count{{{_labels(labels)}}} {cumulative}')
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [
+                f'{name}{{{_labels(labels)}}} {value}'
+                for (metric, labels), value in counters if metric == name
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def slow_request_seconds():
+    return getattr(settings, 'SLOW_REQUEST_MS', 500) / 1000
+
+
+def duplicate_threshold():
+    return getattr(settings, 'DUPLICATE_QUERY_THRESHOLD', 5)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+class InstrumentationMiddleware:
+    """
+    Считает для каждого запроса число и время SQL, повторы одного запроса
+    (признак N+1), время сериализаторов и рендеринга, размер ответа и
+    складывает их в registry по представлениям. Часть запросов
+    (PROFILE_SAMPLE_RATE) выполняется под cProfile; профиль сохраняется
+    в PROFILE_DIR, если запрос оказался медленным. Работает и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, profiler = self.start(profile=True)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(token, profiler)
+        return self.finish(request, response, metrics, profiler)
+
+    async def __acall__(self, request):
+        # cProfile видит весь поток event loop, т.е. и чужие запросы - не профилируем
+        metrics, token, profiler = self.start(profile=False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(token, profiler)
+        return self.finish(request, response, metrics, profiler)
+
+    def start(self, profile):
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        profiler = None
+        if profile and random.random() < getattr(settings, 'PROFILE_SAMPLE_RATE', 0):
+            profiler = cProfile.Profile()
+        if profiler is not None:
+            profiler.enable()
+        metrics.started = time.perf_counter()
+        return metrics, token, profiler
+
+    def stop(self, token, profiler):
+        if profiler is not None:
+            profiler.disable()
+        _current.reset(token)
+
+    def finish(self, request, response, metrics, profiler):
+        duration = time.perf_counter() - metrics.started
+        view = view_label(request)
+        size = None if response.streaming else len(response.content)
+        registry.observe(view, request.method, response.status_code, metrics, duration, size)
+        sql, repeated = metrics.most_repeated()
+        if repeated >= duplicate_threshold():
+            logger.warning('Возможный N+1 в %s: запрос повторен %d раз: %s', view, repeated, sql[:200])
+        if profiler is not None and duration >= slow_request_seconds():
+            self.dump_profile(profiler, view, duration)
+        return response
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после этого хука; конец - в post-render callback
+        metrics = _current.get()
+        if metrics is not None:
+            started, sql_time = time.perf_counter(), metrics.sql_time
+            response.add_post_render_callback(lambda rendered: metrics.add_phase('render', started, sql_time))
+        return response
+
+    @staticmethod
+    def dump_profile(profiler, view, duration):
+        directory = Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+        name = re.sub(r'[^\w.-]', '_', view)
+        path = directory / f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{duration * 1000:.0f}ms.prof'
+        profiler.dump_stats(path)
+        logger.info('Профиль медленного запроса %s сохранен в %s', view, path)
@@ -0,0 +1,82 @@
+# partners/management/commands/audit_indexes.py
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from partners.models import (
+    ContentPost, Follow, Message, Notification, PaymentTransaction,
+    ProfileStats, Review, UserGame, UserSubscription,
+)
+
+# Канонические запросы API: (название, фабрика queryset).
+# Конкретные id не важны - проверяется план, а не результат
+CANONICAL_QUERIES = [
+    ('Посты автора', lambda: ContentPost.objects.filter(
+        author_id=1, is_published=True).order_by('-published_at')[:20]),
+    ('Непрочитанные уведомления', lambda: Notification.objects.filter(
+        user_id=1, is_read=False).order_by('-created_at')[:20]),
+    ('Уведомления пользователя', lambda: Notification.objects.filter(
+        user_id=1, is_read=True).order_by('-created_at')[:20]),
+    ('История переписки', lambda: Message.objects.filter(
+        conversation_id=1).order_by('-created_at', '-message_id')[:50]),
+    ('Активные подписки', lambda: UserSubscription.objects.filter(
+        subscriber_id=1, status='active', ends_at__gt=timezone.now())),
+    ('Подписчики плана', lambda: UserSubscription.objects.filter(
+        plan_id=1, status='active', subscriber_id=1)),
+    ('Платежи пользователя', lambda: PaymentTransaction.objects.filter(
+        user_id=1, status='completed').order_by('-created_at')[:20]),
+    ('Подписчики пользователя', lambda: Follow.objects.filter(following_id=1)),
+    ('Игры пользователя', lambda: UserGame.objects.filter(user_id=1)),
+    ('Игроки в диапазоне рангов', lambda: UserGame.objects.filter(
+        game_id=1, rank_ordinal__gte=2, rank_ordinal__lte=4).values('user_id')),
+    ('Отзывы о пользователе', lambda: Review.objects.filter(target_id=1)),
+    ('Профили по рейтингу', lambda: ProfileStats.objects.order_by('-rating_avg', '-user')[:12]),
+    ('Профили по подписчикам', lambda: ProfileStats.objects.order_by('-followers_count', '-user')[:12]),
+]
+
+
+def sequential_scans(plan):
+    """Таблицы, которые план читает полным сканированием."""
+    if connection.vendor == 'postgresql':
+        return re.findall(r'Seq Scan on (\w+)', plan)
+    if connection.vendor == 'sqlite':
+        return re.findall(r'\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)', plan)
+    return []
+
+
+class Command(BaseCommand):
+    help = 'Выполняет EXPLAIN для основных запросов API и сообщает о последовательных сканированиях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true',
+                            help='Завершиться с ошибкой, если найдено последовательное сканирование')
+        parser.add_argument('--verbose-plans', action='store_true', help='Печатать планы целиком')
+
+    def handle(self, *args, **options):
+        problems = []
+        for name, build in CANONICAL_QUERIES:
+            plan = self.explain(build())
+            scans = sequential_scans(plan)
+            if scans:
+                problems.append(name)
+                self.stdout.write(self.style.WARNING(f'{name}: полное сканирование {", ".join(scans)}'))
+            else:
+                self.stdout.write(f'{name}: OK')
+            if options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if problems and options['fail']:
+            raise CommandError(f'Запросы без подходящего индекса: {len(problems)}')
+        self.stdout.write(self.style.SUCCESS(f'Проверено запросов: {len(CANONICAL_QUERIES)}'))
+
+    def explain(self, queryset):
+        # На маленьких таблицах Postgres выбирает Seq Scan даже при наличии
+        # индекса, поэтому запрещаем его: Seq Scan останется только там,
+        # где подходящего индекса нет
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
@@ -0,0 +1,284 @@
+# partners/management/commands/bench_api.py
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from partners.feed import fanout_post
+from partners.models import *
+from partners.signals import rebuild_post_counters, rebuild_profile_stats
+from partners.urls import router
+
+BASELINE_PATH = Path(settings.BASE_DIR) / 'benchmarks' / 'api_baseline.json'
+PAGE_SIZES = (12, 50, 100)
+# Параметры для дополнительных действий, которым они нужны
+ACTION_PARAMS = {
+    'search': {'q': 'bench'},
+}
+
+
+def seed_dataset(users, rng):
+    """
+    Набор данных для замеров: пользователь 0 - "горячий" (много подписчиков,
+    участник всех переписок), подписки распределены по степенному закону.
+    Данные вставляются через bulk_create, поэтому производное (статистика,
+    счетчики, ленты) собирается в конце явно; у каждого эндпоинта роутера
+    есть хотя бы одна строка, чтобы замерялись и детальные маршруты.
+    """
+    now = timezone.now()
+    games = Game.objects.bulk_create([Game(name=f'Bench Game {i}') for i in range(10)])
+    GameRank.objects.bulk_create([
+        GameRank(game=game, label=f'Rank {i}', ordinal=i) for game in games for i in range(8)
+    ])
+    people = User.objects.bulk_create([
+        User(username=f'bench_{i}', email=f'bench_{i}@example.com', bio='Ищу команду')
+        for i in range(users)
+    ])
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, timezone=f'UTC+{i % 12}', preferred_language=('ru', 'en')[i % 2])
+        for i, user in enumerate(people)
+    ])
+    UserSocialAuth.objects.bulk_create([
+        UserSocialAuth(user=user, provider='steam', provider_user_id=f'bench-{user.pk}') for user in people
+    ])
+    user_games = UserGame.objects.bulk_create([
+        UserGame(user=user, game=game, playtime_hours=rng.randint(1, 3000),
+                 current_rank=f'Rank {rank}', rank_ordinal=rank, is_primary=n == 0)
+        for user in people
+        for n, game in enumerate(rng.sample(games, 3))
+        for rank in [rng.randrange(8)]
+    ])
+    Achievement.objects.bulk_create([
+        Achievement(user_game=user_game, title='Первая победа') for user_game in user_games[::3]
+    ])
+    UserGallery.objects.bulk_create([
+        UserGallery(user=people[i % max(users // 10, 1)], image_url=f'https://example.com/bench/{i}.png',
+                    access_type=('free', 'pay_per_view')[i % 2], price='99.00')
+        for i in range(users)
+    ])
+    follows = {
+        (follower.pk, people[min(int(rng.paretovariate(1.2)) - 1, users - 1)].pk)
+        for follower in people for _ in range(5)
+    }
+    follows |= {(user.pk, people[0].pk) for user in people[1:]}
+    Follow.objects.bulk_create([
+        Follow(follower_id=a, following_id=b) for a, b in follows if a != b
+    ])
+    posts = ContentPost.objects.bulk_create([
+        ContentPost(author=people[i % max(users // 10, 1)], title=f'Bench post {i}', content='Текст поста',
+                    access_type=('free', 'subscription')[i % 2], is_published=True,
+                    published_at=now - timedelta(minutes=i))
+        for i in range(users)
+    ])
+    PostLike.objects.bulk_create([
+        PostLike(post=post, user=user)
+        for post in posts[:50] for user in rng.sample(people, min(20, users))
+    ], ignore_conflicts=True)
+    Purchase.objects.bulk_create([
+        Purchase(user=user, content_type='post', content_id=post.pk, purchase_price='99.00')
+        for user in people[:50] for post in rng.sample(posts, 3)
+    ])
+    PostComment.objects.bulk_create([
+        PostComment(post=post, author=rng.choice(people), content='Комментарий')
+        for post in posts[:50] for _ in range(5)
+    ])
+    Review.objects.bulk_create([
+        Review(author=author, target=people[0] if n == 0 else rng.choice(people), rating=rng.randint(1, 5))
+        for author in people[1:] for n in range(2)
+    ], ignore_conflicts=True)
+    plans = SubscriptionPlan.objects.bulk_create([
+        SubscriptionPlan(author=author, title='Bench plan', price_per_month='199.00')
+        for author in people[:max(users // 10, 1)]
+    ])
+    UserSubscription.objects.bulk_create([
+        UserSubscription(subscriber=user, plan=rng.choice(plans), starts_at=now, ends_at=now + timedelta(days=30))
+        for user in people[::3]
+    ])
+    conversations = Conversation.objects.bulk_create([
+        Conversation(created_by=people[0], is_group=False) for _ in range(20)
+    ])
+    ConversationParticipant.objects.bulk_create([
+        ConversationParticipant(conversation=conversation, user=user)
+        for i, conversation in enumerate(conversations) for user in {people[0], people[(i + 1) % users]}
+    ])
+    Message.objects.bulk_create([
+        Message(conversation=conversation, sender=people[0], content=f'Сообщение {n}')
+        for conversation in conversations for n in range(30)
+    ])
+    Notification.objects.bulk_create([
+        Notification(user=user, type='new_post', title='Новый пост', is_read=n % 2 == 0)
+        for user in people[:50] for n in range(10)
+    ])
+    PaymentTransaction.objects.bulk_create([
+        PaymentTransaction(user=rng.choice(people), type='subscription', amount='199.00', status='completed')
+        for _ in range(users)
+    ])
+    rebuild_profile_stats([user.pk for user in people])
+    rebuild_post_counters([post.pk for post in posts])
+    # Ленты раскладываются как при публикации (после статистики: крупные авторы пропускаются)
+    for post in posts:
+        fanout_post(post.pk)
+    return people[0]
+
+
+def admin_only(permission_classes):
+    return any(issubclass(cls, IsAdminUser) for cls in permission_classes)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет все эндпоинты роутера partners: число запросов, p50/p95 задержки и размер ответа; '
+            'сравнивает с базовой линией в репозитории')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, help='Размер набора данных (по умолчанию - из базовой линии)')
+        parser.add_argument('--repeat', type=int, default=10, help='Замеров на эндпоинт')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--baseline', default=str(BASELINE_PATH))
+        parser.add_argument('--update-baseline', action='store_true', help='Записать результаты как базовую линию')
+        parser.add_argument('--check', action='store_true', help='Завершиться с ошибкой при превышении бюджета')
+        parser.add_argument('--queries-only', action='store_true',
+                            help='Проверять только число запросов (задержка зависит от машины)')
+        parser.add_argument('--latency-tolerance', type=float, default=1.5,
+                            help='Допустимый рост p95 относительно базовой линии')
+        parser.add_argument('--latency-floor', type=float, default=5,
+                            help='Рост p95 меньше стольких мс не считается регрессией (шум на быстрых запросах)')
+        parser.add_argument('--size-tolerance', type=float, default=1.25,
+                            help='Допустимый рост размера ответа относительно базовой линии')
+
+    def handle(self, *args, **options):
+        baseline_path = Path(options['baseline'])
+        # Число запросов, размер и задержка зависят от СУБД: в файле своя
+        # базовая линия для каждой, сверка идет с линией текущей базы
+        baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        baseline = baselines.get(connection.vendor)
+        users = options['users'] or (baseline or {}).get('users', 200)
+        if baseline is None and options['check'] and not options['update_baseline']:
+            raise CommandError(f'Нет базовой линии для {connection.vendor} в {baseline_path}: '
+                               f'снимите ее с --update-baseline')
+        self.repeat = options['repeat']
+
+        # Данные живут только внутри транзакции и откатываются в конце
+        with transaction.atomic():
+            self.user = seed_dataset(users, random.Random(options['seed']))
+            self.client = APIClient()
+            self.client.force_authenticate(self.user)
+            # Выгрузки только для администраторов: иначе замерялся бы ответ 403 без запросов
+            self.staff_client = APIClient()
+            self.staff_client.force_authenticate(
+                User.objects.create(username='bench_staff', email='bench_staff@example.com', is_staff=True))
+            results = {
+                name: self.measure(self.staff_client if staff else self.client, path, params)
+                for name, path, params, staff in self.endpoints()
+            }
+            transaction.set_rollback(True)
+
+        self.report(results)
+        if options['update_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baselines[connection.vendor] = {'users': users, 'endpoints': results}
+            baseline_path.write_text(json.dumps(baselines, ensure_ascii=False, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Базовая линия {connection.vendor} записана: {baseline_path}'))
+        elif options['check']:
+            if baseline['users'] != users:
+                raise CommandError(f'Базовая линия снята на {baseline["users"]} пользователях, а не на {users}')
+            self.check_budget(results, baseline, options)
+
+    def endpoints(self):
+        """
+        (имя, путь, параметры, от администратора ли) для всех GET-эндпоинтов
+        роутера.
+        """
+        for prefix, viewset, _ in router.registry:
+            list_path = f'/api/{prefix}/'
+            staff = admin_only(viewset.permission_classes)
+            if viewset.pagination_class is not None:
+                for size in PAGE_SIZES:
+                    yield f'GET {list_path} page_size={size}', list_path, {'page_size': size}, staff
+            else:
+                yield f'GET {list_path}', list_path, {}, staff
+
+            pk = self.sample_pk(viewset)
+            detail_path = f'/api/{prefix}/{pk}/'
+            if pk is not None:
+                yield f'GET /api/{prefix}/<pk>/', detail_path, {}, staff
+            for action in viewset.get_extra_actions():
+                if 'get' not in action.mapping or (action.detail and pk is None):
+                    continue
+                path = f'{detail_path if action.detail else list_path}{action.url_path}/'
+                name = f'GET /api/{prefix}/{"<pk>/" if action.detail else ""}{action.url_path}/'
+                classes = action.kwargs.get('permission_classes', viewset.permission_classes)
+                yield name, path, ACTION_PARAMS.get(action.url_path, {}), admin_only(classes)
+
+    def sample_pk(self, viewset):
+        """Первичный ключ объекта, видимого горячему пользователю."""
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        view = viewset(request=request, action='list', kwargs={}, format_kwarg=None)
+        return view.get_queryset().order_by('pk').values_list('pk', flat=True).first()
+
+    def measure(self, client, path, params):
+        response_cache = caches['default']
+        client.get(path, params)  # прогрев
+        latencies, queries = [], 0
+        for _ in range(self.repeat):
+            # Замеряется путь без кеша ответов
+            response_cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path, params)
+                # Потоковый ответ (выгрузки) читается внутри замера: запросы идут по мере чтения
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                latencies.append(time.perf_counter() - started)
+            queries = max(queries, len(captured))
+        latencies.sort()
+        return {
+            'status': response.status_code,
+            'queries': queries,
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p95_ms': round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 2),
+            'bytes': len(content),
+        }
+
+    def report(self, results):
+        width = max(len(name) for name in results)
+        self.stdout.write(f'{"Эндпоинт":<{width}}  код  запр.   p50, мс   p95, мс     байт')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<{width}}  {result["status"]:>3}  {result["queries"]:>5}  '
+                f'{result["p50_ms"]:>8.2f}  {result["p95_ms"]:>8.2f}  {result["bytes"]:>7}'
+            )
+
+    def check_budget(self, results, baseline, options):
+        problems = []
+        for name, result in results.items():
+            budget = baseline['endpoints'].get(name)
+            if budget is None:
+                self.stdout.write(self.style.WARNING(f'{name}: нет в базовой линии'))
+                continue
+            if result['status'] != budget['status']:
+                problems.append(f'{name}: код ответа {result["status"]}, ожидался {budget["status"]}')
+            if result['queries'] > budget['queries']:
+                problems.append(f'{name}: запросов {result["queries"]}, бюджет {budget["queries"]}')
+            if result['bytes'] > budget['bytes'] * options['size_tolerance']:
+                problems.append(f'{name}: ответ {result["bytes"]} байт, бюджет {budget["bytes"]}')
+            latency_budget = max(budget['p95_ms'] * options['latency_tolerance'],
+                                 budget['p95_ms'] + options['latency_floor'])
+            if not options['queries_only'] and result['p95_ms'] > latency_budget:
+                problems.append(f'{name}: p95 {result["p95_ms"]} мс, бюджет {budget["p95_ms"]} мс')
+        for problem in problems:
+            self.stdout.write(self.style.ERROR(problem))
+        if problems:
+            raise CommandError(f'Превышен бюджет: {len(problems)}')
+        self.stdout.write(self.style.SUCCESS(f'Бюджет соблюден: {len(results)} эндпоинтов'))
@@ -0,0 +1,166 @@
+# partners/management/commands/bench_async.py
+import asyncio
+import io
+import statistics
+import threading
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test.utils import override_settings
+
+from partners.models import ContentPost, UserProfile
+
+# (название, синхронный путь под WSGI, асинхронный путь под ASGI, одинаковы ли ответы);
+# {user} - автор с наибольшим числом постов
+ENDPOINTS = [
+    ('профили', '/api/profiles/?page_size=12', '/api/async/profiles/?page_size=12', True),
+    # Асинхронная карточка собирает всю страницу профиля (с постами и планами),
+    # синхронного эндпоинта с тем же ответом нет - отношение не считается
+    ('профиль', '/api/profiles/{user}/', '/api/async/profiles/{user}/', False),
+    ('посты автора', '/api/posts/?author={user}', '/api/async/posts/?author={user}', True),
+    ('игры', '/api/games/', '/api/async/games/', True),
+]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест: пропускная способность горячих эндпоинтов чтения через backend/wsgi.py '
+            '(синхронные viewset\'ы, поток на клиента) и backend/asgi.py (partners.async_views, '
+            'один event loop). Нужны данные: seed_data --users N')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16, help='Одновременных клиентов')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность замера эндпоинта')
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help='Задержка на каждый SQL-запрос - имитация сетевой задержки до базы')
+        parser.add_argument('--only', help='Только эндпоинты, в названии которых есть эта строка')
+
+    def handle(self, *args, **options):
+        # Модули точек входа импортируются здесь: они настраивают Django при импорте
+        from backend.asgi import application as asgi_application
+        from backend.wsgi import application as wsgi_application
+
+        author = (ContentPost.objects.values('author_id').annotate(total=Count('*'))
+                  .order_by('-total').values_list('author_id', flat=True).first())
+        if author is None or not UserProfile.objects.filter(pk=author).exists():
+            raise CommandError('Нет данных: сначала seed_data --users N')
+        if options['db_latency_ms']:
+            self.install_latency(options['db_latency_ms'] / 1000)
+
+        self.clients, self.seconds = options['clients'], options['seconds']
+        self.stdout.write(f'Клиентов: {self.clients}, задержка SQL: {options["db_latency_ms"]} мс')
+        self.stdout.write(f'{"Эндпоинт":<14} {"сервер":<6} {"запр/с":>8} {"p50, мс":>8} {"p95, мс":>8} {"ошибок":>7}')
+        # Кеш ответов синхронных viewset'ов выключен: сравнивается работа с базой
+        with override_settings(RESPONSE_CACHE_TIMEOUT=0):
+            for name, sync_path, async_path, comparable in ENDPOINTS:
+                if options['only'] and options['only'] not in name:
+                    continue
+                wsgi = self.run_wsgi(wsgi_application, sync_path.format(user=author))
+                asgi = asyncio.run(self.run_asgi(asgi_application, async_path.format(user=author)))
+                self.report(name, 'WSGI', wsgi)
+                self.report(name, 'ASGI', asgi)
+                if comparable:
+                    self.stdout.write(f'{"":<14} ASGI/WSGI: x{len(asgi[0]) / max(len(wsgi[0]), 1):.2f}')
+                else:
+                    self.stdout.write(f'{"":<14} ASGI/WSGI: ответы различаются, не сравнивается')
+
+    def install_latency(self, seconds):
+        def delay(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def install(connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+        connection_created.connect(install, weak=False)
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+
+    def run_wsgi(self, application, url):
+        path, _, query = url.partition('?')
+
+        def request():
+            environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'wsgi.input': io.BytesIO()}
+            setup_testing_defaults(environ)
+            statuses = []
+            response = application(environ, lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+            return statuses[0].startswith('200')
+
+        request()  # прогрев
+        latencies, errors, lock = [], [0], threading.Lock()
+        deadline = time.perf_counter() + self.seconds
+
+        def client():
+            local, failed = [], 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                failed += not request()
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=client) for _ in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors[0]
+
+    async def run_asgi(self, application, url):
+        path, _, query = url.partition('?')
+
+        async def request():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', b'localhost')],
+                'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            }
+            sent_body = False
+            status = []
+
+            async def receive():
+                nonlocal sent_body
+                if not sent_body:
+                    sent_body = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Клиент не отключается: Django отменит ожидание после ответа
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await application(scope, receive, send)
+            return status[0] == 200
+
+        await request()  # прогрев
+        latencies, errors = [], 0
+        deadline = time.perf_counter() + self.seconds
+
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                errors += not await request()
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(client() for _ in range(self.clients)))
+        return latencies, errors
+
+    def report(self, name, server, result):
+        latencies, errors = result
+        if not latencies:
+            raise CommandError(f'{name} ({server}): ни одного запроса')
+        latencies.sort()
+        self.stdout.write(
+            f'{name:<14} {server:<6} {len(latencies) / self.seconds:8.1f} '
+            f'{statistics.median(latencies) * 1000:8.2f} '
+            f'{latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000:8.2f} {errors:>7}'
+        )
@@ -0,0 +1,94 @@
+# partners/management/commands/bench_bulk_writes.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from partners.bulk import MAX_ITEMS
+from partners.models import ContentPost, Follow, Game, GameRank, PostLike, User, UserGame
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает запись N подписок, лайков и игр пользователя по одной (save() в своей транзакции, '
+            'как при отдельном POST) с пакетными эндпоинтами .../bulk/')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=200, help=f'Элементов в пакете (не больше {MAX_ITEMS})')
+
+    def handle(self, *args, **options):
+        items = options['items']
+        if not 0 < items <= MAX_ITEMS:
+            raise CommandError(f'--items: от 1 до {MAX_ITEMS}')
+        # Тестовые данные живут только внутри транзакции и откатываются в конце
+        with transaction.atomic():
+            single, bulk = User.objects.bulk_create([
+                User(username=f'bulk_bench_{name}', email=f'bulk_bench_{name}@example.com')
+                for name in ('single', 'bulk')
+            ])
+            targets = User.objects.bulk_create([
+                User(username=f'bulk_bench_target_{i}', email=f'bulk_bench_target_{i}@example.com')
+                for i in range(items)
+            ])
+            posts = ContentPost.objects.bulk_create([
+                ContentPost(author=targets[i], title=f'Bench post {i}', content='Текст', is_published=True)
+                for i in range(items)
+            ])
+            games = Game.objects.bulk_create([Game(name=f'Bulk bench game {i}') for i in range(items)])
+            GameRank.objects.bulk_create([
+                GameRank(game=game, label=f'Rank {i}', ordinal=i) for game in games for i in range(5)
+            ])
+            cases = [
+                ('follows', Follow, 'follower', 'following', targets, {}),
+                ('post-likes', PostLike, 'user', 'post', posts, {}),
+                ('user-games', UserGame, 'user', 'game', games, {'current_rank': 'Rank 3', 'playtime_hours': 10}),
+            ]
+            self.client = APIClient()
+            self.client.force_authenticate(bulk)
+            self.stdout.write(f'Элементов: {items}')
+            self.stdout.write(f'{"Эндпоинт":<12} {"операция":<9} {"по одной, мс":>13} {"запр.":>6} '
+                              f'{"пакетом, мс":>12} {"запр.":>6} {"ускорение":>10}')
+            for prefix, model, owner_field, key_field, objects, extra in cases:
+                created = []
+
+                def create_single():
+                    for obj in objects:
+                        with transaction.atomic():
+                            created.append(model.objects.create(**{owner_field: single, key_field: obj}, **extra))
+
+                def delete_single():
+                    for obj in created:
+                        with transaction.atomic():
+                            obj.delete()
+
+                payload = [{key_field: obj.pk, **extra} for obj in objects]
+                self.compare(prefix, 'создание', create_single,
+                             lambda: self.client.post(f'/api/{prefix}/bulk/', {'items': payload}, format='json'))
+                self.compare(prefix, 'удаление', delete_single,
+                             lambda: self.client.delete(f'/api/{prefix}/bulk/', {'items': payload}, format='json'))
+            transaction.set_rollback(True)
+
+    def measure(self, func):
+        # Счетчик вместо журнала запросов: журнал ограничен и на больших пакетах обрезается
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+        return result, elapsed, queries
+
+    def compare(self, prefix, operation, single, bulk):
+        _, single_time, single_queries = self.measure(single)
+        response, bulk_time, bulk_queries = self.measure(bulk)
+        if response.status_code != 200:
+            raise CommandError(f'{prefix}: код ответа {response.status_code}: {response.content[:200]}')
+        self.stdout.write(
+            f'{prefix:<12} {operation:<9} {single_time * 1000:>13.1f} {single_queries:>6} '
+            f'{bulk_time * 1000:>12.1f} {bulk_queries:>6} {single_time / bulk_time:>9.1f}x'
+        )
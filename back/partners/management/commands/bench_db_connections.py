@@ -0,0 +1,91 @@
+# partners/management/commands/bench_db_connections.py
+import io
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Переменные окружения для каждого режима (см. DATABASES в settings.py)
+MODES = {
+    'new': {'DB_POOL': '0', 'DB_CONN_MAX_AGE': '0'},
+    'persistent': {'DB_POOL': '0', 'DB_CONN_MAX_AGE': '60'},
+    'pool': {'DB_POOL': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Запросов в секунду к API с новым соединением на запрос, постоянными соединениями '
+            'и пулом psycopg; каждый режим запускается в отдельном процессе со своим окружением')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/achievements/', help='Эндпоинт (с параметрами)')
+        parser.add_argument('--threads', type=int, default=8, help='Параллельных клиентов')
+        parser.add_argument('--seconds', type=float, default=10, help='Длительность замера режима')
+        parser.add_argument('--mode', choices=['all', *MODES], default='all')
+
+    def handle(self, *args, **options):
+        if options['mode'] != 'all':
+            return self.run_mode(options)
+        for mode, env in MODES.items():
+            command = [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_db_connections', '--mode', mode,
+                '--path', options['path'], '--threads', str(options['threads']), '--seconds', str(options['seconds']),
+            ]
+            result = subprocess.run(command, env={**os.environ, **env}, capture_output=True, text=True)
+            if result.returncode:
+                raise CommandError(f'Режим {mode} завершился с ошибкой:\n{result.stderr}')
+            self.stdout.write(result.stdout.rstrip())
+
+    def run_mode(self, options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Замер имеет смысл только для Postgres')
+        database = settings.DATABASES['default']
+        # Запрос проходит весь WSGI-цикл: по request_finished Django закрывает
+        # соединение, оставляет его открытым или возвращает в пул
+        handler = WSGIHandler()
+        url = urlsplit(options['path'])
+        deadline = time.perf_counter() + options['seconds']
+        latencies, errors, lock = [], [], threading.Lock()
+
+        def client():
+            local_latencies, local_errors = [], 0
+            while time.perf_counter() < deadline:
+                environ = {'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'wsgi.input': io.BytesIO()}
+                setup_testing_defaults(environ)
+                statuses = []
+                started = time.perf_counter()
+                response = handler(environ, lambda status, headers: statuses.append(status))
+                b''.join(response)
+                response.close()
+                local_latencies.append(time.perf_counter() - started)
+                local_errors += not statuses[0].startswith('200')
+            with lock:
+                latencies.extend(local_latencies)
+                errors.append(local_errors)
+
+        threads = [threading.Thread(target=client) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if not latencies:
+            raise CommandError('Ни одного запроса не выполнено')
+
+        latencies.sort()
+        pool = database['OPTIONS'].get('pool')
+        self.stdout.write(
+            f'{options["mode"]:<11} CONN_MAX_AGE={database["CONN_MAX_AGE"]!s:<4} pool={"да" if pool else "нет":<3}  '
+            f'{len(latencies) / elapsed:8.1f} запр/с  p50 {statistics.median(latencies) * 1000:6.2f} мс  '
+            f'p95 {latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000:6.2f} мс  ошибок {sum(errors)}'
+        )
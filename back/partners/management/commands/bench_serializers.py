@@ -0,0 +1,67 @@
+# partners/management/commands/bench_serializers.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from partners.fieldsets import values_plan, values_rows
+from partners.models import Game, User, UserGame
+from partners.renderers import FastJSONRenderer
+from partners.serializers import UserGameSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает стоимость сериализации строки /api/user-games/: полный сериализатор, ?fields=, .values() и рендереры'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3, help='Повторы, берется лучший результат')
+
+    def handle(self, *args, **options):
+        rows, self.repeat = options['rows'], options['repeat']
+        # Тестовые данные живут только внутри транзакции и откатываются в конце
+        with transaction.atomic():
+            games = Game.objects.bulk_create([Game(name=f'bench game {i}') for i in range(20)])
+            users = User.objects.bulk_create([
+                User(username=f'ser_bench_{i}', email=f'ser_bench_{i}@example.com') for i in range(rows)
+            ])
+            UserGame.objects.bulk_create([
+                UserGame(user=user, game=games[i % len(games)], playtime_hours=i, current_rank='Gold')
+                for i, user in enumerate(users)
+            ])
+            queryset = UserGame.objects.filter(user__in=users).select_related('user', 'game').order_by('pk')
+            sparse = self.request({'fields': 'user,game,playtime_hours,current_rank', 'expand': 'game'})
+
+            full_data, full = self.measure(lambda: UserGameSerializer(list(queryset), many=True).data)
+            _, sparse_time = self.measure(
+                lambda: UserGameSerializer(list(queryset), many=True, context={'request': sparse}).data)
+            plan = values_plan(UserGameSerializer(context={'request': self.request({})}))
+            values_data, values_time = self.measure(lambda: values_rows(queryset, plan))
+            _, std_render = self.measure(lambda: JSONRenderer().render(full_data))
+            _, fast_render = self.measure(lambda: FastJSONRenderer().render(full_data))
+            same = JSONRenderer().render(values_data) == JSONRenderer().render(full_data)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Строк: {rows}, мкс на строку (запрос + сериализация):')
+        self.stdout.write(f'  полный сериализатор     {full / rows * 1e6:8.1f}')
+        self.stdout.write(f'  ?fields=&expand=game    {sparse_time / rows * 1e6:8.1f}')
+        self.stdout.write(f'  .values() быстрый путь  {values_time / rows * 1e6:8.1f}  (x{full / values_time:.1f})')
+        self.stdout.write('Рендеринг JSON, мкс на строку:')
+        self.stdout.write(f'  JSONRenderer            {std_render / rows * 1e6:8.1f}')
+        self.stdout.write(f'  FastJSONRenderer        {fast_render / rows * 1e6:8.1f}  (x{std_render / fast_render:.1f})')
+        self.stdout.write(f'Ответ быстрого пути совпадает с сериализатором: {"да" if same else "НЕТ"}')
+
+    def request(self, params):
+        return Request(APIRequestFactory().get('/api/user-games/', params))
+
+    def measure(self, func):
+        best, result = None, None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
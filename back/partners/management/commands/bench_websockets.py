@@ -0,0 +1,114 @@
+# partners/management/commands/bench_websockets.py
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from partners.models import Conversation, ConversationParticipant, User
+from partners.realtime import conversation_topic, get_broker, websocket_application
+
+
+class FakeSocket:
+    """Клиент WebSocket, подключенный напрямую к ASGI-приложению."""
+
+    def __init__(self, conversation_id, user_id):
+        self.scope = {
+            'type': 'websocket',
+            'path': f'/ws/conversations/{conversation_id}/',
+            'headers': [(b'host', b'localhost'), (b'origin', b'http://localhost')],
+            'user_id': user_id,
+        }
+        self.incoming = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.received = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, event):
+        if event['type'] == 'websocket.accept':
+            self.accepted.set()
+        elif event['type'] == 'websocket.send':
+            self.received.append(time.perf_counter())
+            if len(self.received) >= self.expected:
+                self.done.set()
+
+    async def run(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        await websocket_application(self.scope, self.receive, self.send)
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест WebSocket: одновременные подключения к переписке в одном процессе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=20)
+
+    def handle(self, *args, **options):
+        connections, messages = options['connections'], options['messages']
+        # Тестовые данные живут только внутри транзакции и откатываются в конце
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'ws_bench_{i}', email=f'ws_bench_{i}@example.com')
+                for i in range(connections)
+            ])
+            conversation = Conversation.objects.create(is_group=True, created_by=users[0])
+            ConversationParticipant.objects.bulk_create([
+                ConversationParticipant(conversation=conversation, user=user) for user in users
+            ])
+            result = async_to_sync(self.run)(conversation.pk, [u.pk for u in users], messages)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Подключений: {connections}, сообщений: {messages}')
+        self.stdout.write(f'Подключение всех клиентов: {result["connect"]:.2f} с')
+        self.stdout.write(f'Доставлено событий: {result["delivered"]} за {result["elapsed"]:.2f} с '
+                          f'({result["delivered"] / result["elapsed"]:.0f} событий/с)')
+        self.stdout.write(f'Задержка доставки p50/p95: {result["p50"] * 1000:.1f} / {result["p95"] * 1000:.1f} мс')
+        self.stdout.write(f'Память на подключение: {result["memory"] / connections / 1024:.1f} КиБ')
+
+    async def run(self, conversation_id, user_ids, messages):
+        tracemalloc.start()
+        sockets = [FakeSocket(conversation_id, user_id) for user_id in user_ids]
+        for socket in sockets:
+            socket.expected = messages
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(socket.run()) for socket in sockets]
+        await asyncio.gather(*(socket.accepted.wait() for socket in sockets))
+        connect = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        broker = get_broker()
+        topic = conversation_topic(conversation_id)
+        sent_at = []
+        started = time.perf_counter()
+        for i in range(messages):
+            sent_at.append(time.perf_counter())
+            broker.publish(topic, {'type': 'message.created', 'message': {'content': f'bench {i}'}})
+            await asyncio.sleep(0)
+        await asyncio.gather(*(socket.done.wait() for socket in sockets))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(
+            received - sent_at[i]
+            for socket in sockets for i, received in enumerate(socket.received)
+        )
+        for socket in sockets:
+            await socket.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.gather(*tasks)
+        return {
+            'connect': connect,
+            'elapsed': elapsed,
+            'delivered': len(latencies),
+            'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95) - 1],
+            'memory': memory,
+        }
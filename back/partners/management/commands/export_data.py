@@ -0,0 +1,37 @@
+# partners/management/commands/export_data.py
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from partners.exports import EXPORTS, OUTPUTS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка платежей или покупок в CSV/NDJSON; память не зависит от числа строк'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--output', choices=list(OUTPUTS), default='csv')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='С даты (ГГГГ-ММ-ДД)')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='По дату включительно')
+        parser.add_argument('--status', help='Статус платежа')
+        parser.add_argument('--user', type=int, dest='user_id', help='ID пользователя')
+        parser.add_argument('--file', help='Файл (по умолчанию - stdout)')
+        parser.add_argument('--chunk-size', type=int, help='Строк, читаемых из базы за раз')
+
+    def handle(self, *args, **options):
+        chunks = stream_export(
+            options['kind'], options['output'], options['chunk_size'],
+            date_from=options['date_from'], date_to=options['date_to'],
+            status=options['status'], user_id=options['user_id'],
+        )
+        if not options['file']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        written = 0
+        with open(options['file'], 'w', encoding='utf-8', newline='') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Записано {written} символов в {options["file"]}'))
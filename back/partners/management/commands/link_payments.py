@@ -0,0 +1,29 @@
+# partners/management/commands/link_payments.py
+from django.core.management.base import BaseCommand
+
+from partners.earnings import LINK_CHUNK_SIZE, LINK_WINDOW, link_payments, rebuild_earnings
+
+
+class Command(BaseCommand):
+    help = (f'Связывает старые платежи без ссылки с покупкой или подпиской того же пользователя на ту же сумму '
+            f'(не дальше {LINK_WINDOW} по времени), проставляет им автора, если его нет, и пересобирает '
+            f'корзины дохода затронутых авторов. Сопоставление приблизительное: сначала запустите с --dry-run')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать изменения, ничего не записывая')
+        parser.add_argument('--chunk-size', type=int, default=LINK_CHUNK_SIZE,
+                            help='Платежей в одном диапазоне transaction_id')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        counts, authors = link_payments(options['chunk_size'], options['dry_run'], log=log)
+        summary = (f'Связано с покупками: {counts["purchase"]}, с подписками: {counts["subscription"]}, '
+                   f'проставлено авторов: {counts["author"]}')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{summary} (пробный запуск, изменения отменены)'))
+            return
+        self.stdout.write(summary)
+        if authors:
+            total = rebuild_earnings(authors, log=log)
+            self.stdout.write(self.style.SUCCESS(f'Корзины пересобраны для авторов: {len(authors)}, '
+                                                 f'учтено платежей: {total}'))
@@ -0,0 +1,42 @@
+# partners/management/commands/process_subscriptions.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from partners.subscriptions import BATCH_SIZE, process_due
+
+
+class Command(BaseCommand):
+    help = ('Продлевает подписки с автопродлением и завершает остальные, у которых закончился период; '
+            'безопасно запускать повторно и в нескольких процессах. С --interval работает как планировщик')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Подписок в одной транзакции')
+        parser.add_argument('--max-seconds', type=float, help='Ограничение времени запуска; остаток - в следующем')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - один запуск)')
+        parser.add_argument('--now', help='Момент обработки в ISO 8601 (по умолчанию - текущий), для проверок')
+
+    def handle(self, *args, **options):
+        now = None
+        if options['now']:
+            now = parse_datetime(options['now'])
+            if now is None:
+                raise CommandError(f'Некорректная дата: {options["now"]}')
+            if timezone.is_naive(now):
+                now = timezone.make_aware(now)
+        while True:
+            started = time.perf_counter()
+            renewed, expired = process_due(
+                now, options['batch_size'], options['max_seconds'],
+                log=self.stdout.write if options['verbosity'] > 1 else None,
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Продлено: {renewed}, завершено: {expired} за {time.perf_counter() - started:.1f} с'))
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
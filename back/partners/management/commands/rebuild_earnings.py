@@ -0,0 +1,23 @@
+# partners/management/commands/rebuild_earnings.py
+from django.core.management.base import BaseCommand
+
+from partners.earnings import REBUILD_AUTHORS_CHUNK_SIZE, rebuild_earnings
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает дневные корзины дохода (EarningsDaily) порциями авторов из платежей, у которых '
+            'уже есть автор или ссылка на подписку либо покупку; сами платежи не меняются '
+            '(старые платежи без ссылки связывает link_payments)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', type=int, action='append', dest='authors',
+                            help='ID автора (можно указать несколько раз)')
+        parser.add_argument('--chunk-size', type=int, default=REBUILD_AUTHORS_CHUNK_SIZE,
+                            help='Авторов в одной транзакции')
+
+    def handle(self, *args, **options):
+        total = rebuild_earnings(
+            options['authors'], options['chunk_size'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Учтено платежей: {total}'))
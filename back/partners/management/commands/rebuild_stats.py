@@ -0,0 +1,24 @@
+# partners/management/commands/rebuild_stats.py
+from django.core.management.base import BaseCommand
+
+from partners.comments import rebuild_comment_tree
+from partners.signals import rebuild_post_counters, rebuild_profile_stats
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает денормализованную статистику профилей (ProfileStats), счетчики постов '
+            'и положение комментариев в ветках')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='ID пользователя (можно указать несколько раз)')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Пересчет статистики профилей...')
+        total = rebuild_profile_stats(options['users'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено профилей: {total}'))
+        if not options['users']:
+            total = rebuild_post_counters()
+            self.stdout.write(self.style.SUCCESS(f'Обновлено постов: {total}'))
+            total = rebuild_comment_tree()
+            self.stdout.write(self.style.SUCCESS(f'Обновлено комментариев: {total}'))
@@ -1,14 +1,36 @@
 # partners/management/commands/seed_data.py
+import time
+
 from django.core.management.base import BaseCommand
 from partners.models import Game, User, UserGame, ContentPost
+from partners.synthetic import Scale, generate
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 class Command(BaseCommand):
-    help = 'Заполняет базу данных тестовыми данными'
+    help = ('Заполняет базу данных тестовыми данными; с --users генерирует синтетический '
+            'набор заданного масштаба для нагрузочного тестирования')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0, help='Число синтетических пользователей')
+        parser.add_argument('--follows', type=int, default=20, help='Подписок на пользователя в среднем')
+        parser.add_argument('--posts', type=int, default=0, help='Постов (по умолчанию = --users)')
+        parser.add_argument('--messages', type=int, default=0, help='Сообщений (по умолчанию 10 на пользователя)')
+        parser.add_argument('--reviews', type=int, default=0, help='Отзывов (по умолчанию = --users)')
+        parser.add_argument('--transactions', type=int, default=0, help='Платежей (по умолчанию = --users)')
+        parser.add_argument('--conversations', type=int, default=0,
+                            help='Переписок (по умолчанию - одна на 10 пользователей)')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора')
+        parser.add_argument('--prefix', default='synthetic', help='Префикс имен пользователей')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1, help='Процессов для генерации строк')
+        parser.add_argument('--copy', action='store_true', help='Загрузка через COPY (только Postgres)')
 
     def handle(self, *args, **options):
+        if options['users']:
+            return self.generate(options)
+
         self.stdout.write('Создание тестовых данных...')
         
         # Создаем игры
@@ -182,4 +204,21 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(f'Создана подписка: {subscription.subscriber.username} -> {subscription.plan.title}')
         
-        self.stdout.write(self.style.SUCCESS('Тестовые данные успешно созданы!'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS('Тестовые данные успешно созданы!'))
+    
+    def generate(self, options):
+        scale = Scale(**{
+            name: options[name]
+            for name in ('users', 'follows', 'posts', 'messages', 'reviews', 'transactions',
+                         'conversations', 'seed', 'prefix')
+        })
+        started = time.perf_counter()
+        counts, _ = generate(
+            scale, batch_size=options['batch_size'], workers=options['workers'],
+            use_copy=options['copy'], log=self.stdout.write,
+        )
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано строк: {total} за {elapsed:.1f} с ({total / elapsed:.0f} строк/с)'
+        ))
@@ -0,0 +1,183 @@
+import threading
+import time
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from .models import GameRank, UserGame, UserProfile
+
+# Вклад признаков в итоговую оценку кандидата
+WEIGHTS = {
+    'shared_game': 1.0,
+    'rank': 1.0,
+    'playtime': 0.5,
+    'timezone': 0.3,
+    'language': 0.3,
+    'rating': 0.4,
+}
+# Индексы пересобираются при изменении данных (версия в кеше) или по возрасту,
+# т.к. рейтинг в ProfileStats обновляется без сигналов
+INDEX_TTL = 300
+# Изменения данных копятся: после пересборки индекс до стольких секунд отдается
+# устаревшим, иначе при потоке записей он пересобирался бы на каждом запросе
+INDEX_REBUILD_INTERVAL = 5
+
+_indexes = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def _version_key(name):
+    return f'matchmaking:version:{name}'
+
+
+def _version(name):
+    # Версия - случайный токен: после потери ключа в кеше индекс тоже пересобирается
+    version = cache.get(_version_key(name))
+    if version is None:
+        cache.add(_version_key(name), uuid4().hex, None)
+        version = cache.get(_version_key(name))
+    return version
+
+
+def invalidate_index(name):
+    cache.set(_version_key(name), uuid4().hex, None)
+
+
+def game_index_name(game_id):
+    return f'game:{game_id}'
+
+
+class GameIndex:
+    """Кандидаты одной игры: массивы, упорядоченные по user_id."""
+
+    def __init__(self, game_id):
+        rows = list(
+            UserGame.objects.filter(game_id=game_id).order_by('user_id')
+            .values_list('user_id', 'rank_ordinal', 'playtime_hours')
+        )
+        ladder = GameRank.objects.filter(game_id=game_id).aggregate(low=Min('ordinal'), high=Max('ordinal'))
+        self.low = ladder['low'] or 0
+        self.span = max((ladder['high'] or 0) - self.low, 1)
+        self.user_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        self.rank = np.fromiter((self.position(r[1]) for r in rows), dtype=np.float32, count=len(rows))
+        self.playtime = np.log1p(np.fromiter((max(r[2], 0) for r in rows), dtype=np.float32, count=len(rows)))
+
+    def position(self, ordinal):
+        """Ранг в долях таблицы рангов игры: 0 - низший, 1 - высший, NaN - неизвестен."""
+        return np.nan if ordinal is None else (ordinal - self.low) / self.span
+
+    def score(self, rank_ordinal, playtime_hours):
+        """Частичные оценки всех игроков этой игры относительно игрока."""
+        rank_score = np.nan_to_num(1 - np.abs(self.rank - np.float32(self.position(rank_ordinal))))
+        playtime_score = np.exp(-np.abs(self.playtime - np.float32(np.log1p(max(playtime_hours, 0)))))
+        return (
+            WEIGHTS['shared_game']
+            + WEIGHTS['rank'] * rank_score
+            + WEIGHTS['playtime'] * playtime_score
+        )
+
+
+class ProfileIndex:
+    """Часовой пояс, язык и рейтинг всех профилей, упорядоченные по user_id."""
+
+    def __init__(self):
+        rows = list(
+            UserProfile.objects.order_by('user_id')
+            .values_list('user_id', 'timezone', 'preferred_language', 'user__stats__rating_avg')
+        )
+        self.user_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        self.timezones = {}
+        self.languages = {}
+        self.timezone = np.fromiter(
+            (self.timezones.setdefault(r[1], len(self.timezones)) if r[1] else -1 for r in rows),
+            dtype=np.int32, count=len(rows),
+        )
+        self.language = np.fromiter(
+            (self.languages.setdefault(r[2], len(self.languages)) if r[2] else -1 for r in rows),
+            dtype=np.int32, count=len(rows),
+        )
+        self.rating = np.fromiter((r[3] or 0 for r in rows), dtype=np.float32, count=len(rows))
+
+    def lookup(self, user_ids):
+        """Позиции user_ids в индексе и маска найденных."""
+        positions = np.searchsorted(self.user_ids, user_ids)
+        positions = np.minimum(positions, max(len(self.user_ids) - 1, 0))
+        found = (self.user_ids[positions] == user_ids) if len(self.user_ids) else np.zeros(len(user_ids), bool)
+        return positions, found
+
+
+def _fresh(entry, version):
+    if entry is None:
+        return False
+    age = time.monotonic() - entry[1]
+    return age <= INDEX_TTL and (entry[0] == version or age < INDEX_REBUILD_INTERVAL)
+
+
+def get_index(name, build):
+    entry = _indexes.get(name)
+    if _fresh(entry, _version(name)):
+        return entry[2]
+    # Своя блокировка у каждого индекса: пересборка одной игры не ждет другие
+    with _lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        # Пока ждали блокировку, индекс мог пересобрать другой поток. Версия
+        # читается до сборки: изменения во время сборки вызовут следующую
+        version = _version(name)
+        entry = _indexes.get(name)
+        if not _fresh(entry, version):
+            entry = (version, time.monotonic(), build())
+            _indexes[name] = entry
+    return entry[2]
+
+
+def find_partners(user_id, k=20, game_id=None):
+    """
+    Лучшие k напарников для игрока: [(user_id, оценка, общих игр), ...].
+    Оценки по всем общим играм считаются векторно и суммируются по кандидату.
+    """
+    my_games = UserGame.objects.filter(user_id=user_id)
+    if game_id is not None:
+        my_games = my_games.filter(game_id=game_id)
+    my_games = list(my_games.values_list('game_id', 'rank_ordinal', 'playtime_hours'))
+    if not my_games:
+        return []
+
+    # Оценки накапливаются в плотных массивах по user_id: в индексе игры
+    # каждый игрок встречается один раз, поэтому += по индексам корректно
+    indexes = [
+        (get_index(game_index_name(game), lambda: GameIndex(game)), rank, playtime)
+        for game, rank, playtime in my_games
+    ]
+    size = max((int(index.user_ids[-1]) + 1 for index, *_ in indexes if len(index.user_ids)), default=0)
+    if not size:
+        return []
+    scores = np.zeros(size)
+    shared = np.zeros(size, dtype=np.int32)
+    for index, rank, playtime in indexes:
+        scores[index.user_ids] += index.score(rank, playtime)
+        shared[index.user_ids] += 1
+    if user_id < len(shared):
+        shared[user_id] = 0
+    candidates = np.flatnonzero(shared)
+    scores, shared = scores[candidates], shared[candidates]
+
+    profiles = get_index('profiles', ProfileIndex)
+    positions, found = profiles.lookup(candidates)
+    candidates, scores, shared, positions = candidates[found], scores[found], shared[found], positions[found]
+    me, me_found = profiles.lookup(np.array([user_id], dtype=np.int64))
+    if me_found[0]:
+        my_timezone, my_language = profiles.timezone[me[0]], profiles.language[me[0]]
+        scores = scores + WEIGHTS['timezone'] * ((profiles.timezone[positions] == my_timezone) & (my_timezone >= 0))
+        scores = scores + WEIGHTS['language'] * ((profiles.language[positions] == my_language) & (my_language >= 0))
+    scores = scores + WEIGHTS['rating'] * profiles.rating[positions] / 5
+
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.lexsort((candidates[top], -scores[top]))]
+    return [(int(candidates[i]), round(float(scores[i]), 3), int(shared[i])) for i in top]
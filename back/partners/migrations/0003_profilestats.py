@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_stats(apps, schema_editor):
+    User = apps.get_model('partners', 'User')
+    ProfileStats = apps.get_model('partners', 'ProfileStats')
+    Follow = apps.get_model('partners', 'Follow')
+    Review = apps.get_model('partners', 'Review')
+    ContentPost = apps.get_model('partners', 'ContentPost')
+
+    followers = dict(Follow.objects.values_list('following').annotate(n=models.Count('*')))
+    posts = dict(ContentPost.objects.values_list('author').annotate(n=models.Count('*')))
+    reviews = {
+        target: (count, total)
+        for target, count, total in Review.objects.values_list('target').annotate(
+            n=models.Count('*'), s=models.Sum('rating'))
+    }
+    stats = []
+    for user_id in User.objects.values_list('pk', flat=True).iterator():
+        count, total = reviews.get(user_id, (0, 0))
+        stats.append(ProfileStats(
+            user_id=user_id,
+            followers_count=followers.get(user_id, 0),
+            reviews_count=count,
+            rating_sum=total,
+            rating_avg=total / count if count else 0,
+            posts_count=posts.get(user_id, 0),
+        ))
+    ProfileStats.objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0002_userprofile_remove_contentpost_id_remove_game_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('reviews_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_avg', models.FloatField(default=0)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-rating_avg', '-user'], name='stats_rating_idx'), models.Index(fields=['-followers_count', '-user'], name='stats_followers_idx')],
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
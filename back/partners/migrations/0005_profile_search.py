@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:52
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# GIN-индексы есть только в PostgreSQL, на других СУБД шаг пропускается
+SEARCH_INDEXES = [
+    ('profile_search_vector_idx', 'partners_userprofile', 'search_vector'),
+    ('user_username_trgm_idx', 'partners_user', 'username gin_trgm_ops'),
+    ('game_name_trgm_idx', 'partners_game', 'name gin_trgm_ops'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column})')
+
+    # Первичное заполнение поисковых документов
+    schema_editor.execute('''
+        UPDATE partners_userprofile AS p SET search_vector =
+            setweight(to_tsvector('simple', coalesce(u.username, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce((
+                SELECT string_agg(g.name, ' ')
+                FROM partners_usergame AS ug JOIN partners_game AS g ON g.game_id = ug.game_id
+                WHERE ug.user_id = p.user_id
+            ), '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(u.bio, '')), 'C')
+        FROM partners_user AS u
+        WHERE u.id = p.user_id
+    ''')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0004_user_newest_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='userprofile',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0005_profile_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contentpost',
+            index=models.Index(fields=['author', 'is_published', '-published_at'], name='post_author_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', '-created_at', '-message_id'], name='message_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['user', 'status', '-created_at'], name='transaction_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['subscriber', 'status', 'ends_at'], name='subscription_subscriber_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['plan', 'subscriber', 'ends_at'], name='subscription_active_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:43
+
+from django.db import migrations, models
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    ContentPost = apps.get_model('partners', 'ContentPost')
+    PostLike = apps.get_model('partners', 'PostLike')
+    PostComment = apps.get_model('partners', 'PostComment')
+
+    def count(model):
+        return Coalesce(Subquery(
+            model.objects.filter(post=models.OuterRef('pk'))
+            .order_by().values('post').annotate(total=models.Count('*')).values('total')
+        ), models.Value(0))
+
+    ContentPost.objects.update(likes_count=count(PostLike), comments_count=count(PostComment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentpost',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='contentpost',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
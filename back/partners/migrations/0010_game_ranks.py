@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0009_feed_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameRank',
+            fields=[
+                ('rank_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('label', models.CharField(max_length=100)),
+                ('ordinal', models.PositiveIntegerField()),
+            ],
+            options={
+                'ordering': ['game', 'ordinal'],
+            },
+        ),
+        migrations.AddField(
+            model_name='usergame',
+            name='max_rank_ordinal',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='usergame',
+            name='rank_ordinal',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='usergame',
+            index=models.Index(fields=['game', 'rank_ordinal', 'user'], name='usergame_rank_idx'),
+        ),
+        migrations.AddField(
+            model_name='gamerank',
+            name='game',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranks', to='partners.game'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gamerank',
+            unique_together={('game', 'label'), ('game', 'ordinal')},
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_threads(apps, schema_editor):
+    PostComment = apps.get_model('partners', 'PostComment')
+    # Родитель создан раньше ответа, поэтому при обходе по comment_id уже посчитан;
+    # для каждого комментария хранится [root, depth, ordinal, branch_rank, replies_count]
+    threads = {}
+    rows = PostComment.objects.order_by('comment_id').values_list('comment_id', 'parent_comment_id')
+    for pk, parent_id in rows.iterator(chunk_size=2000):
+        parent = threads.get(parent_id)
+        if parent is None:
+            threads[pk] = [None, 0, 0, 0, 0]
+            continue
+        parent[4] += 1
+        threads[pk] = [parent[0] or parent_id, parent[1] + 1, parent[4], max(parent[3], parent[4]), 0]
+    # Комментарии верхнего уровня без ответов уже совпадают со значениями по умолчанию
+    changed = [
+        PostComment(comment_id=pk, root_id=root, depth=depth, ordinal=ordinal,
+                    branch_rank=rank, replies_count=replies)
+        for pk, (root, depth, ordinal, rank, replies) in threads.items() if depth or replies
+    ]
+    PostComment.objects.bulk_update(
+        changed, ['root', 'depth', 'ordinal', 'branch_rank', 'replies_count'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0010_game_ranks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postcomment',
+            name='branch_rank',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='ordinal',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_comments', to='partners.postcomment'),
+        ),
+        migrations.AddIndex(
+            model_name='postcomment',
+            index=models.Index(fields=['post', 'parent_comment', 'comment_id'], name='comment_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postcomment',
+            index=models.Index(fields=['root', 'branch_rank', 'depth'], name='comment_thread_idx'),
+        ),
+        migrations.RunPython(populate_threads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0012_subscription_lifecycle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymenttransaction',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='earnings_transactions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='EarningsDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('subscriptions_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('purchases_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transactions_count', models.IntegerField(default=0)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earnings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('author', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0014_payment_sources'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='postcomment',
+            name='comment_thread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='postcomment',
+            name='branch_rank',
+        ),
+        migrations.AddIndex(
+            model_name='postcomment',
+            index=models.Index(fields=['root', 'depth'], name='comment_thread_idx'),
+        ),
+    ]
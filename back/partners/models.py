@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class User(AbstractUser):
@@ -11,6 +12,11 @@ class User(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='user_newest_idx'),
+        ]
+    
     def __str__(self):
         return self.username
 
@@ -20,6 +26,24 @@ class UserProfile(models.Model):
     city = models.CharField(max_length=100, blank=True, null=True)
     timezone = models.CharField(max_length=50, blank=True, null=True)
     preferred_language = models.CharField(max_length=10, blank=True, null=True)
+    # Поисковый документ (ник, игры, описание), заполняется search.refresh_search_vectors
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+# Денормализованная статистика пользователя, обновляется сигналами (signals.py)
+# и пересобирается командой rebuild_stats
+class ProfileStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    followers_count = models.PositiveIntegerField(default=0)
+    reviews_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_avg = models.FloatField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating_avg', '-user'], name='stats_rating_idx'),
+            models.Index(fields=['-followers_count', '-user'], name='stats_followers_idx'),
+        ]
 
 class UserSocialAuth(models.Model):
     social_id = models.BigAutoField(primary_key=True)
@@ -40,6 +64,20 @@ class Game(models.Model):
     def __str__(self):
         return self.name
 
+# Таблица рангов игры: метка ранга -> порядковый номер (больше - выше)
+class GameRank(models.Model):
+    rank_id = models.BigAutoField(primary_key=True)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='ranks')
+    label = models.CharField(max_length=100)
+    ordinal = models.PositiveIntegerField()
+    
+    class Meta:
+        ordering = ['game', 'ordinal']
+        unique_together = [['game', 'label'], ['game', 'ordinal']]
+    
+    def __str__(self):
+        return f'{self.game}: {self.label}'
+
 class UserGame(models.Model):
     user_game_id = models.BigAutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -47,10 +85,16 @@ class UserGame(models.Model):
     playtime_hours = models.IntegerField(default=0)
     current_rank = models.CharField(max_length=100, blank=True, null=True)
     max_rank = models.CharField(max_length=100, blank=True, null=True)
+    # Порядковые номера рангов по GameRank, заполняются сигналами
+    rank_ordinal = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    max_rank_ordinal = models.PositiveIntegerField(blank=True, null=True, editable=False)
     is_primary = models.BooleanField(default=False)
     
     class Meta:
         unique_together = ['user', 'game']
+        indexes = [
+            models.Index(fields=['game', 'rank_ordinal', 'user'], name='usergame_rank_idx'),
+        ]
 
 class Achievement(models.Model):
     achievement_id = models.BigAutoField(primary_key=True)
@@ -78,10 +122,34 @@ class ContentPost(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(blank=True, null=True)
+    # Денормализованные счетчики, поддерживаются сигналами PostLike/PostComment
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', 'is_published', '-published_at'], name='post_author_published_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
+# Материализованная лента: строка на (читатель, пост), заполняется при
+# публикации поста для подписчиков автора (feed.py)
+class FeedEntry(models.Model):
+    entry_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    post = models.ForeignKey(ContentPost, on_delete=models.CASCADE)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    published_at = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-published_at', '-post'], name='feed_timeline_idx'),
+            models.Index(fields=['user', 'author'], name='feed_user_author_idx'),
+        ]
+
 class UserGallery(models.Model):
     ACCESS_TYPES = [
         ('free', 'Бесплатно'),
@@ -121,7 +189,19 @@ class UserSubscription(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     starts_at = models.DateTimeField()
     ends_at = models.DateTimeField()
+    # Продлевать ли по окончании периода (partners.subscriptions)
+    auto_renew = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['subscriber', 'status', 'ends_at'], name='subscription_subscriber_idx'),
+            # Очередь планировщика: активные подписки с наступившим окончанием
+            models.Index(fields=['status', 'ends_at', 'subscription_id'], name='subscription_due_idx'),
+            # Частичный индекс: проверки доступа смотрят только активные подписки
+            models.Index(fields=['plan', 'subscriber', 'ends_at'], condition=models.Q(status='active'),
+                         name='subscription_active_idx'),
+        ]
 
 class Purchase(models.Model):
     CONTENT_TYPES = [
@@ -160,6 +240,7 @@ class ConversationParticipant(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     joined_at = models.DateTimeField(auto_now_add=True)
+    last_read_at = models.DateTimeField(blank=True, null=True)
     
     class Meta:
         unique_together = ['conversation', 'user']
@@ -172,6 +253,11 @@ class Message(models.Model):
     attachment_url = models.URLField(blank=True, null=True)
     is_edited = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', '-created_at', '-message_id'], name='message_history_idx'),
+        ]
 
 class Notification(models.Model):
     notification_id = models.BigAutoField(primary_key=True)
@@ -183,6 +269,14 @@ class Notification(models.Model):
     related_entity_id = models.BigIntegerField(blank=True, null=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_idx'),
+            # Частичный индекс для счетчика и выборки непрочитанных
+            models.Index(fields=['user', '-created_at'], condition=models.Q(is_read=False),
+                         name='notification_unread_idx'),
+        ]
 
 class Review(models.Model):
     review_id = models.BigAutoField(primary_key=True)
@@ -213,6 +307,20 @@ class PostComment(models.Model):
     parent_comment = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Положение в ветке, заполняется при создании (partners.comments.place_comment):
+    # корневой комментарий ветки (NULL у комментариев верхнего уровня), глубина
+    # и номер среди ответов родителю
+    root = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True,
+                             related_name='thread_comments', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    ordinal = models.PositiveIntegerField(default=0, editable=False)
+    replies_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'parent_comment', 'comment_id'], name='comment_level_idx'),
+            models.Index(fields=['root', 'depth'], name='comment_thread_idx'),
+        ]
 
 class PaymentTransaction(models.Model):
     TRANSACTION_TYPES = [
@@ -230,6 +338,14 @@ class PaymentTransaction(models.Model):
     
     transaction_id = models.BigAutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Автор, которому идет доход; выводится из подписки или покупки
+    # (partners.earnings.payment_author_id), пусто у выплат
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True,
+                               related_name='earnings_transactions')
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='payments')
+    purchase = models.ForeignKey(Purchase, on_delete=models.SET_NULL, blank=True, null=True,
+                                 related_name='payments')
     type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='RUB')
@@ -237,4 +353,20 @@ class PaymentTransaction(models.Model):
     payment_system = models.CharField(max_length=50, blank=True, null=True)
     payment_system_id = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status', '-created_at'], name='transaction_user_idx'),
+        ]
+
+# Доход автора за день по завершенным платежам (partners.earnings)
+class EarningsDaily(models.Model):
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='earnings')
+    day = models.DateField()
+    subscriptions_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    purchases_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    transactions_count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['author', 'day']
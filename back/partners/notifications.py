@@ -0,0 +1,69 @@
+from .models import ContentPost, Follow, Notification, Review, UserSubscription
+
+FANOUT_CHUNK_SIZE = 1000
+
+
+def iter_follower_ids(author_id, chunk_size=None):
+    """ID подписчиков автора порциями по ключу follower_id (без OFFSET)."""
+    chunk_size = chunk_size or FANOUT_CHUNK_SIZE
+    follows = Follow.objects.filter(following_id=author_id).order_by('follower_id')
+    last_id = 0
+    while True:
+        chunk = list(follows.filter(follower_id__gt=last_id).values_list('follower_id', flat=True)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def fanout_to_followers(author_id, chunk_size=None, **fields):
+    total = 0
+    for follower_ids in iter_follower_ids(author_id, chunk_size):
+        Notification.objects.bulk_create(
+            [Notification(user_id=follower_id, **fields) for follower_id in follower_ids]
+        )
+        total += len(follower_ids)
+    return total
+
+
+def post_published(post_id):
+    post = ContentPost.objects.select_related('author').filter(pk=post_id).first()
+    if post is None or not post.is_published:
+        return 0
+    return fanout_to_followers(
+        post.author_id,
+        type='new_post',
+        title=f'Новый пост от {post.author.username}',
+        message=post.title,
+        related_entity_type='post',
+        related_entity_id=post.pk,
+    )
+
+
+def subscription_created(subscription_id):
+    subscription = UserSubscription.objects.select_related('subscriber', 'plan').filter(
+        pk=subscription_id).first()
+    if subscription is None:
+        return
+    Notification.objects.create(
+        user_id=subscription.plan.author_id,
+        type='new_subscription',
+        title=f'Новый подписчик: {subscription.subscriber.username}',
+        message=subscription.plan.title,
+        related_entity_type='subscription',
+        related_entity_id=subscription.pk,
+    )
+
+
+def review_created(review_id):
+    review = Review.objects.select_related('author').filter(pk=review_id).first()
+    if review is None:
+        return
+    Notification.objects.create(
+        user_id=review.target_id,
+        type='new_review',
+        title=f'Новый отзыв от {review.author.username}',
+        message=review.comment,
+        related_entity_type='review',
+        related_entity_id=review.pk,
+    )
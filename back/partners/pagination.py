@@ -0,0 +1,149 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def page_size_from(request, default, maximum, param='page_size'):
+    try:
+        size = int(request.query_params.get(param, default))
+    except ValueError:
+        return default
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def ordering_fields(model, ordering, annotations=None):
+    """Поля ключа сортировки (модели или аннотаций) - по ним проверяется курсор."""
+    fields = []
+    for name in ordering:
+        name = name.lstrip('-')
+        if annotations and name in annotations:
+            fields.append(annotations[name].output_field)
+            continue
+        opts = model._meta
+        for part in name.split('__'):
+            field = opts.get_field(part)
+            if field.is_relation:
+                opts = field.related_model._meta
+        fields.append(field)
+    return fields
+
+
+def decode_cursor(cursor, fields):
+    """
+    Значения ключа из курсора, приведенные к типам полей fields: курсор
+    приходит от клиента, и исправленный вручную должен давать 404, а не
+    ошибку в запросе.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (TypeError, ValueError):
+        raise NotFound('Некорректный курсор')
+    if not isinstance(values, list) or len(values) != len(fields) or None in values:
+        raise NotFound('Некорректный курсор')
+    try:
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (TypeError, ValueError, ValidationError):
+        raise NotFound('Некорректный курсор')
+
+
+def keyset_filter(ordering, values, reverse=False):
+    """
+    Условие "строго после" (или "строго до" при reverse=True) позиции values
+    для составного ключа ordering: (a > x) | (a = x & b > y) | ...
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def row_position(obj, ordering):
+    values = []
+    for field in ordering:
+        value = obj
+        for part in field.lstrip('-').split('__'):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по составному ключу сортировки queryset.
+    Последнее поле сортировки должно быть уникальным, курсор хранит значения
+    ключа последней строки страницы, поэтому глубина страницы не влияет на
+    стоимость запроса (нет OFFSET).
+    """
+    page_size = 12
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        return page_size_from(request, self.page_size, self.max_page_size, self.page_size_query_param)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.cut_page(list(self.page_queryset(queryset, request)))
+
+    # Две половины paginate_queryset - для асинхронных представлений,
+    # которые выполняют запрос страницы сами (partners.async_views)
+    def page_queryset(self, queryset, request):
+        """Queryset страницы с одной лишней строкой - признаком следующей."""
+        self.request = request
+        self.ordering = list(queryset.query.order_by)
+        self.limit = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            fields = ordering_fields(queryset.model, self.ordering, queryset.query.annotations)
+            values = decode_cursor(cursor, fields)
+            queryset = queryset.filter(keyset_filter(self.ordering, values))
+        return queryset[:self.limit + 1]
+
+    def cut_page(self, rows):
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.next_position = row_position(rows[-1], self.ordering) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
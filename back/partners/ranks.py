@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from rest_framework.exceptions import ValidationError
+
+from . import matchmaking
+from .models import GameRank, UserGame
+
+
+def rank_ordinals(game_id, labels):
+    """Порядковые номера меток рангов игры (без учета регистра): {метка: номер}."""
+    labels = [label for label in labels if label]
+    if not labels:
+        return {}
+    condition = Q()
+    for label in labels:
+        condition |= Q(label__iexact=label)
+    ordinals = {
+        label.lower(): ordinal
+        for label, ordinal in GameRank.objects.filter(condition, game_id=game_id).values_list('label', 'ordinal')
+    }
+    return {label: ordinals.get(label.lower()) for label in labels}
+
+
+def rank_tables(game_ids):
+    """Таблицы рангов нескольких игр одним запросом: {game_id: {метка в нижнем регистре: номер}}."""
+    tables = defaultdict(dict)
+    for game_id, label, ordinal in GameRank.objects.filter(game_id__in=game_ids).values_list('game_id', 'label', 'ordinal'):
+        tables[game_id][label.lower()] = ordinal
+    return tables
+
+
+def sync_rank_ordinals(game_id):
+    """Пересчитывает порядковые номера рангов всех игроков игры двумя UPDATE."""
+    games = UserGame.objects.filter(game_id=game_id)
+    for field, label_field in (('rank_ordinal', 'current_rank'), ('max_rank_ordinal', 'max_rank')):
+        games.update(**{field: Subquery(
+            GameRank.objects.filter(game_id=game_id, label__iexact=OuterRef(label_field)).values('ordinal')[:1]
+        )})
+
+
+def _sync_scheduled():
+    connection = transaction.get_connection()
+    game_ids, connection.rank_sync_games = connection.rank_sync_games, set()
+    for game_id in sorted(game_ids):
+        sync_rank_ordinals(game_id)
+        matchmaking.invalidate_index(matchmaking.game_index_name(game_id))
+
+
+def schedule_rank_sync(game_id):
+    """
+    Пересчет номеров рангов игры после коммита: сколько бы рангов ни
+    изменилось в транзакции (таблица рангов в админке), каждая игра
+    пересчитывается один раз - первый из отложенных вызовов забирает все
+    накопленные игры, остальные ничего не делают. Игры из откаченной
+    транзакции пересчитаются со следующим коммитом, это безвредно.
+    """
+    connection = transaction.get_connection()
+    if not hasattr(connection, 'rank_sync_games'):
+        connection.rank_sync_games = set()
+    connection.rank_sync_games.add(game_id)
+    transaction.on_commit(_sync_scheduled)
+
+
+def _bound(game_id, value, name):
+    if value.isdigit():
+        return int(value)
+    ordinal = rank_ordinals(game_id, [value])[value]
+    if ordinal is None:
+        raise ValidationError({name: f'Неизвестный ранг: {value}'})
+    return ordinal
+
+
+def filter_by_rank(queryset, game_id=None, rank=None, rank_min=None, rank_max=None):
+    """
+    Фильтр профилей по рангу. С игрой - диапазон порядковых номеров по индексу
+    (game, rank_ordinal, user); без игры - совпадение с меткой ранга в таблице
+    рангов любой игры пользователя.
+    """
+    if game_id:
+        condition = {'user__usergame__game_id': game_id}
+        if rank:
+            condition['user__usergame__rank_ordinal'] = _bound(game_id, rank, 'rank')
+        if rank_min:
+            condition['user__usergame__rank_ordinal__gte'] = _bound(game_id, rank_min, 'rank_min')
+        if rank_max:
+            condition['user__usergame__rank_ordinal__lte'] = _bound(game_id, rank_max, 'rank_max')
+        # Все условия в одном filter() - они относятся к одной строке UserGame
+        return queryset.filter(**condition)
+    if rank:
+        return queryset.filter(Exists(UserGame.objects.filter(
+            user_id=OuterRef('user_id'),
+            game__ranks__label__iexact=rank,
+            rank_ordinal=F('game__ranks__ordinal'),
+        )))
+    return queryset
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import re
+from collections import defaultdict
+from functools import lru_cache
+from http.cookies import SimpleCookie
+from importlib import import_module
+from threading import Lock
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, connection
+from django.http import HttpRequest
+from django.http.request import split_domain_port, validate_host
+from django.utils.http import is_same_domain
+from django.utils.module_loading import import_string
+
+from .models import ConversationParticipant
+from .serializers import MessageSerializer
+
+CONVERSATION_PATH = re.compile(r'^/ws/conversations/(?P<conversation_id>\d+)/$')
+
+# Коды закрытия WebSocket из диапазона приложения (4000-4999)
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+
+
+def conversation_topic(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+class InMemoryBroker:
+    """
+    Pub/sub внутри процесса. publish() можно вызывать из любого потока
+    (сигналы ORM выполняются в синхронном коде), доставка идет в очереди
+    подписчиков через их event loop. Другой брокер подключается настройкой
+    REALTIME_BROKER и должен реализовать те же subscribe/unsubscribe/publish.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = Lock()
+
+    def subscribe(self, topic):
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[topic].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, topic, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(topic, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(topic, None)
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        return len(subscribers)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    path = getattr(settings, 'REALTIME_BROKER', 'partners.realtime.InMemoryBroker')
+    return import_string(path)()
+
+
+def publish_message(message, created):
+    event = {
+        'type': 'message.created' if created else 'message.updated',
+        'message': MessageSerializer(message).data,
+    }
+    get_broker().publish(conversation_topic(message.conversation_id), event)
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def origin_allowed(scope):
+    """
+    Origin рукопожатия проверяется так же, как CsrfViewMiddleware проверяет
+    POST: тот же хост, что в заголовке Host (и он есть в ALLOWED_HOSTS), или
+    CSRF_TRUSTED_ORIGINS. Иначе любая страница, которую открыл вошедший
+    пользователь, могла бы подключиться с его cookie и читать переписку.
+    Браузер отправляет Origin всегда, поэтому без него рукопожатие отклоняется.
+    """
+    origin = _header(scope, b'origin')
+    if not origin or origin == 'null':
+        return False
+    parsed = urlsplit(origin)
+    if not parsed.scheme or not parsed.netloc:
+        return False
+    host = _header(scope, b'host')
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    if host and parsed.netloc == host and validate_host(split_domain_port(host)[0], allowed_hosts):
+        return True
+    for trusted in settings.CSRF_TRUSTED_ORIGINS:
+        trusted = urlsplit(trusted)
+        if trusted.scheme != parsed.scheme:
+            continue
+        if trusted.netloc == parsed.netloc:
+            return True
+        if trusted.netloc.startswith('*') and is_same_domain(parsed.netloc, trusted.netloc[1:]):
+            return True
+    return False
+
+
+def _session_user_id(scope):
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    # Пользователь сессии - через django.contrib.auth, как у AuthenticationMiddleware:
+    # get_user сверяет хеш сессии, и после смены пароля старые сессии не действуют
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(request)
+    return user.pk if user.is_authenticated else None
+
+
+def _is_participant(conversation_id, user_id):
+    return ConversationParticipant.objects.filter(
+        conversation_id=conversation_id, user_id=user_id
+    ).exists()
+
+
+def _close_old_connections():
+    # Соединение внутри открытой транзакции (тесты, нагрузочный тест) не трогаем
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+@sync_to_async
+def authorize(scope, conversation_id):
+    _close_old_connections()
+    try:
+        # user_id может положить в scope внешний ASGI-middleware аутентификации
+        user_id = scope.get('user_id') or _session_user_id(scope)
+        return user_id is not None and _is_participant(conversation_id, user_id)
+    finally:
+        _close_old_connections()
+
+
+async def websocket_application(scope, receive, send):
+    """
+    /ws/conversations/<id>/ - поток событий переписки для ее участника:
+    {"type": "message.created" | "message.updated", "message": {...}}.
+    Отправка сообщений по-прежнему идет через REST API.
+    """
+    match = CONVERSATION_PATH.match(scope['path'])
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    conversation_id = int(match['conversation_id'])
+    if not origin_allowed(scope) or not await authorize(scope, conversation_id):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    broker = get_broker()
+    topic = conversation_topic(conversation_id)
+    queue = broker.subscribe(topic)
+    await send({'type': 'websocket.accept'})
+
+    async def forward():
+        while True:
+            event = await queue.get()
+            await send({'type': 'websocket.send', 'text': json.dumps(event, ensure_ascii=False)})
+
+    forwarder = asyncio.create_task(forward())
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            if event['type'] == 'websocket.receive' and event.get('text') == 'ping':
+                await send({'type': 'websocket.send', 'text': 'pong'})
+    finally:
+        forwarder.cancel()
+        broker.unsubscribe(topic, queue)
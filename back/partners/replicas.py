@@ -0,0 +1,95 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.viewsets import ViewSetMixin
+
+# Реплика, с которой читает текущий запрос (одна на запрос - одинаковая задержка)
+_replica = ContextVar('replica', default=None)
+
+# Сессии и пользователи читаются с основной базы: иначе сразу после входа
+# реплика с задержкой репликации "не узнает" сессию
+PRIMARY_APPS = {'sessions', 'auth', 'contenttypes', 'admin'}
+
+
+@contextmanager
+def primary_reads():
+    """Чтения внутри блока идут с основной базы, даже в запросе, читающем с реплики."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтения внутри безопасного запроса к viewset'у уходят на реплику,
+    выбранную для запроса из DATABASE_REPLICAS. Первая запись в запросе
+    возвращает его чтения на основную базу, чтобы запрос видел свои
+    изменения; внутри транзакции чтение тоже идет с основной базы.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica is None:
+            return None
+        if model._meta.app_label in PRIMARY_APPS or model is get_user_model():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        _replica.set(None)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaMiddleware:
+    """
+    Помечает GET/HEAD/OPTIONS-запросы к viewset'ам и к представлениям
+    с атрибутом read_replica (partners.async_views) как читающие с реплик.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _replica.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _replica.reset(token)
+
+    async def __acall__(self, request):
+        token = _replica.set(None)
+        try:
+            return await self.get_response(request)
+        finally:
+            _replica.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        view_class = getattr(view_func, 'cls', None)
+        readonly = getattr(view_func, 'read_replica', False) or (
+            view_class is not None and issubclass(view_class, ViewSetMixin))
+        if replicas and readonly and request.method in SAFE_METHODS:
+            _replica.set(random.choice(replicas))
@@ -0,0 +1,99 @@
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, TrigramSimilarity,
+)
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Q
+
+from .models import Game, User, UserGame, UserProfile
+
+# Словарь 'simple' - без стемминга, ники и названия игр не языковые
+SEARCH_CONFIG = 'simple'
+
+
+def is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def prefix_query(text):
+    """Строит tsquery вида 'pro:* & gam:*' для поиска по мере набора."""
+    tokens = re.findall(r'[^\W_]+', text.lower())
+    if not tokens:
+        return None
+    raw = ' & '.join(f"'{token}':*" for token in tokens)
+    return SearchQuery(raw, search_type='raw', config=SEARCH_CONFIG)
+
+
+def filter_profiles(queryset, text):
+    """Фильтр профилей по нику, описанию и названиям игр."""
+    if is_postgres():
+        query = prefix_query(text)
+        if query is None:
+            return queryset.none()
+        # OR условий по двум таблицам не раскладывается на индексы (BitmapOr
+        # работает в пределах одной таблицы), поэтому каждое условие - свой
+        # подзапрос по своему GIN-индексу, а профили выбираются по их UNION
+        matches = UserProfile.objects.filter(search_vector=query).values('user_id').union(
+            User.objects.filter(username__trigram_similar=text).values('pk')
+        )
+        return queryset.filter(user_id__in=matches)
+    # Запасной вариант для других СУБД: без JOIN и DISTINCT по играм
+    games = UserGame.objects.filter(user=OuterRef('user'), game__name__icontains=text)
+    return queryset.filter(Q(user__username__icontains=text) | Q(Exists(games)))
+
+
+def search_profiles(queryset, text):
+    """Профили, отсортированные по релевантности запросу."""
+    queryset = filter_profiles(queryset, text)
+    if not is_postgres():
+        return queryset.order_by('user__username', 'user_id')
+    return queryset.annotate(
+        search_rank=SearchRank(F('search_vector'), prefix_query(text))
+        + TrigramSimilarity('user__username', text),
+    ).order_by('-search_rank', 'user_id')
+
+
+def search_games(text):
+    queryset = Game.objects.all()
+    if not is_postgres():
+        return queryset.filter(name__icontains=text).order_by('name')
+    return queryset.annotate(
+        similarity=TrigramSimilarity('name', text),
+    ).filter(
+        Q(name__istartswith=text) | Q(name__trigram_similar=text)
+    ).order_by('-similarity', 'name')
+
+
+def refresh_search_vectors(user_ids=None):
+    """
+    Пересчитывает UserProfile.search_vector: ник (вес A), названия игр (B)
+    и описание (C). Вызывается сигналами при записи; без user_ids - для всех.
+    """
+    if not is_postgres():
+        return
+    profile = UserProfile._meta.db_table
+    user = UserProfile._meta.get_field('user').related_model._meta.db_table
+    user_game = UserGame._meta.db_table
+    game = Game._meta.db_table
+    sql = f'''
+        UPDATE {profile} AS p SET search_vector =
+            setweight(to_tsvector(%s, coalesce(u.username, '')), 'A') ||
+            setweight(to_tsvector(%s, coalesce((
+                SELECT string_agg(g.name, ' ')
+                FROM {user_game} AS ug JOIN {game} AS g ON g.game_id = ug.game_id
+                WHERE ug.user_id = p.user_id
+            ), '')), 'B') ||
+            setweight(to_tsvector(%s, coalesce(u.bio, '')), 'C')
+        FROM {user} AS u
+        WHERE u.id = p.user_id
+    '''
+    params = [SEARCH_CONFIG] * 3
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        sql += ' AND p.user_id = ANY(%s)'
+        params.append(user_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
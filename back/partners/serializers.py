@@ -1,32 +1,46 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import models
 from .models import *
+from .access import get_entitlements
+from .fieldsets import SparseFieldsMixin
+from .instrumentation import SerializationTimingMixin
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+# Базовый сериализатор моделей с выбором полей через ?fields=/?expand=
+# и учетом времени сериализации в метриках запроса
+class ModelSerializer(SerializationTimingMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    pass
+
+class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'avatar_url', 'bio', 'created_at')
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(ModelSerializer):
     user = UserSerializer(read_only=True)
     
     class Meta:
         model = UserProfile
-        fields = '__all__'
+        exclude = ('search_vector',)
 
-class UserSocialAuthSerializer(serializers.ModelSerializer):
+class UserSocialAuthSerializer(ModelSerializer):
     class Meta:
         model = UserSocialAuth
         fields = '__all__'
 
-class GameSerializer(serializers.ModelSerializer):
+class GameSerializer(ModelSerializer):
     class Meta:
         model = Game
         fields = '__all__'
 
-class UserGameSerializer(serializers.ModelSerializer):
+class GameRankSerializer(ModelSerializer):
+    class Meta:
+        model = GameRank
+        fields = ['rank_id', 'game', 'label', 'ordinal']
+
+class UserGameSerializer(ModelSerializer):
     game = GameSerializer(read_only=True)
     user = UserSerializer(read_only=True)
     
@@ -34,95 +48,198 @@ class UserGameSerializer(serializers.ModelSerializer):
         model = UserGame
         fields = '__all__'
 
-class AchievementSerializer(serializers.ModelSerializer):
+class AchievementSerializer(ModelSerializer):
     class Meta:
         model = Achievement
         fields = '__all__'
 
-class ContentPostSerializer(serializers.ModelSerializer):
+class ContentPostListSerializer(serializers.ListSerializer):
+    # Лайки текущего пользователя для всей страницы - одним запросом
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        # Асинхронные представления передают лайки в контексте готовыми
+        if 'liked_post_ids' not in self.context and user is not None and user.is_authenticated:
+            self.context['liked_post_ids'] = set(
+                PostLike.objects.filter(user=user, post__in=posts).values_list('post_id', flat=True)
+            )
+        return super().to_representation(posts)
+
+class ContentPostSerializer(ModelSerializer):
     author = UserSerializer(read_only=True)
-    likes_count = serializers.SerializerMethodField()
-    comments_count = serializers.SerializerMethodField()
+    is_liked = serializers.SerializerMethodField()
+    is_locked = serializers.SerializerMethodField()
     
     class Meta:
         model = ContentPost
         fields = '__all__'
+        list_serializer_class = ContentPostListSerializer
+    
+    def get_is_liked(self, obj):
+        liked = self.context.get('liked_post_ids')
+        if liked is not None:
+            return obj.pk in liked
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return False
+        return PostLike.objects.filter(post=obj, user=user).exists()
     
-    def get_likes_count(self, obj):
-        return obj.postlike_set.count()
+    def get_is_locked(self, obj):
+        return not get_entitlements(self.context).can_view(obj)
     
-    def get_comments_count(self, obj):
-        return obj.postcomment_set.count()
+    # Закрытый контент отдается без текста, остаются заголовок, превью и цена
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'content' in data and self.get_is_locked(instance):
+            data['content'] = None
+        return data
 
-class UserGallerySerializer(serializers.ModelSerializer):
+class UserGallerySerializer(ModelSerializer):
+    is_locked = serializers.SerializerMethodField()
+    
     class Meta:
         model = UserGallery
         fields = '__all__'
+    
+    def get_is_locked(self, obj):
+        return not get_entitlements(self.context).can_view(obj)
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'image_url' in data and self.get_is_locked(instance):
+            data['image_url'] = None
+        return data
 
-class SubscriptionPlanSerializer(serializers.ModelSerializer):
+class SubscriptionPlanSerializer(ModelSerializer):
     author = UserSerializer(read_only=True)
     
     class Meta:
         model = SubscriptionPlan
         fields = '__all__'
 
-class UserSubscriptionSerializer(serializers.ModelSerializer):
+class UserSubscriptionSerializer(ModelSerializer):
     class Meta:
         model = UserSubscription
         fields = '__all__'
 
-class PurchaseSerializer(serializers.ModelSerializer):
+class PurchaseSerializer(ModelSerializer):
     class Meta:
         model = Purchase
         fields = '__all__'
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(ModelSerializer):
     class Meta:
         model = Follow
         fields = '__all__'
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(ModelSerializer):
     class Meta:
         model = Conversation
         fields = '__all__'
 
-class ConversationParticipantSerializer(serializers.ModelSerializer):
+class ConversationParticipantSerializer(ModelSerializer):
     class Meta:
         model = ConversationParticipant
         fields = '__all__'
 
-class MessageSerializer(serializers.ModelSerializer):
+# Строка входящих: переписка, последнее сообщение и число непрочитанных,
+# поля last_message_* и unread_count аннотируются в ConversationViewSet.inbox
+class ConversationInboxSerializer(ModelSerializer):
+    conversation = ConversationSerializer(read_only=True)
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = ConversationParticipant
+        fields = ('conversation', 'joined_at', 'last_read_at', 'last_message', 'unread_count')
+    
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'message_id': obj.last_message_id,
+            'sender': obj.last_message_sender,
+            'content': obj.last_message_content,
+            'created_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
+class MessageSerializer(ModelSerializer):
     class Meta:
         model = Message
         fields = '__all__'
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(ModelSerializer):
     class Meta:
         model = Review
         fields = '__all__'
 
-class PostLikeSerializer(serializers.ModelSerializer):
+class PostLikeSerializer(ModelSerializer):
     class Meta:
         model = PostLike
         fields = '__all__'
 
-class PostCommentSerializer(serializers.ModelSerializer):
+class PostCommentSerializer(ModelSerializer):
     class Meta:
         model = PostComment
-        fields = '__all__'
+        # Служебные поля ветки нужны только для выборки превью
+        exclude = ('root', 'ordinal')
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        # Место в дереве (root, depth, ordinal) задается при создании,
+        # поэтому пост и родителя существующего комментария не меняют
+        if self.instance is not None:
+            for name in ('post', 'parent_comment'):
+                if name in fields:
+                    fields[name].read_only = True
+        return fields
+    
+    def validate(self, attrs):
+        parent = attrs.get('parent_comment')
+        if parent is not None and parent.post_id != attrs['post'].pk:
+            raise serializers.ValidationError({'parent_comment': 'Комментарий другого поста'})
+        return attrs
+
+# Комментарий с ответами: ветка собрана заранее (partners.comments.attach_replies)
+class PostCommentTreeSerializer(ModelSerializer):
+    author = UserSerializer(read_only=True)
+    replies = serializers.SerializerMethodField()
+    more_replies = serializers.CharField(read_only=True)
+    
+    class Meta:
+        model = PostComment
+        fields = ('comment_id', 'post', 'parent_comment', 'author', 'content', 'created_at',
+                  'depth', 'replies_count', 'replies', 'more_replies')
+    
+    def get_replies(self, obj):
+        return PostCommentTreeSerializer(obj.replies, many=True, context=self.context).data
 
-class PaymentTransactionSerializer(serializers.ModelSerializer):
+class PaymentTransactionSerializer(ModelSerializer):
     class Meta:
         model = PaymentTransaction
         fields = '__all__'
+        # Автор дохода выводится из подписки или покупки (partners.earnings)
+        read_only_fields = ('author',)
+    
+    def validate(self, attrs):
+        user = attrs.get('user', getattr(self.instance, 'user', None))
+        subscription = attrs.get('subscription')
+        purchase = attrs.get('purchase')
+        if subscription and subscription.subscriber_id != getattr(user, 'pk', None):
+            raise serializers.ValidationError({'subscription': 'Подписка другого пользователя'})
+        if purchase and purchase.user_id != getattr(user, 'pk', None):
+            raise serializers.ValidationError({'purchase': 'Покупка другого пользователя'})
+        return attrs
 
 # Новый сериализатор для отображения профилей с играми
-class ProfileWithGamesSerializer(serializers.ModelSerializer):
+class ProfileWithGamesSerializer(ModelSerializer):
     user = UserSerializer(read_only=True)
     user_games = serializers.SerializerMethodField()
     followers_count = serializers.SerializerMethodField()
@@ -130,17 +247,37 @@ class ProfileWithGamesSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = UserProfile
-        fields = '__all__'
+        exclude = ('search_vector',)
     
+    # Игры берутся из prefetch в UserProfileViewSet.get_queryset, счетчики -
+    # из денормализованной ProfileStats; запросы ниже - только запасной вариант
     def get_user_games(self, obj):
-        user_games = UserGame.objects.filter(user=obj.user)
+        user_games = getattr(obj.user, 'prefetched_games', None)
+        if user_games is None:
+            user_games = UserGame.objects.filter(user=obj.user).select_related('game')
         return UserGameSerializer(user_games, many=True).data
     
     def get_followers_count(self, obj):
-        return Follow.objects.filter(following=obj.user).count()
+        stats = getattr(obj.user, 'stats', None)
+        return stats.followers_count if stats else 0
     
     def get_rating(self, obj):
-        reviews = Review.objects.filter(target=obj.user)
-        if reviews.exists():
-            return round(sum([r.rating for r in reviews]) / reviews.count(), 1)
-        return 0
\ No newline at end of file
+        stats = getattr(obj.user, 'stats', None)
+        return round(stats.rating_avg, 1) if stats else 0
+
+# Элементы пакетной записи (partners.bulk): только идентификаторы и значения,
+# без запросов - цели проверяются одним запросом на весь список
+class FollowItemSerializer(serializers.Serializer):
+    following = serializers.IntegerField(min_value=1)
+
+class PostLikeItemSerializer(serializers.Serializer):
+    post = serializers.IntegerField(min_value=1)
+
+class UserGameKeySerializer(serializers.Serializer):
+    game = serializers.IntegerField(min_value=1)
+
+class UserGameItemSerializer(UserGameKeySerializer):
+    playtime_hours = serializers.IntegerField(min_value=0, default=0)
+    current_rank = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
+    max_rank = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
+    is_primary = serializers.BooleanField(default=False)
@@ -0,0 +1,447 @@
+from django.db.models import (
+    Case, Count, F, FloatField, OuterRef, QuerySet, Subquery, Sum, Value, When,
+)
+from django.db import transaction
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import feed, matchmaking, notifications
+
+from .access import invalidate_entitlements
+from .caching import invalidate_responses
+from .comments import place_comment, update_replies_count
+from .earnings import EarningsDelta, payment_author_id
+from .models import (
+    ContentPost, FeedEntry, Follow, Game, GameRank, Message, PaymentTransaction, PostComment,
+    PostLike, ProfileStats, Purchase, Review, SubscriptionPlan, User, UserGame, UserProfile,
+    UserSubscription,
+)
+from .ranks import rank_ordinals, schedule_rank_sync
+from .realtime import publish_message
+from .search import refresh_search_vectors
+from .tasks import enqueue
+
+BATCH_SIZE = 2000
+
+
+def update_profile_stats(user_id, followers=0, reviews=0, rating=0, posts=0):
+    """Атомарно применяет приращения к ProfileStats пользователя."""
+    changes = {
+        'followers_count': F('followers_count') + followers,
+        'reviews_count': F('reviews_count') + reviews,
+        'rating_sum': F('rating_sum') + rating,
+        'posts_count': F('posts_count') + posts,
+    }
+    if reviews or rating:
+        # В одном UPDATE F() ссылается на старые значения, поэтому среднее
+        # считается по уже сдвинутым сумме и количеству
+        changes['rating_avg'] = Case(
+            When(reviews_count__gt=-reviews, then=(
+                Cast(F('rating_sum') + rating, FloatField()) / (F('reviews_count') + reviews)
+            )),
+            default=0.0,
+            output_field=FloatField(),
+        )
+
+    updated = ProfileStats.objects.filter(user_id=user_id).update(**changes)
+    if not updated:
+        # Строки ещё нет (пользователь создан до появления таблицы) -
+        # собираем её целиком из исходных данных
+        rebuild_profile_stats([user_id])
+
+
+def rebuild_profile_stats(user_ids=None):
+    """Пересчитывает ProfileStats из Follow, Review и ContentPost."""
+    def aggregate(queryset, field, value):
+        return Coalesce(Subquery(
+            queryset.filter(**{field: OuterRef('pk')})
+            .order_by().values(field).annotate(total=value).values('total')
+        ), Value(0))
+
+    users = User.objects.order_by('pk')
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    users = users.annotate(
+        followers_total=aggregate(Follow.objects.all(), 'following', Count('*')),
+        reviews_total=aggregate(Review.objects.all(), 'target', Count('*')),
+        rating_total=aggregate(Review.objects.all(), 'target', Sum('rating')),
+        posts_total=aggregate(ContentPost.objects.all(), 'author', Count('*')),
+    ).values_list('pk', 'followers_total', 'reviews_total', 'rating_total', 'posts_total')
+
+    total = 0
+    batch = []
+    for pk, followers, reviews, rating, posts in users.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ProfileStats(
+            user_id=pk,
+            followers_count=followers,
+            reviews_count=reviews,
+            rating_sum=rating,
+            rating_avg=rating / reviews if reviews else 0,
+            posts_count=posts,
+        ))
+        if len(batch) == BATCH_SIZE:
+            total += _save_stats(batch)
+            batch = []
+    if batch:
+        total += _save_stats(batch)
+    return total
+
+
+def _save_stats(batch):
+    ProfileStats.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['followers_count', 'reviews_count', 'rating_sum', 'rating_avg', 'posts_count'],
+    )
+    return len(batch)
+
+
+def update_post_counters(post_id, likes=0, comments=0):
+    ContentPost.objects.filter(pk=post_id).update(
+        likes_count=F('likes_count') + likes,
+        comments_count=F('comments_count') + comments,
+    )
+
+
+def rebuild_post_counters(post_ids=None):
+    """Пересчитывает likes_count/comments_count постов одним UPDATE."""
+    def count(model):
+        return Coalesce(Subquery(
+            model.objects.filter(post=OuterRef('pk'))
+            .order_by().values('post').annotate(total=Count('*')).values('total')
+        ), Value(0))
+
+    posts = ContentPost.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    return posts.update(likes_count=count(PostLike), comments_count=count(PostComment))
+
+
+def _is_being_deleted(user_id, origin):
+    # При каскадном удалении пользователя его собственную статистику не трогаем
+    if isinstance(origin, User):
+        return origin.pk == user_id
+    if isinstance(origin, QuerySet) and origin.model is User:
+        return origin.filter(pk=user_id).exists()
+    return False
+
+
+@receiver(post_save, sender=User)
+def create_profile_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ProfileStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_profile_stats(instance.following_id, followers=1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, origin=None, **kwargs):
+    if _is_being_deleted(instance.following_id, origin):
+        return
+    update_profile_stats(instance.following_id, followers=-1)
+
+
+@receiver(pre_save, sender=Review)
+def review_remember_previous(sender, instance, raw=False, **kwargs):
+    # Оценку можно изменить - запоминаем прежнее значение для корректной дельты
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        update_profile_stats(instance.target_id, reviews=1, rating=instance.rating)
+    elif previous != instance.rating:
+        update_profile_stats(instance.target_id, rating=instance.rating - previous)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, origin=None, **kwargs):
+    if _is_being_deleted(instance.target_id, origin):
+        return
+    update_profile_stats(instance.target_id, reviews=-1, rating=-instance.rating)
+
+
+@receiver(post_save, sender=ContentPost)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_profile_stats(instance.author_id, posts=1)
+
+
+@receiver(post_delete, sender=ContentPost)
+def post_deleted(sender, instance, origin=None, **kwargs):
+    if _is_being_deleted(instance.author_id, origin):
+        return
+    update_profile_stats(instance.author_id, posts=-1)
+
+
+@receiver(post_save, sender=PostLike)
+def like_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_post_counters(instance.post_id, likes=1)
+
+
+@receiver(post_delete, sender=PostLike)
+def like_deleted(sender, instance, **kwargs):
+    update_post_counters(instance.post_id, likes=-1)
+
+
+@receiver(pre_save, sender=PostComment)
+def comment_place_in_thread(sender, instance, raw=False, **kwargs):
+    if instance._state.adding and not raw:
+        place_comment(instance)
+
+
+@receiver(post_save, sender=PostComment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_post_counters(instance.post_id, comments=1)
+        if instance.parent_comment_id:
+            update_replies_count(instance.parent_comment_id, 1)
+
+
+@receiver(post_delete, sender=PostComment)
+def comment_deleted(sender, instance, **kwargs):
+    update_post_counters(instance.post_id, comments=-1)
+    if instance.parent_comment_id:
+        # При каскадном удалении ветки родителя уже может не быть - UPDATE ничего не изменит
+        update_replies_count(instance.parent_comment_id, -1)
+
+
+# Поисковый индекс профилей (search_vector) пересчитывается при изменении
+# ника/описания, самого профиля, набора игр пользователя или названия игры
+@receiver(post_save, sender=User)
+def user_search_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_search_vectors([instance.pk])
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_search_changed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        refresh_search_vectors([instance.user_id])
+
+
+@receiver(post_save, sender=UserGame)
+@receiver(post_delete, sender=UserGame)
+def user_game_search_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_search_vectors([instance.user_id])
+
+
+@receiver(post_save, sender=Game)
+def game_search_changed(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        refresh_search_vectors(
+            UserGame.objects.filter(game=instance).values_list('user_id', flat=True)
+        )
+
+
+# Кешированные права доступа зрителя сбрасываются при покупке или
+# изменении его подписок
+@receiver(post_save, sender=UserSubscription)
+@receiver(post_delete, sender=UserSubscription)
+def subscription_changed(sender, instance, **kwargs):
+    invalidate_entitlements(instance.subscriber_id)
+
+
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+def purchase_changed(sender, instance, **kwargs):
+    invalidate_entitlements(instance.user_id)
+
+
+# Дневные корзины дохода авторов следуют за завершенными платежами:
+# при изменении платежа снимается его прежний вклад и добавляется новый
+@receiver(pre_save, sender=PaymentTransaction)
+def payment_remember_previous(sender, instance, raw=False, **kwargs):
+    instance._previous_payment = None
+    if raw:
+        return
+    if instance.pk:
+        instance._previous_payment = PaymentTransaction.objects.filter(pk=instance.pk).first()
+    # Автор дохода выводится на сервере из подписки или покупки
+    instance.author_id = payment_author_id(instance)
+
+
+@receiver(post_save, sender=PaymentTransaction)
+def payment_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    delta = EarningsDelta()
+    previous = getattr(instance, '_previous_payment', None)
+    if previous is not None:
+        delta.add_transaction(previous, sign=-1)
+    delta.add_transaction(instance)
+    if delta:
+        delta.apply()
+
+
+@receiver(post_delete, sender=PaymentTransaction)
+def payment_deleted(sender, instance, **kwargs):
+    delta = EarningsDelta()
+    delta.add_transaction(instance, sign=-1)
+    if delta:
+        delta.apply()
+
+
+# Новые и отредактированные сообщения уходят подписчикам WebSocket
+# после фиксации транзакции
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: publish_message(instance, created))
+
+
+# Уведомления рассылаются фоновыми задачами, чтобы время публикации
+# не зависело от числа подписчиков автора
+@receiver(pre_save, sender=ContentPost)
+def post_remember_published(sender, instance, raw=False, **kwargs):
+    instance._was_published = False
+    if instance.pk and not raw:
+        instance._was_published = ContentPost.objects.filter(
+            pk=instance.pk, is_published=True).exists()
+    if instance.is_published and instance.published_at is None:
+        instance.published_at = timezone.now()
+
+
+@receiver(post_save, sender=ContentPost)
+def post_published(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    was_published = getattr(instance, '_was_published', False)
+    if instance.is_published and not was_published:
+        enqueue(notifications.post_published, instance.pk)
+        enqueue(feed.fanout_post, instance.pk)
+    elif was_published and not instance.is_published:
+        FeedEntry.objects.filter(post=instance).delete()
+
+
+@receiver(post_save, sender=UserSubscription)
+def subscription_notify(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue(notifications.subscription_created, instance.pk)
+        enqueue(feed.backfill_follower, instance.subscriber_id, instance.plan.author_id)
+
+
+# Закончившаяся или отмененная подписка убирает посты автора из ленты,
+# если читатель не подписан на него бесплатно
+@receiver(post_save, sender=UserSubscription)
+def subscription_ended_feed(sender, instance, raw=False, **kwargs):
+    if not raw and instance.status != 'active':
+        enqueue(feed.remove_author, instance.subscriber_id, instance.plan.author_id)
+
+
+@receiver(post_delete, sender=UserSubscription)
+def subscription_deleted_feed(sender, instance, **kwargs):
+    enqueue(feed.remove_author, instance.subscriber_id, instance.plan.author_id)
+
+
+# Ленты читателей следуют за подписками
+@receiver(post_save, sender=Follow)
+def follow_feed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue(feed.backfill_follower, instance.follower_id, instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def unfollow_feed(sender, instance, **kwargs):
+    enqueue(feed.remove_author, instance.follower_id, instance.following_id)
+
+
+@receiver(post_save, sender=Review)
+def review_notify(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue(notifications.review_created, instance.pk)
+
+
+# Индексы подбора напарников пересобираются при изменении игр или профилей
+@receiver(post_save, sender=UserGame)
+@receiver(post_delete, sender=UserGame)
+def user_game_matchmaking_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        matchmaking.invalidate_index(matchmaking.game_index_name(instance.game_id))
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_matchmaking_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        matchmaking.invalidate_index('profiles')
+
+
+# Порядковые номера рангов следуют за метками игрока и таблицей рангов игры
+@receiver(pre_save, sender=UserGame)
+def user_game_rank_ordinals(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ordinals = rank_ordinals(instance.game_id, [instance.current_rank, instance.max_rank])
+    instance.rank_ordinal = ordinals.get(instance.current_rank)
+    instance.max_rank_ordinal = ordinals.get(instance.max_rank)
+
+
+@receiver(post_save, sender=GameRank)
+@receiver(post_delete, sender=GameRank)
+def game_rank_changed(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Game):
+        return
+    schedule_rank_sync(instance.game_id)
+
+
+# Кешированные ответы каталога (partners.caching): сигнал меняет поколение
+# списка и, где можно, только затронутого профиля
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+@receiver(post_save, sender=GameRank)
+@receiver(post_delete, sender=GameRank)
+def game_responses_changed(sender, instance, **kwargs):
+    invalidate_responses('games', 'profiles')
+
+
+@receiver(post_save, sender=SubscriptionPlan)
+@receiver(post_delete, sender=SubscriptionPlan)
+def plan_responses_changed(sender, instance, **kwargs):
+    invalidate_responses('plans')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_responses_changed(sender, instance, update_fields=None, **kwargs):
+    # Вход в систему обновляет только last_login, которого нет в ответах
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_responses('profiles', 'plans', f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=UserGame)
+@receiver(post_delete, sender=UserGame)
+def profile_responses_changed(sender, instance, **kwargs):
+    invalidate_responses('profiles', f'user:{instance.user_id}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_responses_changed(sender, instance, **kwargs):
+    invalidate_responses('profiles', f'user:{instance.following_id}')
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_responses_changed(sender, instance, **kwargs):
+    invalidate_responses('profiles', f'user:{instance.target_id}')
@@ -0,0 +1,118 @@
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import feed
+from .access import invalidate_entitlements
+from .earnings import EarningsDelta
+from .models import Notification, PaymentTransaction, SubscriptionPlan, UserSubscription
+from .tasks import enqueue
+
+RENEWAL_PERIOD = timedelta(days=30)
+BATCH_SIZE = 1000
+
+
+def due_subscriptions(now):
+    """Активные подписки, период которых закончился, по индексу (status, ends_at, id)."""
+    return UserSubscription.objects.filter(status='active', ends_at__lte=now).order_by('ends_at', 'subscription_id')
+
+
+def process_batch(now, batch_size=None):
+    """
+    Продлевает или завершает одну порцию подписок в отдельной транзакции:
+    два UPDATE и два INSERT ... SELECT (платежи и уведомления) по списку id
+    и прибавка к дневному доходу авторов (partners.earnings),
+    без построчной работы в Python. Строки порции блокируются, а занятые
+    другим процессом пропускаются (SKIP LOCKED), поэтому планировщики не
+    мешают друг другу и запросам к таблице. Обработанная подписка выходит
+    из выборки (истекла или ее период продлен за now), так что повторный
+    запуск продолжает с оставшихся. Возвращает (продлено, завершено).
+    """
+    batch_size = batch_size or BATCH_SIZE
+    created_at = connection.ops.adapt_datetimefield_value(now)
+    with transaction.atomic():
+        rows = list(
+            due_subscriptions(now).select_for_update(skip_locked=True, of=('self',))
+            .values_list('subscription_id', 'subscriber_id', 'auto_renew', 'plan__is_active',
+                         'plan__author_id', 'plan__price_per_month')[:batch_size]
+        )
+        renewed = [row for row in rows if row[2] and row[3]]
+        expired = [row[0] for row in rows if not (row[2] and row[3])]
+        renewed_ids = [row[0] for row in renewed]
+
+        # Пропущенные периоды не доначисляются: продление идет от now
+        UserSubscription.objects.filter(pk__in=renewed_ids).update(
+            ends_at=ExpressionWrapper(Greatest(F('ends_at'), Value(now)) + RENEWAL_PERIOD,
+                                      output_field=DateTimeField()))
+        UserSubscription.objects.filter(pk__in=expired).update(status='expired')
+
+        _insert_from_subscriptions(
+            PaymentTransaction,
+            ['user_id', 'author_id', 'subscription_id', 'type', 'amount', 'currency', 'status', 'description',
+             'created_at'],
+            "s.subscriber_id, p.author_id, s.subscription_id, 'subscription', p.price_per_month, %s, 'completed', "
+            "%s || p.title || %s, %s",
+            ['RUB', 'Продление подписки «', '»', created_at], renewed_ids,
+        )
+        # Платежи вставлены в обход сигналов - доход авторов учитывается здесь
+        earnings = EarningsDelta()
+        for _, _, _, _, author_id, price in renewed:
+            earnings.add(author_id, timezone.localdate(now), 'subscription', price)
+        earnings.apply()
+        # Статус уже обновлен: по нему выбирается вид уведомления
+        _insert_from_subscriptions(
+            Notification,
+            ['user_id', 'type', 'title', 'related_entity_type', 'related_entity_id', 'is_read', 'created_at'],
+            "s.subscriber_id, CASE WHEN s.status = 'expired' THEN 'subscription_expired' "
+            "ELSE 'subscription_renewed' END, "
+            "%s || p.title || CASE WHEN s.status = 'expired' THEN %s ELSE %s END, "
+            "'subscription', s.subscription_id, %s, %s",
+            ['Подписка «', '» закончилась', '» продлена', False, created_at], renewed_ids + expired,
+        )
+        # Посты авторов закончившихся подписок уходят из лент после фиксации
+        enqueue(feed.remove_authors, [(row[1], row[4]) for row in rows if not (row[2] and row[3])])
+    # Права доступа подписчиков могли закешироваться до продления
+    invalidate_entitlements(*{row[1] for row in rows})
+    return len(renewed), len(expired)
+
+
+def _insert_from_subscriptions(model, columns, select, params, subscription_ids):
+    """INSERT ... SELECT строк model по подпискам (s) и их планам (p)."""
+    if not subscription_ids:
+        return
+    subscription = UserSubscription._meta.db_table
+    plan = SubscriptionPlan._meta.db_table
+    placeholders = ', '.join(['%s'] * len(subscription_ids))
+    sql = f'''
+        INSERT INTO {model._meta.db_table} ({', '.join(columns)})
+        SELECT {select}
+        FROM {subscription} AS s JOIN {plan} AS p ON p.plan_id = s.plan_id
+        WHERE s.subscription_id IN ({placeholders})
+        ORDER BY s.subscription_id
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, *subscription_ids])
+
+
+def process_due(now=None, batch_size=None, max_seconds=None, log=None):
+    """
+    Обрабатывает порции подписок, пока они есть или пока не вышло время
+    max_seconds (остаток подхватит следующий запуск). Возвращает
+    (продлено, завершено).
+    """
+    now = now or timezone.now()
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    total_renewed = total_expired = 0
+    while deadline is None or time.monotonic() < deadline:
+        renewed, expired = process_batch(now, batch_size)
+        if not renewed and not expired:
+            break
+        total_renewed += renewed
+        total_expired += expired
+        if log:
+            log(f'Продлено: {total_renewed}, завершено: {total_expired}')
+    return total_renewed, total_expired
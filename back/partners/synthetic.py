@@ -0,0 +1,411 @@
+"""
+Генератор синтетических данных для нагрузочного тестирования (seed_data --users).
+
+Строки генерируются порциями, при необходимости в нескольких процессах, и
+загружаются пакетными INSERT либо COPY (Postgres) в обход моделей и сигналов.
+Распределения неравномерные: популярность пользователей и активность
+переписок подчиняются степенному закону, поэтому в данных есть "горячие"
+авторы и переписки. Производные данные (ProfileStats, счетчики постов,
+поисковые векторы) пересчитываются в конце.
+"""
+import csv
+import io
+import multiprocessing
+import random
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+import django
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (
+    ContentPost, Conversation, ConversationParticipant, Follow, Game, GameRank, Message,
+    PaymentTransaction, PostComment, PostLike, Review, SubscriptionPlan, User, UserGame,
+    UserProfile, UserSubscription,
+)
+
+YEAR = 365 * 24 * 3600
+# Чем больше, тем сильнее популярность сосредоточена на первых пользователях
+SKEW = 3.0
+RANKS = ['Iron', 'Bronze', 'Silver', 'Gold', 'Platinum', 'Diamond', 'Master', 'Legend']
+TIMEZONES = ['UTC+3', 'UTC+2', 'UTC+5', 'UTC+0', 'UTC-5', 'UTC+8']
+LANGUAGES = ['ru', 'ru', 'ru', 'en', 'en', 'de']
+CITIES = [('Россия', 'Москва'), ('Россия', 'Санкт-Петербург'), ('Казахстан', 'Алматы'),
+          ('Германия', 'Берлин'), ('США', 'Нью-Йорк')]
+
+
+@dataclass
+class Scale:
+    users: int
+    follows: int = 20
+    posts: int = 0
+    messages: int = 0
+    reviews: int = 0
+    transactions: int = 0
+    conversations: int = 0
+    likes: int = 5
+    comments: int = 2
+    games: int = 10
+    seed: int = 1
+    prefix: str = 'synthetic'
+
+    def __post_init__(self):
+        # Объемы по умолчанию - пропорционально числу пользователей
+        self.posts = self.posts or self.users
+        self.messages = self.messages or self.users * 10
+        self.reviews = self.reviews or self.users
+        self.transactions = self.transactions or self.users
+        self.conversations = self.conversations or max(self.users // 10, 1)
+
+
+def popular(rng, n):
+    """Индекс в [0, n) со степенным распределением: 0 - самый популярный."""
+    return min(int(n * rng.random() ** SKEW), n - 1)
+
+
+def amount(rng, mean):
+    """Случайное количество со средним mean (экспоненциальное распределение)."""
+    return int(rng.expovariate(1 / mean)) if mean > 0 else 0
+
+
+def moment(rng, now):
+    return now - timedelta(seconds=rng.randrange(YEAR))
+
+
+# Генераторы строк: (rng, params, start, stop) -> список кортежей в порядке
+# колонок TABLES[kind]. Ссылки на пользователей, посты, переписки и планы -
+# явные id от базовых значений в params, поэтому порции независимы.
+
+def gen_users(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        user_id = p['user_base'] + i
+        joined = moment(rng, p['now'])
+        rows.append((user_id, '!', f'{p["prefix"]}_{user_id}', f'{p["prefix"]}_{user_id}@example.com',
+                     'Ищу команду для рейтинговых игр', joined, joined, joined))
+    return rows
+
+
+def gen_profiles(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        country, city = rng.choice(CITIES)
+        rows.append((p['user_base'] + i, country, city, rng.choice(TIMEZONES), rng.choice(LANGUAGES)))
+    return rows
+
+
+def gen_user_games(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        games = rng.sample(p['game_ids'], min(rng.randint(1, 4), len(p['game_ids'])))
+        for n, game_id in enumerate(games):
+            rank = min(int(len(RANKS) * rng.random() ** 1.5), len(RANKS) - 1)
+            best = rng.randint(rank, len(RANKS) - 1)
+            rows.append((p['user_base'] + i, game_id, int(rng.paretovariate(1.1) * 20),
+                         RANKS[rank], RANKS[best], rank, best, n == 0))
+    return rows
+
+
+def gen_follows(rng, p, start, stop):
+    rows = []
+    users = p['users']
+    for i in range(start, stop):
+        targets = {popular(rng, users) for _ in range(amount(rng, p['follows']))}
+        targets.discard(i)
+        rows += [(p['user_base'] + i, p['user_base'] + t, moment(rng, p['now'])) for t in targets]
+    return rows
+
+
+def gen_posts(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        created = moment(rng, p['now'])
+        access = rng.choices(('free', 'subscription', 'pay_per_view'), (70, 25, 5))[0]
+        published = rng.random() < 0.95
+        rows.append((p['post_base'] + i, p['user_base'] + popular(rng, p['users']), f'Пост {i}',
+                     'Разбор матча, советы по позиционированию и выбору героев. ' * 3, access,
+                     '299.00' if access == 'pay_per_view' else '0.00', published,
+                     created, created, created if published else None))
+    return rows
+
+
+def gen_likes(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        likers = {rng.randrange(p['users']) for _ in range(amount(rng, p['likes']))}
+        rows += [(p['post_base'] + i, p['user_base'] + u, moment(rng, p['now'])) for u in likers]
+    return rows
+
+
+def gen_comments(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        for _ in range(amount(rng, p['comments'])):
+            rows.append((p['post_base'] + i, p['user_base'] + rng.randrange(p['users']),
+                         'Спасибо, полезно!', moment(rng, p['now'])))
+    return rows
+
+
+def gen_plans(rng, p, start, stop):
+    return [
+        (p['plan_base'] + i, p['user_base'] + i, 'Поддержка автора', 'Закрытые разборы и стримы',
+         rng.choice(('199.00', '299.00', '499.00')), True)
+        for i in range(start, stop)
+    ]
+
+
+def gen_subscriptions(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        if rng.random() >= 0.2:
+            continue
+        starts = moment(rng, p['now'])
+        ends = starts + timedelta(days=30)
+        rows.append((p['user_base'] + i, p['plan_base'] + popular(rng, p['plans']),
+                     'active' if ends > p['now'] else 'expired', starts, ends, rng.random() < 0.7, starts))
+    return rows
+
+
+def participants(seed, users, conversation):
+    """Участники переписки: популярный пользователь и случайный собеседник."""
+    rng = random.Random(f'{seed}:participants:{conversation}')
+    first = popular(rng, users)
+    second = rng.randrange(users)
+    return (first,) if second == first else (first, second)
+
+
+def gen_conversations(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        members = participants(p['seed'], p['users'], i)
+        rows.append((p['conversation_base'] + i, False, None, p['user_base'] + members[0], moment(rng, p['now'])))
+    return rows
+
+
+def gen_participants(rng, p, start, stop):
+    return [
+        (p['conversation_base'] + i, p['user_base'] + member, p['now'] - timedelta(days=365), None)
+        for i in range(start, stop) for member in participants(p['seed'], p['users'], i)
+    ]
+
+
+def gen_messages(rng, p, start, stop):
+    rows = []
+    members = {}
+    for _ in range(start, stop):
+        # "Горячие" переписки получают большую часть сообщений
+        conversation = popular(rng, p['conversations'])
+        if conversation not in members:
+            members[conversation] = participants(p['seed'], p['users'], conversation)
+        rows.append((p['conversation_base'] + conversation, p['user_base'] + rng.choice(members[conversation]),
+                     'Го в пати вечером?', False, moment(rng, p['now'])))
+    return rows
+
+
+def gen_reviews(rng, p, start, stop):
+    rows = []
+    per_author = p['reviews'] / p['users']
+    for i in range(start, stop):
+        targets = {popular(rng, p['users']) for _ in range(amount(rng, per_author))}
+        targets.discard(i)
+        rows += [(p['user_base'] + i, p['user_base'] + t, rng.choices((1, 2, 3, 4, 5), (5, 5, 15, 35, 40))[0],
+                  'Отличный тиммейт', moment(rng, p['now'])) for t in targets]
+    return rows
+
+
+def gen_transactions(rng, p, start, stop):
+    rows = []
+    for i in range(start, stop):
+        kind = rng.choices(('subscription', 'one_time_purchase', 'payout'), (70, 25, 5))[0]
+        status = rng.choices(('completed', 'pending', 'failed', 'refunded'), (85, 5, 7, 3))[0]
+        # Доход идет популярным авторам, у выплат автора нет
+        author = None if kind == 'payout' else p['user_base'] + popular(rng, p['users'])
+        rows.append((p['user_base'] + rng.randrange(p['users']), author, kind,
+                     rng.choice(('199.00', '299.00', '499.00')), status, 'synthetic', f'{p["prefix"]}-{i}',
+                     moment(rng, p['now'])))
+    return rows
+
+
+# kind -> (модель, колонки, генератор); остальные поля модели получают
+# значения по умолчанию. Порядок - порядок загрузки (внешние ключи).
+TABLES = {
+    'users': (User, ['id', 'password', 'username', 'email', 'bio', 'date_joined', 'created_at', 'updated_at'],
+              gen_users),
+    'profiles': (UserProfile, ['user_id', 'country', 'city', 'timezone', 'preferred_language'], gen_profiles),
+    'user_games': (UserGame, ['user_id', 'game_id', 'playtime_hours', 'current_rank', 'max_rank',
+                              'rank_ordinal', 'max_rank_ordinal', 'is_primary'], gen_user_games),
+    'follows': (Follow, ['follower_id', 'following_id', 'created_at'], gen_follows),
+    'posts': (ContentPost, ['post_id', 'author_id', 'title', 'content', 'access_type', 'price', 'is_published',
+                            'created_at', 'updated_at', 'published_at'], gen_posts),
+    'likes': (PostLike, ['post_id', 'user_id', 'created_at'], gen_likes),
+    'comments': (PostComment, ['post_id', 'author_id', 'content', 'created_at'], gen_comments),
+    'plans': (SubscriptionPlan, ['plan_id', 'author_id', 'title', 'description', 'price_per_month', 'is_active'],
+              gen_plans),
+    'subscriptions': (UserSubscription, ['subscriber_id', 'plan_id', 'status', 'starts_at', 'ends_at',
+                                         'auto_renew', 'created_at'], gen_subscriptions),
+    'conversations': (Conversation, ['conversation_id', 'is_group', 'title', 'created_by_id', 'created_at'],
+                      gen_conversations),
+    'participants': (ConversationParticipant, ['conversation_id', 'user_id', 'joined_at', 'last_read_at'],
+                     gen_participants),
+    'messages': (Message, ['conversation_id', 'sender_id', 'content', 'is_edited', 'created_at'], gen_messages),
+    'reviews': (Review, ['author_id', 'target_id', 'rating', 'comment', 'created_at'], gen_reviews),
+    'transactions': (PaymentTransaction, ['user_id', 'author_id', 'type', 'amount', 'status', 'payment_system',
+                                          'payment_system_id', 'created_at'], gen_transactions),
+}
+
+
+def generate_chunk(task):
+    kind, start, stop, params = task
+    rng = random.Random(f'{params["seed"]}:{kind}:{start}')
+    return TABLES[kind][2](rng, params, start, stop)
+
+
+class TableWriter:
+    """Пакетная запись строк в таблицу модели: COPY на Postgres или executemany."""
+
+    def __init__(self, model, columns, use_copy):
+        self.model = model
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        fields = {field.attname: field for field in model._meta.concrete_fields}
+        self.fields = [fields[column] for column in columns]
+        # Недостающие поля (кроме автоинкрементного ключа) - значения по умолчанию
+        now = timezone.now()
+        self.tail = []
+        for field in model._meta.concrete_fields:
+            if field.attname in columns or (field.primary_key and isinstance(field, models.AutoField)):
+                continue
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                value = now
+            else:
+                value = field.get_default()
+            self.fields.append(field)
+            self.tail.append(value)
+        self.tail = tuple(self.tail)
+        # Подготовка значений нужна только типам, которые драйвер не примет как есть
+        self.prepare = [
+            field if isinstance(field, (models.DateTimeField, models.DecimalField)) else None
+            for field in self.fields
+        ]
+
+    def write(self, rows):
+        if not rows:
+            return 0
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        columns = ', '.join(quote(field.column) for field in self.fields)
+        with connection.cursor() as cursor:
+            if self.use_copy:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow(['\\N' if value is None else value for value in row + self.tail])
+                sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+                if hasattr(cursor.cursor, 'copy'):  # psycopg 3
+                    with cursor.cursor.copy(sql) as copy:
+                        copy.write(buffer.getvalue())
+                else:
+                    buffer.seek(0)
+                    cursor.cursor.copy_expert(sql, buffer)
+            else:
+                placeholders = ', '.join(['%s'] * len(self.fields))
+                cursor.executemany(
+                    f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                    [self.adapt(row + self.tail) for row in rows],
+                )
+        return len(rows)
+
+    def adapt(self, row):
+        return [
+            value if field is None or value is None else field.get_db_prep_save(value, connection)
+            for field, value in zip(self.prepare, row)
+        ]
+
+
+def _next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+def _ensure_games(count):
+    """Синтетические игры с таблицами рангов (создаются один раз)."""
+    games = list(Game.objects.filter(name__startswith='Synthetic Game ').order_by('pk')[:count])
+    for i in range(len(games), count):
+        game = Game.objects.create(name=f'Synthetic Game {i + 1}', description='Сгенерированная игра')
+        GameRank.objects.bulk_create([
+            GameRank(game=game, label=label, ordinal=ordinal) for ordinal, label in enumerate(RANKS)
+        ])
+        games.append(game)
+    return [game.pk for game in games]
+
+
+def _chunks(total, size):
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def generate(scale, batch_size=5000, workers=1, use_copy=False, log=None):
+    """
+    Генерирует и загружает набор данных. Возвращает число строк по таблицам
+    и id первого (самого популярного) пользователя.
+    """
+    log = log or (lambda message: None)
+    params = asdict(scale)
+    params['plans'] = max(scale.users // 50, 1)
+    params['now'] = timezone.now()
+    counts = {}
+    sizes = {
+        'users': scale.users, 'profiles': scale.users, 'user_games': scale.users, 'follows': scale.users,
+        'posts': scale.posts, 'likes': scale.posts, 'comments': scale.posts, 'plans': params['plans'],
+        'subscriptions': scale.users, 'conversations': scale.conversations,
+        'participants': scale.conversations, 'messages': scale.messages, 'reviews': scale.users,
+        'transactions': scale.transactions,
+    }
+    # spawn: дочерние процессы не наследуют открытые соединения с БД. Инициализатор -
+    # сам django.setup: этот модуль импортирует модели и загрузится только после него
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(workers, initializer=django.setup)
+    try:
+        with transaction.atomic():
+            params['game_ids'] = _ensure_games(scale.games)
+            params['user_base'] = _next_id(User)
+            params['post_base'] = _next_id(ContentPost)
+            params['plan_base'] = _next_id(SubscriptionPlan)
+            params['conversation_base'] = _next_id(Conversation)
+            for kind, (model, columns, _) in TABLES.items():
+                writer = TableWriter(model, columns, use_copy)
+                tasks = [(kind, start, stop, params) for start, stop in _chunks(sizes[kind], batch_size)]
+                chunks = pool.imap(generate_chunk, tasks) if pool else map(generate_chunk, tasks)
+                counts[kind] = sum(writer.write(rows) for rows in chunks)
+                log(f'{kind}: {counts[kind]}')
+            # Явные id не двигают последовательности Postgres
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), [User, ContentPost, SubscriptionPlan, Conversation]):
+                    cursor.execute(sql)
+            _rebuild_derived(params, log)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return counts, params['user_base']
+
+
+def _rebuild_derived(params, log):
+    from . import matchmaking
+    from .caching import invalidate_responses
+    from .earnings import rebuild_earnings
+    from .search import refresh_search_vectors
+    from .signals import rebuild_post_counters, rebuild_profile_stats
+
+    rebuild_profile_stats()
+    rebuild_post_counters()
+    rebuild_earnings()
+    refresh_search_vectors()
+    # Вставка шла в обход сигналов - сбрасываем зависящие от данных кеши
+    invalidate_responses('profiles', 'games', 'plans')
+    matchmaking.invalidate_index('profiles')
+    for game_id in params['game_ids']:
+        matchmaking.invalidate_index(matchmaking.game_index_name(game_id))
+    log('Статистика, счетчики, доход авторов и поисковые векторы пересчитаны')
@@ -0,0 +1,72 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class ImmediateBackend:
+    """Выполняет задачу сразу в текущем потоке (тесты, отладка)."""
+
+    def enqueue(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class ThreadQueueBackend:
+    """
+    Очередь задач в фоновых потоках процесса. Задачи не переживают
+    перезапуск процесса - для них нужен внешний брокер, подключаемый
+    той же настройкой TASK_BACKEND.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or getattr(settings, 'TASK_WORKERS', 2)
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def enqueue(self, func, *args, **kwargs):
+        self.start()
+        self.queue.put((func, args, kwargs))
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.work, name=f'task-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception('Ошибка фоновой задачи %s', getattr(func, '__name__', func))
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def join(self):
+        self.queue.join()
+
+
+_backends = {}
+
+
+def get_backend():
+    path = getattr(settings, 'TASK_BACKEND', 'partners.tasks.ThreadQueueBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def enqueue(func, *args, **kwargs):
+    """Ставит задачу в очередь после фиксации текущей транзакции."""
+    transaction.on_commit(lambda: get_backend().enqueue(func, *args, **kwargs))
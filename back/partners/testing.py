@@ -0,0 +1,18 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Фоновые задачи (partners.tasks) в тестах выполняются сразу: потоки
+    ThreadQueueBackend пережили бы тест и писали бы в базу следующего.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.immediate_tasks = override_settings(TASK_BACKEND='partners.tasks.ImmediateBackend')
+        self.immediate_tasks.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.immediate_tasks.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1221 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from . import matchmaking, notifications
+from .bulk import MAX_ITEMS, BulkWriter
+from .caching import CachedResponseMixin, generations
+from .comments import rebuild_comment_tree
+from .earnings import rebuild_earnings
+from .subscriptions import process_due
+from .instrumentation import RequestMetrics, registry
+from .models import *
+from .pagination import encode_cursor
+from .realtime import websocket_application
+from .replicas import ReplicaMiddleware, ReplicaRouter
+from .views import FollowViewSet, MetricsView
+
+
+class ProfileListQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        games = [Game.objects.create(name=f'Game {i}') for i in range(3)]
+        users = [
+            User.objects.create(username=f'player{i}', email=f'player{i}@example.com')
+            for i in range(50)
+        ]
+        for i, user in enumerate(users):
+            UserProfile.objects.create(user=user)
+            for game in games[:i % 3 + 1]:
+                UserGame.objects.create(user=user, game=game, current_rank='Legend')
+            if i:
+                Follow.objects.create(follower=users[i - 1], following=user)
+                Review.objects.create(author=users[i - 1], target=user, rating=i % 5 + 1)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_profile_page_query_count_is_constant(self):
+        # профили + prefetch игр пользователей
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/profiles/', {'page_size': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_profile_aggregates(self):
+        # На Postgres поиск нечеткий (триграммы): в выдаче и другие playerN
+        response = self.client.get('/api/profiles/', {'search': 'player7', 'page_size': 50})
+        profile = next(p for p in response.data['results'] if p['user']['username'] == 'player7')
+        self.assertEqual(profile['followers_count'], 1)
+        self.assertEqual(profile['rating'], 3)
+        self.assertEqual(len(profile['user_games']), 2)
+        self.assertEqual(profile['user_games'][0]['user']['username'], 'player7')
+
+
+    def test_keyset_pages_cover_directory_in_order(self):
+        for sort_by in ('rating', 'followers', 'newest', ''):
+            seen = []
+            params = {'sort_by': sort_by, 'page_size': 7}
+            url = '/api/profiles/'
+            while url:
+                response = self.client.get(url, params)
+                seen.extend(response.data['results'])
+                url, params = response.data['next'], None
+            self.assertEqual(len({p['user']['id'] for p in seen}), 50)
+            if sort_by == 'rating':
+                ratings = [p['rating'] for p in seen]
+                self.assertEqual(ratings, sorted(ratings, reverse=True))
+
+    def test_min_rating_filter(self):
+        response = self.client.get('/api/profiles/', {'min_rating': '4.5', 'page_size': 50})
+        self.assertEqual({p['rating'] for p in response.data['results']}, {5})
+        for value in ('abc', 'nan', 'inf', '1e'):
+            response = self.client.get('/api/profiles/', {'min_rating': value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('min_rating', response.data)
+
+    def test_missing_stats_and_bad_cursors(self):
+        ProfileStats.objects.filter(user__username__in=['player3', 'player4']).delete()
+        for sort_by in ('rating', 'followers'):
+            seen = []
+            params = {'sort_by': sort_by, 'page_size': 7}
+            url = '/api/profiles/'
+            while url:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                seen.extend(response.data['results'])
+                url, params = response.data['next'], None
+            self.assertEqual(len({p['user']['id'] for p in seen}), 50)
+
+        # Курсоры с значениями не того типа, None и лишними полями
+        for values in (['abc', 1], [1.5, 'x'], [None, 1], [[1], 1], [1, 2, 3]):
+            response = self.client.get('/api/profiles/', {'sort_by': 'rating', 'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/profiles/', {'sort_by': 'newest', 'cursor': encode_cursor(['вчера', 1])})
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_search_endpoint(self):
+        response = self.client.get('/api/profiles/search/', {'q': 'player4'})
+        usernames = [p['user']['username'] for p in response.data]
+        self.assertEqual(usernames[0], 'player4')
+        self.assertNotIn('search_vector', response.data[0])
+
+        response = self.client.get('/api/profiles/', {'search': 'Game 2', 'page_size': 50})
+        self.assertEqual(len(response.data['results']), 16)
+
+
+class ProfileStatsTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@example.com')
+        self.target = User.objects.create(username='target', email='target@example.com')
+
+    def stats(self):
+        return ProfileStats.objects.get(user=self.target)
+
+    def test_incremental_updates(self):
+        follow = Follow.objects.create(follower=self.author, following=self.target)
+        review = Review.objects.create(author=self.author, target=self.target, rating=4)
+        ContentPost.objects.create(author=self.target, title='Post', content='...')
+        stats = self.stats()
+        self.assertEqual((stats.followers_count, stats.reviews_count, stats.posts_count), (1, 1, 1))
+        self.assertEqual(stats.rating_avg, 4)
+
+        review.rating = 2
+        review.save()
+        self.assertEqual(self.stats().rating_avg, 2)
+
+        review.delete()
+        follow.delete()
+        stats = self.stats()
+        self.assertEqual((stats.followers_count, stats.reviews_count, stats.rating_sum), (0, 0, 0))
+        self.assertEqual(stats.rating_avg, 0)
+
+    def test_rebuild_matches_source_rows(self):
+        Review.objects.create(author=self.author, target=self.target, rating=5)
+        ProfileStats.objects.all().delete()
+        call_command('rebuild_stats', stdout=StringIO())
+        self.assertEqual(self.stats().rating_avg, 5)
+        self.assertEqual(ProfileStats.objects.count(), 2)
+
+    def test_user_delete_cascades_cleanly(self):
+        Follow.objects.create(follower=self.author, following=self.target)
+        self.target.delete()
+        self.assertFalse(ProfileStats.objects.filter(user_id=self.target.pk).exists())
+
+
+class IndexAuditTest(TestCase):
+    def test_canonical_queries_use_indexes(self):
+        call_command('audit_indexes', fail=True, stdout=StringIO())
+
+
+class EntitlementsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', email='author@example.com')
+        self.viewer = User.objects.create(username='viewer', email='viewer@example.com')
+        self.plan = SubscriptionPlan.objects.create(author=self.author, title='Plan', price_per_month=100)
+        self.posts = {
+            access: ContentPost.objects.create(
+                author=self.author, title=access, content='secret', access_type=access)
+            for access in ('free', 'subscription', 'pay_per_view')
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def contents(self):
+        response = self.client.get('/api/posts/', {'author': self.author.pk})
+        return {post['title']: post['content'] for post in response.data}
+
+    def test_locked_content_is_redacted(self):
+        self.assertEqual(self.contents(), {'free': 'secret', 'subscription': None, 'pay_per_view': None})
+
+    def test_subscription_and_purchase_unlock_content(self):
+        self.contents()  # прогреваем кеш прав
+        now = timezone.now()
+        UserSubscription.objects.create(
+            subscriber=self.viewer, plan=self.plan, starts_at=now, ends_at=now + timedelta(days=30))
+        Purchase.objects.create(
+            user=self.viewer, content_type='post',
+            content_id=self.posts['pay_per_view'].pk, purchase_price=10)
+        self.assertEqual(self.contents(), {'free': 'secret', 'subscription': 'secret', 'pay_per_view': 'secret'})
+
+    def test_expired_subscription_does_not_unlock(self):
+        now = timezone.now()
+        UserSubscription.objects.create(
+            subscriber=self.viewer, plan=self.plan, starts_at=now - timedelta(days=60),
+            ends_at=now - timedelta(days=30))
+        self.assertIsNone(self.contents()['subscription'])
+
+
+class PostFeedQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', email='author@example.com')
+        self.viewer = User.objects.create(username='viewer', email='viewer@example.com')
+        self.posts = [
+            ContentPost.objects.create(author=self.author, title=f'Post {i}', content='...')
+            for i in range(30)
+        ]
+        for post in self.posts[::2]:
+            PostLike.objects.create(post=post, user=self.viewer)
+            PostComment.objects.create(post=post, author=self.viewer, content='!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_post_list_query_count_is_constant(self):
+        # посты с авторами + лайки зрителя + подписки и покупки зрителя
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/posts/', {'author': self.author.pk})
+        self.assertEqual(len(response.data), 30)
+
+    def test_counters_and_liked_flag(self):
+        posts = {p['post_id']: p for p in self.client.get('/api/posts/').data}
+        liked = posts[self.posts[0].pk]
+        self.assertEqual((liked['likes_count'], liked['comments_count'], liked['is_liked']), (1, 1, True))
+        self.assertFalse(posts[self.posts[1].pk]['is_liked'])
+
+        PostLike.objects.filter(post=self.posts[0]).delete()
+        response = self.client.get(f'/api/posts/{self.posts[0].pk}/')
+        self.assertEqual((response.data['likes_count'], response.data['is_liked']), (0, False))
+
+
+class ConversationSocketTest(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(username='member', email='member@example.com')
+        self.stranger = User.objects.create(username='stranger', email='stranger@example.com')
+        self.conversation = Conversation.objects.create(created_by=self.member)
+        ConversationParticipant.objects.create(conversation=self.conversation, user=self.member)
+
+    def connect(self, user, on_accept=None, expected=0, origin=b'http://testserver', cookie=None):
+        headers = [(b'host', b'testserver')]
+        if origin:
+            headers.append((b'origin', origin))
+        if cookie:
+            headers.append((b'cookie', cookie))
+        scope = {
+            'type': 'websocket',
+            'path': f'/ws/conversations/{self.conversation.pk}/',
+            'headers': headers,
+        }
+        if user is not None:
+            scope['user_id'] = user.pk
+        sent = []
+
+        async def scenario():
+            incoming = asyncio.Queue()
+            await incoming.put({'type': 'websocket.connect'})
+
+            async def send(event):
+                sent.append(event)
+                if event['type'] == 'websocket.accept' and on_accept:
+                    await sync_to_async(on_accept)()
+                if event['type'] != 'websocket.close' and len(sent) == expected + 1:
+                    await incoming.put({'type': 'websocket.disconnect'})
+
+            await asyncio.wait_for(websocket_application(scope, incoming.get, send), timeout=5)
+
+        async_to_sync(scenario)()
+        return sent
+
+    def post_message(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.member, content='gg')
+
+    def test_participant_receives_new_messages(self):
+        sent = self.connect(self.member, self.post_message, expected=1)
+        self.assertEqual(sent[0]['type'], 'websocket.accept')
+        event = json.loads(sent[1]['text'])
+        self.assertEqual(event['type'], 'message.created')
+        self.assertEqual(event['message']['content'], 'gg')
+
+    def test_stranger_is_rejected(self):
+        sent = self.connect(self.stranger)
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4403}])
+
+    def test_foreign_origin_is_rejected(self):
+        for origin in (b'https://evil.example', None):
+            sent = self.connect(self.member, origin=origin)
+            self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4403}])
+        with override_settings(CSRF_TRUSTED_ORIGINS=['https://*.example.com']):
+            sent = self.connect(self.member, origin=b'https://app.example.com')
+        self.assertEqual(sent[0]['type'], 'websocket.accept')
+
+    def test_session_is_verified(self):
+        self.member.set_password('old-password')
+        self.member.save()
+        client = APIClient()
+        client.force_login(self.member)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'.encode()
+        self.assertEqual(self.connect(None, cookie=cookie)[0]['type'], 'websocket.accept')
+        # После смены пароля хеш сессии не совпадает
+        self.member.set_password('new-password')
+        self.member.save()
+        self.assertEqual(self.connect(None, cookie=cookie), [{'type': 'websocket.close', 'code': 4403}])
+
+
+class ConversationHistoryTest(TestCase):
+    def setUp(self):
+        self.me = User.objects.create(username='me', email='me@example.com')
+        self.friend = User.objects.create(username='friend', email='friend@example.com')
+        self.chats = []
+        for i in range(3):
+            chat = Conversation.objects.create(created_by=self.me)
+            ConversationParticipant.objects.create(conversation=chat, user=self.me)
+            ConversationParticipant.objects.create(conversation=chat, user=self.friend)
+            self.chats.append(chat)
+        self.messages = [
+            Message.objects.create(conversation=self.chats[0], sender=self.friend, content=str(i))
+            for i in range(25)
+        ]
+        Message.objects.create(conversation=self.chats[1], sender=self.me, content='mine')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def test_inbox_in_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/conversations/inbox/')
+        inbox = {row['conversation']['conversation_id']: row for row in response.data}
+        self.assertEqual(inbox[self.chats[0].pk]['unread_count'], 25)
+        self.assertEqual(inbox[self.chats[0].pk]['last_message']['content'], '24')
+        self.assertEqual(inbox[self.chats[1].pk]['unread_count'], 0)
+        self.assertIsNone(inbox[self.chats[2].pk]['last_message'])
+
+        self.client.post(f'/api/conversations/{self.chats[0].pk}/read/')
+        response = self.client.get('/api/conversations/inbox/')
+        self.assertEqual(response.data[0]['conversation']['conversation_id'], self.chats[1].pk)
+        self.assertEqual([row['unread_count'] for row in response.data], [0, 0, 0])
+
+    def test_history_windows(self):
+        url = f'/api/conversations/{self.chats[0].pk}/messages/'
+        page = self.client.get(url, {'limit': 10}).data
+        self.assertEqual([m['content'] for m in page['results']], [str(i) for i in range(15, 25)])
+
+        older = self.client.get(url, {'limit': 10, 'before': page['before']}).data
+        self.assertEqual([m['content'] for m in older['results']], [str(i) for i in range(5, 15)])
+        oldest = self.client.get(url, {'limit': 10, 'before': older['before']}).data
+        self.assertEqual(len(oldest['results']), 5)
+        self.assertIsNone(oldest['before'])
+
+        newer = self.client.get(url, {'limit': 3, 'after': older['after']}).data
+        self.assertEqual([m['content'] for m in newer['results']], ['15', '16', '17'])
+
+    def test_history_requires_participation(self):
+        stranger = User.objects.create(username='stranger', email='stranger@example.com')
+        self.client.force_authenticate(stranger)
+        response = self.client.get(f'/api/conversations/{self.chats[0].pk}/messages/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/api/messages/').data, [])
+
+
+@override_settings(TASK_BACKEND='partners.tasks.ImmediateBackend')
+class NotificationFanoutTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@example.com')
+        self.followers = User.objects.bulk_create([
+            User(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(25)
+        ])
+        Follow.objects.bulk_create([
+            Follow(follower=user, following=self.author) for user in self.followers
+        ])
+
+    def test_publish_fans_out_in_chunks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = ContentPost.objects.create(author=self.author, title='Draft', content='...')
+        self.assertEqual(Notification.objects.count(), 0)
+
+        post.is_published = True
+        with patch.object(notifications, 'FANOUT_CHUNK_SIZE', 10), \
+                self.captureOnCommitCallbacks(execute=True):
+            # в самом запросе публикации - только проверка статуса и UPDATE
+            with self.assertNumQueries(2):
+                post.save()
+        self.assertIsNotNone(post.published_at)
+        self.assertEqual(Notification.objects.filter(type='new_post').count(), 25)
+
+        # повторное сохранение опубликованного поста не рассылает заново
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(Notification.objects.count(), 25)
+
+    def test_unread_count_and_mark_read(self):
+        fan = self.followers[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(author=self.author, target=fan, rating=5)
+            ContentPost.objects.create(author=self.author, title='Hi', content='...', is_published=True)
+        client = APIClient()
+        client.force_authenticate(fan)
+        self.assertEqual(client.get('/api/notifications/unread_count/').data, {'unread_count': 2})
+
+        first = client.get('/api/notifications/').data[0]['notification_id']
+        self.assertEqual(client.post('/api/notifications/mark_read/', {'ids': [first]}, format='json').data,
+                         {'updated': 1})
+        self.assertEqual(client.post('/api/notifications/mark_read/', {}, format='json').data, {'updated': 1})
+        self.assertEqual(client.get('/api/notifications/unread_count/').data, {'unread_count': 0})
+
+
+@override_settings(TASK_BACKEND='partners.tasks.ImmediateBackend', FEED_FANOUT_LIMIT=3)
+class FeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create(username='reader', email='reader@example.com')
+        self.friend = User.objects.create(username='friend', email='friend@example.com')
+        self.star = User.objects.create(username='star', email='star@example.com')
+        self.stranger = User.objects.create(username='stranger', email='stranger@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.reader, following=self.friend)
+            for fan in User.objects.exclude(pk=self.star.pk):
+                Follow.objects.create(follower=fan, following=self.star)
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, author, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ContentPost.objects.create(author=author, title=title, content='...', is_published=True)
+
+    def test_feed_merges_materialized_and_large_authors(self):
+        for i in range(4):
+            self.publish(self.friend, f'friend {i}')
+            self.publish(self.star, f'star {i}')
+            self.publish(self.stranger, f'stranger {i}')
+        # у крупного автора записи в ленты не раскладываются
+        self.assertFalse(FeedEntry.objects.filter(author=self.star).exists())
+
+        titles = []
+        url, params = '/api/posts/feed/', {'page_size': 3}
+        while url:
+            response = self.client.get(url, params)
+            titles += [post['title'] for post in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(titles, [f'{who} {i}' for i in range(3, -1, -1) for who in ('star', 'friend')])
+
+    def subscribe(self, reader, author, ends_at, **fields):
+        plan = SubscriptionPlan.objects.create(author=author, title='VIP', price_per_month='199.00', **fields)
+        with self.captureOnCommitCallbacks(execute=True):
+            return UserSubscription.objects.create(subscriber=reader, plan=plan, starts_at=timezone.now(),
+                                                   ends_at=ends_at)
+
+    def test_paid_subscription_pulls_large_author(self):
+        patron = User.objects.create(username='patron', email='patron@example.com')
+        self.subscribe(patron, self.star, timezone.now() + timedelta(days=30))
+        self.publish(self.star, 'star post')
+        self.client.force_authenticate(patron)
+        titles = [post['title'] for post in self.client.get('/api/posts/feed/').data['results']]
+        self.assertEqual(titles, ['star post'])
+
+    def test_ended_subscriptions_leave_feed(self):
+        soon = timezone.now() + timedelta(minutes=1)
+        self.subscribe(self.reader, self.stranger, soon, is_active=False)
+        self.publish(self.stranger, 'paid post')
+        self.assertTrue(FeedEntry.objects.filter(user=self.reader, author=self.stranger).exists())
+        # Пакетное завершение (план закрыт) идет мимо сигналов, ленты чистит задача
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_due(now=soon), (0, 1))
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader, author=self.stranger).exists())
+
+        # Отмена через сигнал; на friend читатель еще и подписан бесплатно - посты остаются
+        for author, kept in ((self.stranger, False), (self.friend, True)):
+            subscription = self.subscribe(self.reader, author, soon)
+            self.publish(author, 'paid post')
+            subscription.status = 'canceled'
+            with self.captureOnCommitCallbacks(execute=True):
+                subscription.save()
+            self.assertEqual(FeedEntry.objects.filter(user=self.reader, author=author).exists(), kept)
+
+    def test_follow_backfills_and_unfollow_clears(self):
+        self.publish(self.stranger, 'old post')
+        with self.captureOnCommitCallbacks(execute=True):
+            follow = Follow.objects.create(follower=self.reader, following=self.stranger)
+        self.assertTrue(FeedEntry.objects.filter(user=self.reader, author=self.stranger).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader, author=self.stranger).exists())
+
+
+class MatchmakingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Индексы живут в процессе: без очистки пересборку сдержал бы интервал
+        matchmaking._indexes.clear()
+        self.shooter = Game.objects.create(name='Shooter')
+        self.racing = Game.objects.create(name='Racing')
+        self.users = {}
+        for name, timezone_name, games in (
+            ('me', 'UTC+3', [(self.shooter, 'Gold', 100), (self.racing, 'Pro', 10)]),
+            ('twin', 'UTC+3', [(self.shooter, 'Gold', 120), (self.racing, 'Pro', 12)]),
+            ('casual', 'UTC-5', [(self.shooter, 'Bronze', 2)]),
+            ('racer', 'UTC+3', [(self.racing, 'Pro', 10)]),
+            ('other', 'UTC+3', []),
+        ):
+            user = User.objects.create(username=name, email=f'{name}@example.com')
+            UserProfile.objects.create(user=user, timezone=timezone_name)
+            for game, rank, hours in games:
+                UserGame.objects.create(user=user, game=game, current_rank=rank, playtime_hours=hours)
+            self.users[name] = user
+        self.client = APIClient()
+
+    def usernames(self, **params):
+        response = self.client.get(f'/api/profiles/{self.users["me"].pk}/matches/', params)
+        self.assertEqual(response.status_code, 200)
+        return [profile['user']['username'] for profile in response.data]
+
+    def test_candidates_ranked_by_score(self):
+        self.assertEqual(self.usernames(), ['twin', 'racer', 'casual'])
+        self.assertEqual(self.usernames(game=self.shooter.pk), ['twin', 'casual'])
+        self.assertEqual(self.usernames(k=1), ['twin'])
+
+    @patch('partners.matchmaking.INDEX_REBUILD_INTERVAL', 0)
+    def test_index_follows_user_games(self):
+        self.assertEqual(self.usernames(game=self.shooter.pk), ['twin', 'casual'])
+        UserGame.objects.create(user=self.users['other'], game=self.shooter, current_rank='Gold', playtime_hours=100)
+        self.assertEqual(self.usernames(game=self.shooter.pk), ['other', 'twin', 'casual'])
+
+    def test_index_rebuilds_once_and_debounced(self):
+        builds = []
+        release = threading.Event()
+
+        def build():
+            builds.append(1)
+            release.wait(5)
+            return len(builds)
+
+        matchmaking.invalidate_index('test')
+        threads = [threading.Thread(target=matchmaking.get_index, args=('test', build)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(builds), 1)
+
+        # Изменение сразу после пересборки ждет интервала
+        matchmaking.invalidate_index('test')
+        self.assertEqual(matchmaking.get_index('test', build), 1)
+        with patch('partners.matchmaking.INDEX_REBUILD_INTERVAL', 0):
+            self.assertEqual(matchmaking.get_index('test', build), 2)
+
+
+class RankLadderTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dota = Game.objects.create(name='Dota 2')
+        for ordinal, label in enumerate(['Herald', 'Legend', 'Ancient', 'Divine', 'Immortal']):
+            GameRank.objects.create(game=self.dota, label=label, ordinal=ordinal)
+        for name, rank in (('herald', 'Herald'), ('legend', 'legend'), ('divine', 'Divine'),
+                           ('immortal', 'Immortal'), ('unranked', 'Titan')):
+            user = User.objects.create(username=name, email=f'{name}@example.com')
+            UserProfile.objects.create(user=user)
+            UserGame.objects.create(user=user, game=self.dota, current_rank=rank)
+        self.client = APIClient()
+
+    def usernames(self, **params):
+        response = self.client.get('/api/profiles/', {'game': self.dota.pk, 'page_size': 50, **params})
+        self.assertEqual(response.status_code, 200)
+        return [profile['user']['username'] for profile in response.data['results']]
+
+    def test_rank_range_filter(self):
+        self.assertEqual(self.usernames(rank_min='Legend', rank_max='Divine', sort_by='rank'), ['divine', 'legend'])
+        self.assertEqual(self.usernames(rank_min='Divine', sort_by='rank'), ['immortal', 'divine'])
+        self.assertEqual(self.usernames(rank='immortal'), ['immortal'])
+        response = self.client.get('/api/profiles/', {'game': self.dota.pk, 'rank_min': 'Nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_label_filter_without_game(self):
+        response = self.client.get('/api/profiles/', {'rank': 'Legend'})
+        self.assertEqual([p['user']['username'] for p in response.data['results']], ['legend'])
+
+    def test_ladder_changes_resync_ordinals(self):
+        self.assertEqual(self.usernames(rank_min='Immortal'), ['immortal'])
+        with self.captureOnCommitCallbacks(execute=True):
+            GameRank.objects.create(game=self.dota, label='Titan', ordinal=5)
+        self.assertEqual(self.usernames(rank_min='Immortal', sort_by='rank'), ['unranked', 'immortal'])
+        self.assertEqual(
+            UserGame.objects.get(user__username='unranked').rank_ordinal, 5)
+
+    def test_ladder_edits_resync_once_per_game(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                for ordinal, label in enumerate(['Titan', 'Titan II', 'Titan III'], start=5):
+                    GameRank.objects.create(game=self.dota, label=label, ordinal=ordinal)
+        synced = [q for q in queries if q['sql'].startswith(f'UPDATE "{UserGame._meta.db_table}"')]
+        self.assertEqual(len(synced), 2)
+        self.assertEqual(UserGame.objects.get(user__username='unranked').rank_ordinal, 5)
+        # Следующее изменение после выполненного вызова пересчитывается снова
+        with self.captureOnCommitCallbacks(execute=True):
+            GameRank.objects.filter(label='Titan').delete()
+        self.assertIsNone(UserGame.objects.get(user__username='unranked').rank_ordinal)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.game = Game.objects.create(name='Chess')
+        self.players = [User.objects.create(username=f'p{i}', email=f'p{i}@example.com') for i in range(3)]
+        for player in self.players:
+            UserProfile.objects.create(user=player)
+        self.client = APIClient()
+
+    def test_cached_list_and_not_modified(self):
+        response = self.client.get('/api/games/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/games/').data, response.data)
+            response = self.client.get('/api/games/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        before = generations(['games'])
+        # Поколение меняется только после фиксации транзакции записи
+        with self.captureOnCommitCallbacks(execute=True):
+            self.game.name = 'Chess 960'
+            self.game.save()
+            self.assertEqual(generations(['games']), before)
+        self.assertNotEqual(generations(['games']), before)
+        response = self.client.get('/api/games/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['name'], 'Chess 960')
+
+    def test_follow_invalidates_only_affected_profile(self):
+        target, other = self.players[0], self.players[1]
+        self.client.get(f'/api/profiles/{target.pk}/')
+        self.client.get(f'/api/profiles/{other.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=other, following=target)
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/profiles/{other.pk}/')
+        response = self.client.get(f'/api/profiles/{target.pk}/')
+        self.assertEqual(response.data['followers_count'], 1)
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.game = Game.objects.create(name='Go')
+        self.users = [User.objects.create(username=f'u{i}', email=f'u{i}@example.com') for i in range(3)]
+        for i, user in enumerate(self.users):
+            UserGame.objects.create(user=user, game=self.game, playtime_hours=i, current_rank='Dan')
+            Review.objects.create(author=user, target=self.users[0], rating=5, comment='ok')
+        SubscriptionPlan.objects.create(author=self.users[0], title='Gold', price_per_month='9.90')
+        self.client = APIClient()
+
+    def test_values_fast_path_matches_serializers(self):
+        from rest_framework.renderers import JSONRenderer
+        from .serializers import ReviewSerializer, SubscriptionPlanSerializer, UserGameSerializer
+        for url, serializer, queryset in (
+            ('/api/user-games/', UserGameSerializer, UserGame.objects.all()),
+            ('/api/reviews/', ReviewSerializer, Review.objects.all()),
+            ('/api/subscription-plans/', SubscriptionPlanSerializer, SubscriptionPlan.objects.all()),
+        ):
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            expected = JSONRenderer().render(serializer(queryset, many=True).data)
+            self.assertEqual(json.loads(response.content), json.loads(expected))
+
+    def test_fields_and_expand(self):
+        response = self.client.get('/api/user-games/', {'fields': 'user,game,playtime_hours', 'expand': 'game'})
+        row = response.data[0]
+        self.assertEqual(set(row), {'user', 'game', 'playtime_hours'})
+        self.assertEqual(row['user'], self.users[0].pk)
+        self.assertEqual(row['game']['name'], 'Go')
+
+        user_game = UserGame.objects.get(user=self.users[0])
+        response = self.client.get(f'/api/user-games/{user_game.pk}/', {'fields': 'user'})
+        self.assertEqual(set(response.data), {'user'})
+
+    def test_fields_ignored_on_write(self):
+        user_game = UserGame.objects.get(user=self.users[0])
+        response = self.client.patch(f'/api/user-games/{user_game.pk}/?fields=user', {'playtime_hours': 42},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['playtime_hours'], 42)
+        user_game.refresh_from_db()
+        self.assertEqual(user_game.playtime_hours, 42)
+
+    def test_locked_post_stays_redacted_without_flag(self):
+        post = ContentPost.objects.create(
+            author=self.users[0], title='Paid', content='secret', is_published=True, access_type='subscription')
+        response = self.client.get(f'/api/posts/{post.pk}/', {'fields': 'title,content'})
+        self.assertEqual(response.data, {'title': 'Paid', 'content': None})
+
+
+class QueryBudgetTest(TestCase):
+    def test_endpoints_within_query_budget(self):
+        # Без базовой линии для СУБД тестовой базы команда завершается ошибкой.
+        # Задержка зависит от машины, в тестах проверяются запросы, коды и размеры ответов
+        out = StringIO()
+        call_command('bench_api', '--check', '--queries-only', '--repeat', '1', stdout=out)
+        self.assertIn('Бюджет соблюден', out.getvalue())
+
+    def test_missing_vendor_baseline_fails(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as baseline:
+            json.dump({'other': {'users': 10, 'endpoints': {}}}, baseline)
+            baseline.flush()
+            with self.assertRaisesMessage(CommandError, f'Нет базовой линии для {connection.vendor}'):
+                call_command('bench_api', '--check', '--baseline', baseline.name, stdout=StringIO())
+
+
+class SyntheticDataTest(TestCase):
+    def test_generates_skewed_dataset_with_consistent_counters(self):
+        call_command('seed_data', '--users', '60', '--follows', '5', stdout=StringIO())
+        users = User.objects.filter(username__startswith='synthetic_')
+        self.assertEqual(users.count(), 60)
+        self.assertEqual(UserProfile.objects.filter(user__in=users).count(), 60)
+        self.assertEqual(Message.objects.count(), 600)
+
+        # Степенное распределение: первый пользователь собирает больше всего подписчиков
+        hot = users.order_by('pk').first()
+        followers = [stats.followers_count for stats in ProfileStats.objects.filter(user__in=users)]
+        self.assertEqual(hot.stats.followers_count, max(followers))
+        self.assertEqual(hot.stats.followers_count, Follow.objects.filter(following=hot).count())
+        post = ContentPost.objects.filter(author__in=users).order_by('pk').first()
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, PostLike.objects.filter(post=post).count())
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        self.admin = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        Game.objects.create(name='Dota 2')
+
+    def test_metrics_endpoint_is_admin_only_prometheus_text(self):
+        self.client.get('/api/games/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE partners_http_request_duration_seconds histogram', text)
+        self.assertIn('partners_http_requests_total{view="game-list",method="GET",status="200"} 1', text)
+        self.assertIn('partners_http_request_queries_bucket{view="game-list",method="GET",le="+Inf"} 1', text)
+
+    def test_repeated_statement_is_flagged(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for game in Game.objects.all():
+                for _ in range(3):
+                    list(GameRank.objects.filter(game=game))
+        self.assertEqual(metrics.queries, 4)
+        self.assertEqual(metrics.duplicates, 2)
+        self.assertEqual(metrics.most_repeated()[1], 3)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRouterTest(SimpleTestCase):
+    def route(self, method, view_func, write=False):
+        router = ReplicaRouter()
+
+        def get_response(request):
+            middleware.process_view(request, view_func, (), {})
+            if write:
+                router.db_for_write(Follow)
+            return router.db_for_read(Follow), router.db_for_read(User)
+        middleware = ReplicaMiddleware(get_response)
+        return middleware(getattr(RequestFactory(), method)('/api/follows/'))
+
+    def test_cached_responses_are_built_from_primary(self):
+        class ReadsFrom:
+            def list(self, request):
+                return Response({'db': ReplicaRouter().db_for_read(Follow)})
+
+        class CachedView(CachedResponseMixin, ReadsFrom):
+            def cache_dependencies(self):
+                return ['replica-probe']
+
+        def get_response(request):
+            middleware.process_view(request, FollowViewSet.as_view({'get': 'list'}), (), {})
+            return CachedView().list(Request(request)).data['db'], ReplicaRouter().db_for_read(Follow)
+        middleware = ReplicaMiddleware(get_response)
+        self.assertEqual(middleware(RequestFactory().get('/api/follows/')), (None, 'replica_1'))
+
+    def test_safe_viewset_reads_go_to_replica(self):
+        viewset = FollowViewSet.as_view({'get': 'list', 'post': 'create'})
+        # Пользователи и сессии всегда читаются с основной базы
+        self.assertEqual(self.route('get', viewset), ('replica_1', None))
+        self.assertEqual(self.route('post', viewset), (None, None))
+        self.assertEqual(self.route('get', MetricsView.as_view()), (None, None))
+        # После записи запрос читает свои изменения с основной базы
+        self.assertEqual(self.route('get', viewset, write=True), (None, None))
+
+
+# TransactionTestCase: одновременные запросы карточки идут из других потоков
+# со своими соединениями и должны видеть данные
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', email='author@example.com')
+        UserProfile.objects.create(user=self.author, city='Казань')
+        game = Game.objects.create(name='Dota 2')
+        UserGame.objects.create(user=self.author, game=game, current_rank='Legend')
+        SubscriptionPlan.objects.create(author=self.author, title='VIP', price_per_month='99.00')
+        ContentPost.objects.create(author=self.author, title='Открытый', content='текст', is_published=True,
+                                   published_at=timezone.now())
+        ContentPost.objects.create(author=self.author, title='Закрытый', content='секрет', is_published=True,
+                                   access_type='subscription', published_at=timezone.now())
+
+    def test_async_list_endpoints_match_sync(self):
+        for sync_path, async_path in [
+            ('/api/profiles/?page_size=5', '/api/async/profiles/?page_size=5'),
+            (f'/api/posts/?author={self.author.pk}', f'/api/async/posts/?author={self.author.pk}'),
+            ('/api/games/', '/api/async/games/'),
+            ('/api/profiles/?game=x', '/api/async/profiles/?game=x'),
+        ]:
+            expected = self.client.get(sync_path)
+            response = async_to_sync(AsyncClient().get)(async_path)
+            self.assertEqual(response.status_code, expected.status_code, async_path)
+            self.assertEqual(response.json(), expected.json(), async_path)
+
+    def test_profile_page_loads_sub_queries(self):
+        response = async_to_sync(AsyncClient().get)(f'/api/async/profiles/{self.author.pk}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['city'], 'Казань')
+        self.assertEqual([game['game']['name'] for game in data['user_games']], ['Dota 2'])
+        self.assertEqual([plan['title'] for plan in data['subscription_plans']], ['VIP'])
+        # Закрытый пост отдается без текста
+        contents = {post['title']: post['content'] for post in data['posts']}
+        self.assertEqual(contents, {'Открытый': 'текст', 'Закрытый': None})
+
+        self.assertEqual(async_to_sync(AsyncClient().get)('/api/async/profiles/999/').status_code, 404)
+        self.assertEqual(async_to_sync(AsyncClient().post)('/api/async/games/').status_code, 405)
+
+
+class CommentTreeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.post = ContentPost.objects.create(author=self.user, title='Пост', content='...')
+        self.top = [self.comment(None, f'top {i}') for i in range(3)]
+        # Длинная ветка под первым комментарием и пять ответов на второй
+        parent = self.top[0]
+        self.chain = []
+        for level in range(6):
+            parent = self.comment(parent, f'level {level + 1}')
+            self.chain.append(parent)
+        self.replies = [self.comment(self.top[1], f'reply {i}') for i in range(5)]
+
+    def comment(self, parent, content):
+        return PostComment.objects.create(post=self.post, author=self.user, parent_comment=parent, content=content)
+
+    def get(self, **params):
+        return self.client.get(f'/api/posts/{self.post.pk}/comments/', params).json()
+
+    def test_thread_is_loaded_in_constant_queries(self):
+        # пост + страница верхнего уровня + превью веток
+        with self.assertNumQueries(3):
+            data = self.get(page_size=2, depth=3, replies=2)
+        first, second = data['results']
+        node = first
+        for level in range(1, 4):
+            self.assertEqual(len(node['replies']), 1)
+            node = node['replies'][0]
+            self.assertEqual((node['depth'], node['content']), (level, f'level {level}'))
+        self.assertTrue(node['more_replies'])
+        self.assertEqual(node['replies'], [])
+        self.assertEqual([reply['content'] for reply in second['replies']], ['reply 0', 'reply 1'])
+        self.assertEqual(second['replies_count'], 5)
+
+        # "Загрузить еще" продолжает после показанных ответов
+        with self.assertNumQueries(2):
+            more = self.client.get(second['more_replies']).json()
+        self.assertEqual([reply['content'] for reply in more['results']], ['reply 2', 'reply 3'])
+        self.assertEqual([reply['content'] for reply in self.client.get(more['next']).json()['results']],
+                         ['reply 4'])
+        self.assertEqual([c['content'] for c in self.client.get(data['next']).json()['results']], ['top 2'])
+
+    def test_comments_cannot_move_between_threads(self):
+        client = APIClient()
+        reply = self.replies[0]
+        response = client.patch(f'/api/post-comments/{reply.pk}/', {'parent_comment': self.top[2].pk,
+                                                                     'content': 'правка'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        reply.refresh_from_db()
+        self.assertEqual((reply.parent_comment_id, reply.content), (self.top[1].pk, 'правка'))
+        other = ContentPost.objects.create(author=self.user, title='Другой', content='...')
+        response = client.post('/api/post-comments/', {'post': other.pk, 'author': self.user.pk,
+                                                       'parent_comment': self.top[0].pk, 'content': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+        # Перенос в обход сигналов не ломает превью: строка без родителя в ветке пропускается
+        PostComment.objects.filter(pk=self.chain[0].pk).update(parent_comment=self.top[2])
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.pk}/comments/', {'page_size': 1}).status_code, 200)
+
+    def test_preview_skips_deleted_replies(self):
+        for reply in self.replies[:3]:
+            reply.delete()
+        self.comment(self.top[1], 'reply 5')
+        second = self.get(page_size=2, depth=1, replies=2)['results'][1]
+        self.assertEqual([reply['content'] for reply in second['replies']], ['reply 3', 'reply 4'])
+        more = self.client.get(second['more_replies']).json()
+        self.assertEqual([reply['content'] for reply in more['results']], ['reply 5'])
+
+    def test_positions_survive_deletes(self):
+        self.replies[0].delete()
+        self.replies[2].delete()
+        reply = self.comment(self.top[1], 'late')
+        self.assertEqual((reply.root_id, reply.depth, reply.ordinal), (self.top[1].pk, 1, 6))
+        self.top[1].refresh_from_db()
+        self.assertEqual(self.top[1].replies_count, 4)
+        self.chain[2].delete()
+        self.chain[1].refresh_from_db()
+        self.assertEqual(self.chain[1].replies_count, 0)
+
+        # Пересчет нумерует ответы заново, остальное совпадает с поддержанным сигналами
+        fields = ('root_id', 'depth', 'replies_count')
+        before = list(PostComment.objects.order_by('pk').values_list(*fields))
+        PostComment.objects.update(root=None, depth=0, ordinal=0, replies_count=0)
+        rebuild_comment_tree()
+        self.assertEqual(list(PostComment.objects.order_by('pk').values_list(*fields)), before)
+        self.assertEqual(list(self.top[1].postcomment_set.order_by('pk').values_list('ordinal', flat=True)), [1, 2, 3, 4])
+
+
+class SubscriptionSchedulerTest(TestCase):
+    def setUp(self):
+        author = User.objects.create(username='author', email='author@example.com')
+        self.fans = User.objects.bulk_create([
+            User(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(5)
+        ])
+        plan = SubscriptionPlan.objects.create(author=author, title='VIP', price_per_month='199.00')
+        closed = SubscriptionPlan.objects.create(author=author, title='Old', price_per_month='99.00',
+                                                 is_active=False)
+        self.now = timezone.now()
+        past, future = self.now - timedelta(days=3), self.now + timedelta(days=3)
+        self.subscriptions = UserSubscription.objects.bulk_create([
+            UserSubscription(subscriber=self.fans[0], plan=plan, starts_at=past, ends_at=past),
+            UserSubscription(subscriber=self.fans[1], plan=plan, starts_at=past, ends_at=past, auto_renew=False),
+            UserSubscription(subscriber=self.fans[2], plan=closed, starts_at=past, ends_at=past),
+            UserSubscription(subscriber=self.fans[3], plan=plan, starts_at=past, ends_at=future),
+            UserSubscription(subscriber=self.fans[4], plan=plan, starts_at=past, ends_at=past, status='canceled'),
+        ])
+
+    def test_expires_and_renews_in_batches(self):
+        out = StringIO()
+        call_command('process_subscriptions', '--batch-size', '2', stdout=out)
+        self.assertIn('Продлено: 1, завершено: 2', out.getvalue())
+        statuses = {s.subscriber_id: (s.status, s.ends_at > self.now)
+                    for s in UserSubscription.objects.all()}
+        self.assertEqual(statuses, {
+            self.fans[0].pk: ('active', True),
+            self.fans[1].pk: ('expired', False),
+            self.fans[2].pk: ('expired', False),
+            self.fans[3].pk: ('active', True),
+            self.fans[4].pk: ('canceled', False),
+        })
+        payment = PaymentTransaction.objects.get()
+        self.assertEqual((payment.user_id, payment.amount, payment.status), (self.fans[0].pk, 199, 'completed'))
+        self.assertEqual(payment.description, 'Продление подписки «VIP»')
+        self.assertEqual(EarningsDaily.objects.values_list('author_id', 'subscriptions_amount').get(),
+                         (payment.author_id, 199))
+        self.assertEqual(sorted(Notification.objects.values_list('user_id', 'type', 'title')), [
+            (self.fans[0].pk, 'subscription_renewed', 'Подписка «VIP» продлена'),
+            (self.fans[1].pk, 'subscription_expired', 'Подписка «VIP» закончилась'),
+            (self.fans[2].pk, 'subscription_expired', 'Подписка «Old» закончилась'),
+        ])
+        self.assertLess(abs(Notification.objects.first().created_at - self.now), timedelta(minutes=1))
+
+        # Повторный запуск ничего не делает
+        call_command('process_subscriptions', stdout=out)
+        self.assertIn('Продлено: 0, завершено: 0', out.getvalue())
+        self.assertEqual(PaymentTransaction.objects.count(), 1)
+
+
+class EarningsLedgerTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@example.com')
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+
+    def pay(self, kind, amount, status='completed'):
+        return PaymentTransaction.objects.create(user=self.buyer, author=self.author, type=kind,
+                                                 amount=amount, status=status)
+
+    def bucket(self):
+        return EarningsDaily.objects.filter(author=self.author).values_list(
+            'subscriptions_amount', 'purchases_amount', 'transactions_count').get()
+
+    def test_buckets_follow_transaction_status(self):
+        subscription = self.pay('subscription', '199.00')
+        purchase = self.pay('one_time_purchase', '299.00', status='pending')
+        self.pay('payout', '1000.00')
+        self.assertEqual(self.bucket(), (199, 0, 1))
+
+        purchase.status = 'completed'
+        purchase.save()
+        self.assertEqual(self.bucket(), (199, 299, 2))
+        subscription.status = 'refunded'
+        subscription.save()
+        purchase.delete()
+        self.assertEqual(self.bucket(), (0, 0, 0))
+
+    def test_author_derived_from_purchase(self):
+        post = ContentPost.objects.create(author=self.author, title='Платный', content='текст',
+                                          access_type='pay_per_view', price='299.00')
+        purchase = Purchase.objects.create(user=self.buyer, content_type='post', content_id=post.pk,
+                                           purchase_price='299.00')
+        client = APIClient()
+        payment = {'user': self.buyer.pk, 'type': 'one_time_purchase', 'amount': '299.00', 'status': 'completed'}
+        # Автора из запроса API не принимает
+        response = client.post('/api/payment-transactions/', {**payment, 'purchase': purchase.pk,
+                                                              'author': self.buyer.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['author'], self.author.pk)
+        self.assertEqual(self.bucket(), (0, 299, 1))
+        response = client.post('/api/payment-transactions/', {**payment, 'user': self.author.pk,
+                                                              'purchase': purchase.pk})
+        self.assertEqual(response.status_code, 400)
+
+    def test_link_payments_is_explicit(self):
+        post = ContentPost.objects.create(author=self.author, title='Платный', content='текст',
+                                          access_type='pay_per_view', price='299.00')
+        Purchase.objects.create(user=self.buyer, content_type='post', content_id=post.pk, purchase_price='299.00')
+        plan = SubscriptionPlan.objects.create(author=self.author, title='План', price_per_month='199.00')
+        # Подписка годичной давности: ее платеж за этот месяц с ней не связывается
+        UserSubscription.objects.create(subscriber=self.buyer, plan=plan,
+                                        starts_at=timezone.now() - timedelta(days=365),
+                                        ends_at=timezone.now() + timedelta(days=30))
+        other = User.objects.create(username='other', email='other@example.com')
+        # Старые платежи без ссылки и автора; у последнего автор задан и не перезаписывается
+        PaymentTransaction.objects.bulk_create([
+            PaymentTransaction(user=self.buyer, type='one_time_purchase', amount='299.00', status='completed'),
+            PaymentTransaction(user=self.buyer, type='subscription', amount='199.00', status='completed'),
+            PaymentTransaction(user=self.buyer, type='one_time_purchase', amount='299.00', status='completed',
+                               author=other),
+        ])
+        # Пересборка платежи не меняет и учитывает только платеж с автором
+        self.assertEqual(rebuild_earnings(), 1)
+        self.assertFalse(EarningsDaily.objects.filter(author=self.author).exists())
+
+        out = StringIO()
+        call_command('link_payments', dry_run=True, stdout=out)
+        self.assertIn('Связано с покупками: 1, с подписками: 0, проставлено авторов: 1', out.getvalue())
+        self.assertFalse(PaymentTransaction.objects.filter(purchase__isnull=False).exists())
+
+        call_command('link_payments', stdout=out)
+        self.assertEqual(self.bucket(), (0, 299, 1))
+        linked = PaymentTransaction.objects.get(purchase__isnull=False)
+        self.assertEqual((linked.author_id, linked.user_id), (self.author.pk, self.buyer.pk))
+        self.assertEqual(PaymentTransaction.objects.filter(author=other).count(), 1)
+        self.assertFalse(PaymentTransaction.objects.filter(subscription__isnull=False).exists())
+
+    def test_rebuild_and_report(self):
+        self.pay('subscription', '199.00')
+        self.pay('one_time_purchase', '299.00')
+        old = self.pay('subscription', '99.00')
+        # Платеж прошлого месяца; UPDATE идет мимо сигналов - корзины пересобираются
+        PaymentTransaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=40))
+        self.assertEqual(rebuild_earnings(chunk_size=1), 3)
+        self.assertEqual(EarningsDaily.objects.count(), 2)
+
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with self.assertNumQueries(2):
+            data = client.get('/api/earnings/', {'period': 'month'}).json()
+        self.assertEqual(data['totals'], {'subscriptions_amount': '298.00', 'purchases_amount': '299.00',
+                                          'total_amount': '597.00', 'transactions_count': 3})
+        self.assertEqual([point['total_amount'] for point in data['series']], ['99.00', '498.00'])
+        self.assertEqual(len(client.get('/api/earnings/').json()['series']), 1)
+        self.assertEqual(client.get('/api/earnings/', {'author': self.buyer.pk}).status_code, 403)
+        self.assertEqual(client.get('/api/earnings/', {'from': 'вчера'}).status_code, 400)
+
+
+class StreamingExportTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        PaymentTransaction.objects.bulk_create([
+            PaymentTransaction(user=self.buyer if i % 2 else self.admin, type='subscription', amount='199.00',
+                               status='completed' if i % 3 else 'failed', description=f'Платеж {i}')
+            for i in range(30)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get('/api/payment-transactions/export/', params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_and_ndjson_with_filters(self):
+        # Строки читаются курсором порциями, весь поток - один запрос
+        with patch('partners.exports.FLUSH_BYTES', 100), self.assertNumQueries(1):
+            lines = self.export(status='completed', user=self.buyer.pk).splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['transaction_id', 'created_at', 'user_id'])
+        self.assertEqual(len(lines) - 1, 10)
+
+        rows = [json.loads(line) for line in self.export(output='ndjson').splitlines()]
+        self.assertEqual(len(rows), 30)
+        self.assertEqual((rows[0]['amount'], rows[0]['description']), ('199.00', 'Платеж 0'))
+        today = timezone.localdate()
+        self.assertEqual(self.export(to=str(today - timedelta(days=1))).splitlines(), [lines[0]])
+
+    def test_asgi_streams_chunks_and_escapes_formulas(self):
+        PaymentTransaction.objects.create(user=self.buyer, type='subscription', amount='1.00', status='completed',
+                                          description='=HYPERLINK("http://example.com")')
+
+        async def export():
+            client = AsyncClient()
+            await client.aforce_login(self.admin)
+            response = await client.get('/api/payment-transactions/export/', {'user': self.buyer.pk})
+            # Под ASGI куски отдаются асинхронным итератором по одному, а не собираются в список
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        with patch('partners.exports.FLUSH_BYTES', 100):
+            lines = async_to_sync(export)().splitlines()
+        self.assertEqual(len(lines) - 1, 16)
+        self.assertTrue(lines[-1].endswith('"\'=HYPERLINK(""http://example.com"")"'))
+
+    def test_admin_only(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/purchases/export/').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get('/api/purchases/export/', {'output': 'xml'}).status_code, 400)
+        out = StringIO()
+        call_command('export_data', 'transactions', '--output', 'ndjson', '--status', 'failed', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 10)
+
+
+class BulkWriteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='owner', email='owner@example.com')
+        self.others = [User.objects.create(username=f'other{i}', email=f'other{i}@example.com') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, prefix, items, method='post'):
+        response = getattr(self.client, method)(f'/api/{prefix}/bulk/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def followers(self, user):
+        return ProfileStats.objects.get(user=user).followers_count
+
+    def test_follows_report_each_item(self):
+        first, second, third = self.others
+        Follow.objects.create(follower=self.user, following=second)
+        items = [{'following': first.pk}, {'following': second.pk}, {'following': first.pk},
+                 {'following': self.user.pk}, {'following': 10 ** 9}, {'following': 'x'}, {'following': third.pk}]
+        # Цели, вставка и счетчики - независимо от длины списка (плюс точка сохранения)
+        with self.assertNumQueries(5):
+            data = self.bulk('follows', items)
+        self.assertEqual([item['status'] for item in data['results']],
+                         ['created', 'exists', 'duplicate', 'invalid', 'invalid', 'invalid', 'created'])
+        self.assertEqual(data['summary'], {'created': 2, 'exists': 1, 'duplicate': 1, 'invalid': 3})
+        self.assertEqual(data['results'][4]['errors'], {'following': ['Объект не найден']})
+        self.assertEqual([self.followers(user) for user in self.others], [1, 1, 1])
+
+        data = self.bulk('follows', [{'following': first.pk}, {'following': first.pk + 100}], method='delete')
+        self.assertEqual(data['summary'], {'deleted': 1, 'not_found': 1})
+        self.assertEqual([self.followers(user) for user in self.others], [0, 1, 1])
+        self.assertEqual(Follow.objects.filter(follower=self.user).count(), 2)
+
+    def test_concurrent_duplicates_counted_once(self):
+        post = ContentPost.objects.create(author=self.others[0], title='Пост', content='Текст')
+        validate = BulkWriter.validate
+
+        # Такой же запрос успевает вставить лайк между проверкой и записью
+        def racing_validate(writer, *args, **kwargs):
+            result = validate(writer, *args, **kwargs)
+            PostLike.objects.bulk_create([PostLike(post=post, user=self.user)])
+            return result
+
+        with patch.object(BulkWriter, 'validate', racing_validate):
+            data = self.bulk('post-likes', [{'post': post.pk}])
+        self.assertEqual(data['summary'], {'exists': 1})
+        self.assertEqual(ContentPost.objects.get(pk=post.pk).likes_count, 0)
+
+        # Повторы (клиент переотправил запрос) не сдвигают счетчик второй раз
+        other = ContentPost.objects.create(author=self.others[0], title='Пост 2', content='Текст')
+        for expected in ({'created': 1}, {'exists': 1}):
+            self.assertEqual(self.bulk('post-likes', [{'post': other.pk}])['summary'], expected)
+        for expected in ({'deleted': 1}, {'not_found': 1}):
+            self.assertEqual(self.bulk('post-likes', [{'post': other.pk}], method='delete')['summary'], expected)
+        self.assertEqual(ContentPost.objects.get(pk=other.pk).likes_count, 0)
+
+    def test_likes_and_games_keep_derived_fields(self):
+        posts = [ContentPost.objects.create(author=self.others[0], title=f'Пост {i}', content='Текст') for i in range(2)]
+        PostLike.objects.create(post=posts[0], user=self.others[1])
+        self.bulk('post-likes', [{'post': post.pk} for post in posts])
+        self.assertEqual([post.likes_count for post in ContentPost.objects.order_by('pk')], [2, 1])
+        self.bulk('post-likes', [{'post': posts[0].pk}], method='delete')
+        self.assertEqual(ContentPost.objects.get(pk=posts[0].pk).likes_count, 1)
+
+        game = Game.objects.create(name='Valorant')
+        GameRank.objects.create(game=game, label='Gold', ordinal=3)
+        data = self.bulk('user-games', [{'game': game.pk, 'current_rank': 'gold', 'playtime_hours': 10},
+                                        {'game': game.pk + 1, 'playtime_hours': -1}])
+        self.assertEqual(data['summary'], {'created': 1, 'invalid': 1})
+        self.assertIn('playtime_hours', data['results'][1]['errors'])
+        user_game = UserGame.objects.get(user=self.user)
+        self.assertEqual((user_game.rank_ordinal, user_game.playtime_hours), (3, 10))
+
+        Achievement.objects.create(user_game=user_game, title='Первая победа')
+        data = self.bulk('user-games', [{'game': game.pk}], method='delete')
+        self.assertEqual(data['summary'], {'deleted': 1})
+        self.assertFalse(Achievement.objects.exists())
+
+    def test_rejects_bad_payloads(self):
+        for items in (None, [], [{'following': 1}] * (MAX_ITEMS + 1)):
+            response = self.client.post('/api/follows/bulk/', {'items': items}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post('/api/follows/bulk/', {'items': []}, format='json').status_code, 403)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 
@@ -26,5 +26,12 @@ router.register(r'post-comments', views.PostCommentViewSet)
 router.register(r'payment-transactions', views.PaymentTransactionViewSet)
 
 urlpatterns = [
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('earnings/', views.EarningsView.as_view(), name='earnings'),
+    # Асинхронные версии эндпоинтов чтения (для ASGI)
+    path('async/profiles/', async_views.profile_list, name='async-profile-list'),
+    path('async/profiles/<int:pk>/', async_views.profile_detail, name='async-profile-detail'),
+    path('async/posts/', async_views.post_list, name='async-post-list'),
+    path('async/games/', async_views.game_list, name='async-game-list'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
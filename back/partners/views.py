@@ -1,68 +1,238 @@
+import math
+from datetime import date, timedelta
+
 from rest_framework import viewsets, permissions
-from django.db.models import Q
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.contrib.auth import get_user_model
 from .models import *
 from .serializers import *
+from .pagination import (
+    KeysetPagination, decode_cursor, encode_cursor, keyset_filter, ordering_fields, page_size_from,
+)
+from .search import filter_profiles, search_profiles, search_games
+from .bulk import FollowBulkWriter, PostLikeBulkWriter, UserGameBulkWriter
+from .comments import attach_replies, preview_size
+from .earnings import earnings_report
+from .exports import OUTPUTS, aiter_export, stream_export
+from .feed import FEED_ORDERING, feed_page, feed_position
+from .matchmaking import find_partners
+from .ranks import filter_by_rank
+from .caching import CachedResponseMixin
+from .fieldsets import ValuesListMixin
+from .instrumentation import registry
+from .renderers import PrometheusTextRenderer
 
 User = get_user_model()
 
-class UserViewSet(viewsets.ModelViewSet):
+def day_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: 'Ожидается дата ГГГГ-ММ-ДД'})
+    return day
+
+class ExportMixin:
+    """
+    Потоковая выгрузка для финансов (partners.exports), только для
+    администраторов: ?output=csv|ndjson, ?from=/?to= (ГГГГ-ММ-ДД), ?status=, ?user=.
+    """
+    export_kind = None
+    
+    @action(detail=False, permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        params = request.query_params
+        output = params.get('output', 'csv')
+        if output not in OUTPUTS:
+            raise ValidationError({'output': f'Ожидается одно из: {", ".join(OUTPUTS)}'})
+        user_id = params.get('user')
+        if user_id and not user_id.isdigit():
+            raise ValidationError({'user': 'Ожидается ID пользователя'})
+        rows = stream_export(
+            self.export_kind, output,
+            date_from=day_param(params, 'from'), date_to=day_param(params, 'to'),
+            status=params.get('status'), user_id=user_id,
+        )
+        if isinstance(request._request, ASGIRequest):
+            rows = aiter_export(rows)
+        response = StreamingHttpResponse(rows, content_type=OUTPUTS[output])
+        response['Content-Disposition'] = f'attachment; filename="{self.export_kind}.{output}"'
+        return response
+
+class BulkWriteMixin:
+    """
+    Пакетная запись связей текущего пользователя (partners.bulk): POST
+    создает, DELETE удаляет; тело - {"items": [...]}, в ответе - итог по
+    каждому элементу (created/exists/deleted/not_found/duplicate/invalid).
+    """
+    bulk_writer = None
+    
+    @action(detail=False, methods=['post', 'delete'])
+    def bulk(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        items = request.data.get('items') if isinstance(request.data, dict) else None
+        writer = self.bulk_writer(request.user)
+        if request.method == 'DELETE':
+            return Response(writer.delete(items))
+        return Response(writer.create(items))
+
+class UserViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = ProfileWithGamesSerializer  # Используем новый сериализатор
     permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    
+    # Профиль включает игры пользователя, поэтому зависит и от каталога игр
+    def cache_dependencies(self):
+        if self.action == 'retrieve':
+            return [f'user:{self.kwargs["pk"]}', 'games']
+        return ['profiles', 'games']
+    
+    def get_profiles_queryset(self):
+        return UserProfile.objects.select_related('user', 'user__stats').defer(
+            'search_vector'
+        ).prefetch_related(
+            Prefetch(
+                'user__usergame_set',
+                queryset=UserGame.objects.select_related('game'),
+                to_attr='prefetched_games',
+            )
+        )
     
     def get_queryset(self):
-        queryset = UserProfile.objects.all()
+        queryset = self.get_profiles_queryset()
         
         # Фильтрация по поиску
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(user__username__icontains=search) |
-                Q(user__user_games__game__name__icontains=search)
-            ).distinct()
+            queryset = filter_profiles(queryset, search)
+        
+        # Фильтрация по игре и диапазону рангов в ней
+        params = self.request.query_params
+        game = params.get('game')
+        if game and not game.isdigit():
+            raise ValidationError({'game': 'Ожидается ID игры'})
+        queryset = filter_by_rank(
+            queryset, game, params.get('rank'), params.get('rank_min'), params.get('rank_max'),
+        )
         
-        # Фильтрация по игре
-        game = self.request.query_params.get('game')
-        if game:
-            queryset = queryset.filter(user__user_games__game_id=game)
+        # Фильтрация по минимальному рейтингу
+        min_rating = self.request.query_params.get('min_rating')
+        if min_rating:
+            try:
+                min_rating = float(min_rating)
+            except ValueError:
+                min_rating = None
+            if min_rating is None or not math.isfinite(min_rating):
+                raise ValidationError({'min_rating': 'Ожидается число'})
+            queryset = queryset.filter(user__stats__rating_avg__gte=min_rating)
         
-        # Сортировка
+        # Сортировка; последний ключ уникален - на нем держится курсорная пагинация
         sort_by = self.request.query_params.get('sort_by')
+        # Профиль без строки статистики сортируется как нулевой - и в запросе, и в курсоре
         if sort_by == 'rating':
-            # Сортировка по рейтингу (пока заглушка)
-            queryset = queryset.order_by('-user__username')
+            queryset = queryset.annotate(
+                stats_rating=Coalesce('user__stats__rating_avg', 0.0)
+            ).order_by('-stats_rating', '-user_id')
         elif sort_by == 'followers':
-            # Сортировка по подписчикам (пока заглушка)
-            queryset = queryset.order_by('-user__username')
+            queryset = queryset.annotate(
+                stats_followers=Coalesce('user__stats__followers_count', 0)
+            ).order_by('-stats_followers', '-user_id')
         elif sort_by == 'newest':
-            queryset = queryset.order_by('-user__created_at')
+            queryset = queryset.order_by('-user__created_at', '-user_id')
+        elif sort_by == 'rank' and game:
+            queryset = queryset.annotate(
+                game_rank=Coalesce('user__usergame__rank_ordinal', -1)
+            ).order_by('-game_rank', '-user_id')
         else:
-            queryset = queryset.order_by('-user__username')
+            queryset = queryset.order_by('-user__username', '-user_id')
         
         return queryset
+    
+    # Поиск с ранжированием по релевантности для подсказок при наборе
+    @action(detail=False)
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+        limit = page_size_from(request, KeysetPagination.page_size, KeysetPagination.max_page_size)
+        queryset = search_profiles(self.get_profiles_queryset(), query)[:limit]
+        return Response(self.get_serializer(queryset, many=True).data)
+    
+    # Подбор напарников для игрока: /api/profiles/<id>/matches/?game=&k=
+    @action(detail=True)
+    def matches(self, request, pk=None):
+        user = get_object_or_404(User, pk=pk)
+        game = request.query_params.get('game')
+        if game is not None and not game.isdigit():
+            raise ValidationError({'game': 'Ожидается ID игры'})
+        k = page_size_from(request, 20, KeysetPagination.max_page_size, param='k')
+        matches = find_partners(user.pk, k=k, game_id=int(game) if game else None)
+        profiles = self.get_profiles_queryset().in_bulk([user_id for user_id, _, _ in matches])
+        results = []
+        for user_id, score, shared_games in matches:
+            if user_id in profiles:
+                data = self.get_serializer(profiles[user_id]).data
+                data['match'] = {'score': score, 'shared_games': shared_games}
+                results.append(data)
+        return Response(results)
 
 class UserSocialAuthViewSet(viewsets.ModelViewSet):
     queryset = UserSocialAuth.objects.all()
     serializer_class = UserSocialAuthSerializer
     permission_classes = [permissions.AllowAny]
 
-class GameViewSet(viewsets.ModelViewSet):
+class GameViewSet(CachedResponseMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Game.objects.all()
     serializer_class = GameSerializer
     permission_classes = [permissions.AllowAny]
+    
+    def cache_dependencies(self):
+        return ['games']
+    
+    @action(detail=False)
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+        queryset = search_games(query)[:20]
+        return Response(self.get_serializer(queryset, many=True).data)
+    
+    # Таблица рангов игры снизу вверх
+    @action(detail=True)
+    def ranks(self, request, pk=None):
+        ranks = GameRank.objects.filter(game_id=pk)
+        return Response(GameRankSerializer(ranks, many=True).data)
 
-class UserGameViewSet(viewsets.ModelViewSet):
-    queryset = UserGame.objects.all()
+class UserGameViewSet(BulkWriteMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = UserGame.objects.select_related('user', 'game')
     serializer_class = UserGameSerializer
     permission_classes = [permissions.AllowAny]
+    bulk_writer = UserGameBulkWriter
 
-class AchievementViewSet(viewsets.ModelViewSet):
+class AchievementViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = Achievement.objects.all()
     serializer_class = AchievementSerializer
     permission_classes = [permissions.AllowAny]
@@ -73,22 +243,65 @@ class ContentPostViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
     
     def get_queryset(self):
-        queryset = ContentPost.objects.all()
+        queryset = ContentPost.objects.select_related('author')
         author_id = self.request.query_params.get('author')
         if author_id:
             queryset = queryset.filter(author_id=author_id)
         return queryset
+    
+    # Лента постов авторов, на которых подписан пользователь, с курсором
+    @action(detail=False)
+    def feed(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        limit = page_size_from(request, KeysetPagination.page_size, KeysetPagination.max_page_size)
+        cursor = request.query_params.get('cursor')
+        position = decode_cursor(cursor, ordering_fields(FeedEntry, FEED_ORDERING)) if cursor else None
+        posts, has_more = feed_page(request.user, limit, position)
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', encode_cursor(feed_position(posts[-1])))
+        return Response({
+            'next': next_url,
+            'results': self.get_serializer(posts, many=True).data,
+        })
+    
+    # Ветки комментариев: страница комментариев верхнего уровня с превью
+    # ответов (?depth=&replies=) или, с ?parent=, следующие ответы на
+    # комментарий. Запросов всегда три, какой бы глубокой ни была ветка
+    @action(detail=True)
+    def comments(self, request, pk=None):
+        comments = PostComment.objects.filter(post_id=pk).select_related('author').order_by('comment_id')
+        parent_id = request.query_params.get('parent')
+        if parent_id:
+            if not parent_id.isdigit():
+                raise ValidationError({'parent': 'Ожидается ID комментария'})
+            get_object_or_404(PostComment.objects.only('pk'), pk=parent_id, post_id=pk)
+            comments = comments.filter(parent_comment_id=parent_id)
+            depth, replies = 0, 0
+        else:
+            get_object_or_404(ContentPost.objects.only('pk'), pk=pk)
+            comments = comments.filter(parent_comment__isnull=True)
+            depth, replies = preview_size(request)
+        paginator = KeysetPagination()
+        page = attach_replies(paginator.paginate_queryset(comments, request), request, depth, replies)
+        serializer = PostCommentTreeSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
 class UserGalleryViewSet(viewsets.ModelViewSet):
     queryset = UserGallery.objects.all()
     serializer_class = UserGallerySerializer
     permission_classes = [permissions.AllowAny]
 
-class SubscriptionPlanViewSet(viewsets.ModelViewSet):
+class SubscriptionPlanViewSet(CachedResponseMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = SubscriptionPlan.objects.all()
     serializer_class = SubscriptionPlanSerializer
     permission_classes = [permissions.AllowAny]
     
+    def cache_dependencies(self):
+        return ['plans']
+    
     def get_queryset(self):
         queryset = SubscriptionPlan.objects.all()
         author_id = self.request.query_params.get('author')
@@ -101,20 +314,98 @@ class UserSubscriptionViewSet(viewsets.ModelViewSet):
     serializer_class = UserSubscriptionSerializer
     permission_classes = [permissions.AllowAny]
 
-class PurchaseViewSet(viewsets.ModelViewSet):
+class PurchaseViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = Purchase.objects.all()
     serializer_class = PurchaseSerializer
     permission_classes = [permissions.AllowAny]
+    export_kind = 'purchases'
 
-class FollowViewSet(viewsets.ModelViewSet):
+class FollowViewSet(BulkWriteMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
     permission_classes = [permissions.AllowAny]
+    bulk_writer = FollowBulkWriter
 
 class ConversationViewSet(viewsets.ModelViewSet):
     queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
     permission_classes = [permissions.AllowAny]
+    history_page_size = 50
+    
+    def get_participant(self, request, pk):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        return get_object_or_404(ConversationParticipant, conversation_id=pk, user=request.user)
+    
+    # Входящие: переписки пользователя с последним сообщением и числом
+    # непрочитанных, все считается коррелированными подзапросами в одном SELECT
+    @action(detail=False)
+    def inbox(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        last = Message.objects.filter(
+            conversation=OuterRef('conversation')
+        ).order_by('-created_at', '-message_id')
+        unread = Message.objects.filter(
+            conversation=OuterRef('conversation'),
+            created_at__gt=OuterRef('read_marker'),
+        ).exclude(sender=OuterRef('user')).order_by().values('conversation').annotate(
+            total=Count('*')
+        ).values('total')
+        queryset = ConversationParticipant.objects.filter(user=request.user).select_related(
+            'conversation'
+        ).annotate(
+            read_marker=Coalesce('last_read_at', 'joined_at'),
+            last_message_id=Subquery(last.values('message_id')[:1]),
+            last_message_sender=Subquery(last.values('sender_id')[:1]),
+            last_message_content=Subquery(last.values('content')[:1]),
+            last_message_at=Subquery(last.values('created_at')[:1]),
+            unread_count=Coalesce(Subquery(unread), 0),
+        ).order_by(F('last_message_at').desc(nulls_last=True), '-conversation_id')
+        return Response(ConversationInboxSerializer(queryset, many=True).data)
+    
+    # История переписки окнами: ?before=<курсор> - более старые сообщения,
+    # ?after=<курсор> - более новые, без курсора - последние сообщения.
+    # Ключ (created_at, message_id) покрыт индексом message_history_idx
+    @action(detail=True)
+    def messages(self, request, pk=None):
+        self.get_participant(request, pk)
+        limit = page_size_from(request, self.history_page_size, KeysetPagination.max_page_size, 'limit')
+        queryset = Message.objects.filter(conversation_id=pk)
+        
+        after = request.query_params.get('after')
+        before = request.query_params.get('before')
+        if after:
+            ordering = ('created_at', 'message_id')
+            queryset = queryset.filter(keyset_filter(ordering, decode_cursor(after, ordering_fields(Message, ordering))))
+        else:
+            ordering = ('-created_at', '-message_id')
+            if before:
+                queryset = queryset.filter(keyset_filter(ordering, decode_cursor(before, ordering_fields(Message, ordering))))
+        
+        rows = list(queryset.order_by(*ordering)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not after:
+            rows.reverse()
+        
+        def cursor(message):
+            return encode_cursor([message.created_at, message.message_id])
+        
+        return Response({
+            # Курсор более старой части истории есть только если она существует;
+            # курсор новых сообщений отдается всегда - для дозагрузки
+            'before': cursor(rows[0]) if rows and (has_more or after) else None,
+            'after': cursor(rows[-1]) if rows else after,
+            'results': MessageSerializer(rows, many=True).data,
+        })
+    
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        participant = self.get_participant(request, pk)
+        participant.last_read_at = timezone.now()
+        participant.save(update_fields=['last_read_at'])
+        return Response({'last_read_at': participant.last_read_at})
 
 class ConversationParticipantViewSet(viewsets.ModelViewSet):
     queryset = ConversationParticipant.objects.all()
@@ -125,28 +416,115 @@ class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [permissions.AllowAny]
+    
+    # Только сообщения из переписок текущего пользователя
+    def get_queryset(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return Message.objects.none()
+        queryset = Message.objects.filter(
+            conversation__conversationparticipant__user=user
+        ).order_by('-created_at', '-message_id')
+        conversation_id = self.request.query_params.get('conversation')
+        if conversation_id:
+            queryset = queryset.filter(conversation_id=conversation_id)
+        return queryset
 
 class NotificationViewSet(viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.AllowAny]
+    
+    # Только уведомления текущего пользователя
+    def get_queryset(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return Notification.objects.none()
+        queryset = Notification.objects.filter(user=user).order_by('-created_at')
+        if self.request.query_params.get('unread'):
+            queryset = queryset.filter(is_read=False)
+        return queryset
+    
+    # Счетчик по частичному индексу notification_unread_idx
+    @action(detail=False)
+    def unread_count(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        count = Notification.objects.filter(user=request.user, is_read=False).count()
+        return Response({'unread_count': count})
+    
+    # Массовая отметка прочитанными: {"ids": [...]} или все непрочитанные
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        queryset = Notification.objects.filter(user=request.user, is_read=False)
+        ids = request.data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+                raise ValidationError({'ids': 'Ожидается список идентификаторов'})
+            queryset = queryset.filter(notification_id__in=ids)
+        return Response({'updated': queryset.update(is_read=True)})
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [permissions.AllowAny]
 
-class PostLikeViewSet(viewsets.ModelViewSet):
+class PostLikeViewSet(BulkWriteMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = PostLike.objects.all()
     serializer_class = PostLikeSerializer
     permission_classes = [permissions.AllowAny]
+    bulk_writer = PostLikeBulkWriter
 
-class PostCommentViewSet(viewsets.ModelViewSet):
+class PostCommentViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = PostComment.objects.all()
     serializer_class = PostCommentSerializer
     permission_classes = [permissions.AllowAny]
 
-class PaymentTransactionViewSet(viewsets.ModelViewSet):
+class PaymentTransactionViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = PaymentTransaction.objects.all()
     serializer_class = PaymentTransactionSerializer
-    permission_classes = [permissions.AllowAny]
\ No newline at end of file
+    permission_classes = [permissions.AllowAny]
+    export_kind = 'transactions'
+
+class MetricsView(APIView):
+    """Метрики запросов процесса (partners.instrumentation) для Prometheus, только для администраторов."""
+    # Basic - для сборщика метрик, у которого нет сессии
+    authentication_classes = [SessionAuthentication, BasicAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusTextRenderer]
+
+    def get(self, request):
+        return Response(registry.render())
+
+class EarningsView(APIView):
+    """
+    Доход автора из дневных корзин (partners.earnings): ?period=day|month,
+    ?from=/?to= (ГГГГ-ММ-ДД), по умолчанию 30 дней или 12 месяцев до сегодня.
+    Администратор может запросить доход другого автора через ?author=.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        params = request.query_params
+        author_id = request.user.pk
+        if params.get('author'):
+            if not request.user.is_staff:
+                raise PermissionDenied()
+            if not params['author'].isdigit():
+                raise ValidationError({'author': 'Ожидается ID пользователя'})
+            author_id = int(params['author'])
+        period = params.get('period', 'day')
+        if period not in ('day', 'month'):
+            raise ValidationError({'period': 'Ожидается day или month'})
+        
+        date_to = day_param(params, 'to') or timezone.localdate()
+        date_from = day_param(params, 'from')
+        if date_from is None:
+            date_from = date_to - timedelta(days=29)
+            if period == 'month':
+                months = date_to.year * 12 + date_to.month - 1 - 11
+                date_from = date(months // 12, months % 12 + 1, 1)
+        return Response(earnings_report(author_id, date_from, date_to, period))
+    
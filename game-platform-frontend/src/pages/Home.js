@@ -1,16 +1,17 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import ProfileCard from '../components/profiles/ProfileCard';
-import { getProfiles, getGames } from '../services/api';
+import { getProfiles, getGames, getGameRanks } from '../services/api';
 import { FaSearch, FaGamepad, FaSort, FaTrophy, FaTimes } from 'react-icons/fa';
 import './Home.css';
 
 const Home = () => {
   const [profiles, setProfiles] = useState([]);
   const [games, setGames] = useState([]);
+  const [ranks, setRanks] = useState([]);
   const [loading, setLoading] = useState(true);
   const [loadingMore, setLoadingMore] = useState(false);
   const [hasMore, setHasMore] = useState(true);
-  const [page, setPage] = useState(1);
+  const [nextCursor, setNextCursor] = useState(null);
   const [filters, setFilters] = useState({
     game: '',
     sortBy: 'rating',
@@ -24,6 +25,15 @@ const Home = () => {
     loadGames();
   }, []);
 
+  // Ранги выбранной игры для фильтра
+  useEffect(() => {
+    if (filters.game) {
+      getGameRanks(filters.game).then(setRanks);
+    } else {
+      setRanks([]);
+    }
+  }, [filters.game]);
+
   const loadGames = async () => {
     try {
       const gamesData = await getGames();
@@ -33,26 +43,23 @@ const Home = () => {
     }
   };
 
-  const loadProfiles = useCallback(async (pageNum = 1, reset = false) => {
+  const loadProfiles = useCallback(async (cursor = null, reset = false) => {
     try {
-      if (pageNum === 1) {
+      if (!cursor) {
         setLoading(true);
       } else {
         setLoadingMore(true);
       }
 
-      const profilesData = await getProfiles({
+      const { results, nextCursor: cursorAfter } = await getProfiles({
         ...filters,
-        page: pageNum,
+        cursor,
         page_size: 12
       });
 
-      if (profilesData.length === 0) {
-        setHasMore(false);
-      } else {
-        setProfiles(prev => reset ? profilesData : [...prev, ...profilesData]);
-        setPage(pageNum);
-      }
+      setProfiles(prev => reset ? results : [...prev, ...results]);
+      setNextCursor(cursorAfter);
+      setHasMore(Boolean(cursorAfter));
     } catch (error) {
       console.error('Ошибка загрузки профилей:', error);
     } finally {
@@ -63,21 +70,24 @@ const Home = () => {
 
   // Загрузка профилей при изменении фильтров
   useEffect(() => {
-    setPage(1);
+    setNextCursor(null);
     setProfiles([]);
-    loadProfiles(1, true);
+    setHasMore(true);
+    loadProfiles(null, true);
   }, [filters, loadProfiles]);
 
   const handleLoadMore = useCallback(() => {
     if (!loadingMore && hasMore) {
-      loadProfiles(page + 1);
+      loadProfiles(nextCursor);
     }
-  }, [loadingMore, hasMore, page, loadProfiles]);
+  }, [loadingMore, hasMore, nextCursor, loadProfiles]);
 
   const handleFilterChange = (key, value) => {
     setFilters(prev => ({
       ...prev,
-      [key]: value
+      [key]: value,
+      // ранги у каждой игры свои
+      ...(key === 'game' ? { rank: '' } : {})
     }));
   };
 
@@ -223,11 +233,19 @@ const Home = () => {
                   className="filter-select"
                 >
                   <option value="">Любой ранг</option>
-                  <option value="beginner">Начинающий</option>
-                  <option value="intermediate">Средний</option>
-                  <option value="advanced">Продвинутый</option>
-                  <option value="expert">Эксперт</option>
-                  <option value="pro">Профессионал</option>
+                  {ranks.length > 0 ? ranks.map(rank => (
+                    <option key={rank.rank_id} value={rank.label}>
+                      {rank.label}
+                    </option>
+                  )) : (
+                    <>
+                      <option value="beginner">Начинающий</option>
+                      <option value="intermediate">Средний</option>
+                      <option value="advanced">Продвинутый</option>
+                      <option value="expert">Эксперт</option>
+                      <option value="pro">Профессионал</option>
+                    </>
+                  )}
                 </select>
               </div>
             </div>
@@ -282,7 +300,7 @@ const Home = () => {
           </div>
         </div>
         
-        {loading && page === 1 ? (
+        {loading && !nextCursor ? (
           <div className="loading">
             <div className="loading-spinner"></div>
             <p>Загрузка игроков...</p>
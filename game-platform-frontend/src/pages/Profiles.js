@@ -1,16 +1,17 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { Link } from 'react-router-dom';
 import ProfileCard from '../components/profiles/ProfileCard';
-import { getProfiles, getGames } from '../services/api';
+import { getProfiles, getGames, getGameRanks } from '../services/api';
 import { FaSearch, FaGamepad, FaSort, FaTrophy, FaTimes } from 'react-icons/fa';
 import './Profiles.css';
 
 const Profiles = () => {
   const [profiles, setProfiles] = useState([]);
   const [games, setGames] = useState([]);
+  const [ranks, setRanks] = useState([]);
   const [loading, setLoading] = useState(true);
   const [hasMore, setHasMore] = useState(true);
-  const [page, setPage] = useState(1);
+  const [nextCursor, setNextCursor] = useState(null);
   const [filters, setFilters] = useState({
     game: '',
     sortBy: 'rating',
@@ -25,6 +26,15 @@ const Profiles = () => {
     loadGames();
   }, []);
 
+  // Ранги выбранной игры для фильтра
+  useEffect(() => {
+    if (filters.game) {
+      getGameRanks(filters.game).then(setRanks);
+    } else {
+      setRanks([]);
+    }
+  }, [filters.game]);
+
   const loadGames = async () => {
     try {
       const gamesData = await getGames();
@@ -34,30 +44,26 @@ const Profiles = () => {
     }
   };
 
-  const loadProfiles = useCallback(async (pageNum = 1, reset = false) => {
+  const loadProfiles = useCallback(async (cursor = null, reset = false) => {
     try {
-      if (pageNum === 1) {
+      if (!cursor) {
         setLoading(true);
       }
 
-      const profilesData = await getProfiles({
+      const { results, nextCursor: cursorAfter } = await getProfiles({
         ...filters,
-        page: pageNum,
+        cursor,
         page_size: PROFILES_PER_PAGE
       });
 
-      if (profilesData.length < PROFILES_PER_PAGE) {
-        setHasMore(false);
-      } else {
-        setHasMore(true);
-      }
+      setHasMore(Boolean(cursorAfter));
 
       if (reset) {
-        setProfiles(profilesData);
+        setProfiles(results);
       } else {
-        setProfiles(prev => [...prev, ...profilesData]);
+        setProfiles(prev => [...prev, ...results]);
       }
-      setPage(pageNum);
+      setNextCursor(cursorAfter);
     } catch (error) {
       console.error('Ошибка загрузки профилей:', error);
     } finally {
@@ -67,22 +73,24 @@ const Profiles = () => {
 
   // Загрузка профилей при изменении фильтров
   useEffect(() => {
-    setPage(1);
+    setNextCursor(null);
     setProfiles([]);
     setHasMore(true);
-    loadProfiles(1, true);
+    loadProfiles(null, true);
   }, [filters, loadProfiles]);
 
   const handleLoadMore = () => {
     if (hasMore) {
-      loadProfiles(page + 1, false);
+      loadProfiles(nextCursor, false);
     }
   };
 
   const handleFilterChange = (key, value) => {
     setFilters(prev => ({
       ...prev,
-      [key]: value
+      [key]: value,
+      // ранги у каждой игры свои
+      ...(key === 'game' ? { rank: '' } : {})
     }));
   };
 
@@ -189,11 +197,19 @@ const Profiles = () => {
                   className="filter-select"
                 >
                   <option value="">Любой ранг</option>
-                  <option value="beginner">Начинающий</option>
-                  <option value="intermediate">Средний</option>
-                  <option value="advanced">Продвинутый</option>
-                  <option value="expert">Эксперт</option>
-                  <option value="pro">Профессионал</option>
+                  {ranks.length > 0 ? ranks.map(rank => (
+                    <option key={rank.rank_id} value={rank.label}>
+                      {rank.label}
+                    </option>
+                  )) : (
+                    <>
+                      <option value="beginner">Начинающий</option>
+                      <option value="intermediate">Средний</option>
+                      <option value="advanced">Продвинутый</option>
+                      <option value="expert">Эксперт</option>
+                      <option value="pro">Профессионал</option>
+                    </>
+                  )}
                 </select>
               </div>
             </div>
@@ -246,7 +262,7 @@ const Profiles = () => {
           )}
         </div>
         
-        {loading && page === 1 ? (
+        {loading && !nextCursor ? (
           <div className="loading">
             <div className="loading-spinner"></div>
             <p>Загрузка партнеров...</p>
@@ -23,7 +23,7 @@ export const getProfiles = async (filters = {}) => {
   try {
     const response = await api.get('/profiles/', { 
       params: {
-        page: filters.page || 1,
+        cursor: filters.cursor,
         page_size: filters.page_size || 12,
         game: filters.game,
         sort_by: filters.sortBy,
@@ -32,10 +32,13 @@ export const getProfiles = async (filters = {}) => {
         has_achievements: filters.achievements
       }
     });
-    return response.data;
+    // Курсорная пагинация: курсор следующей страницы берем из ссылки next
+    const { results, next } = response.data;
+    const nextCursor = next ? new URL(next, window.location.origin).searchParams.get('cursor') : null;
+    return { results, nextCursor };
   } catch (error) {
     console.error('Ошибка загрузки профилей:', error);
-    return [];
+    return { results: [], nextCursor: null };
   }
 };
 
@@ -60,6 +63,17 @@ export const getGames = async () => {
   }
 };
 
+// Таблица рангов игры (снизу вверх)
+export const getGameRanks = async (gameId) => {
+  try {
+    const response = await api.get(`/games/${gameId}/ranks/`);
+    return response.data;
+  } catch (error) {
+    console.error('Ошибка загрузки рангов:', error);
+    return [];
+  }
+};
+
 // Posts
 export const getPosts = async (userId) => {
   try {